@@ -0,0 +1,114 @@
+"""
+Benchmark for parallel CSV obfuscation and its chunk transports.
+
+Measures, on a synthetic CSV:
+
+- end-to-end time of obfuscate_csv (one process) and obfuscate_csv_parallel
+  with the 'pickle' and 'shm' transports;
+- transport overhead alone: moving every chunk to a worker and a same-sized
+  result back, with no obfuscation work.
+
+Usage:
+    python benchmarks/bench_parallel_csv.py --size-mb 256 --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from obfuscator import obfuscate_csv  # noqa: E402
+from parallel_csv import find_record_boundaries, obfuscate_csv_parallel  # noqa: E402
+from shm_transport import SharedBuffer, read_ref, write_ref  # noqa: E402
+
+PII_FIELDS = ["name", "email"]
+
+
+def make_csv(size_mb: int) -> bytes:
+    rows = ["id,name,email,city,notes\n"]
+    size, i = len(rows[0]), 0
+    while size < size_mb * 1024 * 1024:
+        row = f'{i},User {i},user{i}@example.com,Leeds,"note {i}\nsecond line"\n'
+        rows.append(row)
+        size += len(row)
+        i += 1
+    return "".join(rows).encode("utf-8")
+
+
+def _echo_pickled(chunk: bytes) -> bytes:
+    return chunk
+
+
+def _echo_shared(chunk_ref, output_ref) -> int:
+    return write_ref(output_ref, read_ref(chunk_ref))
+
+
+def transport_overhead(data: bytes, workers: int, chunk_size: int) -> dict:
+    """Round-trip every chunk through the pool without obfuscating it."""
+    boundaries = find_record_boundaries(data, chunk_size)
+    spans = list(zip(boundaries, boundaries[1:]))
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_echo_pickled, [b""] * workers))  # start the workers
+
+        start = time.perf_counter()
+        b"".join(pool.map(_echo_pickled, [data[a:b] for a, b in spans]))
+        timings["pickle"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with SharedBuffer.from_bytes(data) as source, SharedBuffer(len(data)) as out:
+            sizes = pool.map(
+                _echo_shared,
+                [source.ref(a, b) for a, b in spans],
+                [out.ref(a, b) for a, b in spans],
+            )
+            b"".join(out.read(a, a + n) for (a, _), n in zip(spans, sizes))
+        timings["shm"] = time.perf_counter() - start
+    return timings
+
+
+def timed(label: str, fn) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.3f}s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    args = parser.parse_args()
+
+    data = make_csv(args.size_mb)
+    chunk_size = args.chunk_mb * 1024 * 1024
+    os.environ["CSV_PARALLEL_MIN_SIZE"] = "1"
+    print(
+        f"{len(data) / 1e6:.0f} MB CSV, {args.workers} workers, "
+        f"{args.chunk_mb} MB chunks\n"
+    )
+
+    serial = timed("serial", lambda: obfuscate_csv(data.decode(), PII_FIELDS))
+    for transport in ("pickle", "shm"):
+        elapsed = timed(
+            f"parallel ({transport})",
+            lambda: obfuscate_csv_parallel(
+                data, PII_FIELDS, args.workers, chunk_size, transport
+            ),
+        )
+        print(f"{'':<28} speed-up x{serial / elapsed:.2f}")
+
+    print("\ntransport overhead (no obfuscation):")
+    for transport, elapsed in transport_overhead(
+        data, args.workers, chunk_size
+    ).items():
+        print(f"  {transport:<26} {elapsed:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
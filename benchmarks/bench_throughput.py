@@ -0,0 +1,81 @@
+"""
+Benchmark of single-worker obfuscation throughput per input format.
+
+Runs each registered engine ('mask') on the same synthetic records written as
+CSV, JSON, NDJSON, Parquet, Arrow and ORC, and prints bytes of input per
+second. The last line is a PLAN_THROUGHPUT value for the plan mode's runtime
+estimates (see src/planning.py) on this kind of host.
+
+Usage:
+    python benchmarks/bench_throughput.py --rows 200000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from columnar import write_table  # noqa: E402
+from formats import get_format  # noqa: E402
+
+PII_FIELDS = ["name", "email"]
+FIELDS = ("id", "name", "email", "city", "score")
+
+
+def make_records(rows: int):
+    return [
+        {
+            "id": i,
+            "name": f"User {i}",
+            "email": f"user{i}@example.com",
+            "city": "Leeds",
+            "score": i % 100,
+        }
+        for i in range(rows)
+    ]
+
+
+def encode(records, file_format: str):
+    if file_format == "csv":
+        lines = [",".join(FIELDS)]
+        lines.extend(",".join(str(r[f]) for f in FIELDS) for r in records)
+        return "\n".join(lines) + "\n"
+    if file_format == "json":
+        return json.dumps(records)
+    if file_format == "ndjson":
+        return "\n".join(json.dumps(r) for r in records) + "\n"
+    import pyarrow as pa
+
+    return write_table(pa.Table.from_pylist(records), file_format)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = make_records(args.rows)
+    rates = {}
+    for name in ("csv", "json", "ndjson", "parquet", "arrow", "orc"):
+        content = encode(records, name)
+        size = len(content.encode("utf-8") if isinstance(content, str) else content)
+        engine = get_format(name).engine
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            engine(content, PII_FIELDS)
+            best = min(best, time.perf_counter() - start)
+        rates[name] = round(size / best)
+        print(
+            f"{name:<8} {size / 1e6:8.1f} MB {best:8.3f}s {rates[name] / 1e6:8.1f} MB/s"
+        )
+
+    print(f"\nPLAN_THROUGHPUT='{json.dumps(rates)}'")
+
+
+if __name__ == "__main__":
+    main()
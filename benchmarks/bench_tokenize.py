@@ -0,0 +1,96 @@
+"""
+Benchmark for the 'tokenize' strategy against constant masking.
+
+Measures, on a synthetic dataset in CSV and Parquet:
+
+- obfuscate_csv / obfuscate_columnar with 'mask';
+- the same with 'tokenize' against an empty vault (every value inserted);
+- 'tokenize' again against the now warm vault with a cold LRU cache
+  (every value looked up in SQLite).
+
+Usage:
+    python benchmarks/bench_tokenize.py --rows 500000 --distinct 100000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import tokenization  # noqa: E402
+from columnar import obfuscate_columnar, write_table  # noqa: E402
+from obfuscator import obfuscate_csv  # noqa: E402
+
+PII_FIELDS = ["name", "email"]
+
+
+def make_rows(rows: int, distinct: int):
+    return [
+        (i, f"User {i % distinct}", f"user{i % distinct}@example.com", "Leeds")
+        for i in range(rows)
+    ]
+
+
+def make_csv(rows) -> str:
+    lines = ["id,name,email,city"]
+    lines.extend(",".join(map(str, row)) for row in rows)
+    return "\n".join(lines) + "\n"
+
+
+def make_parquet(rows) -> bytes:
+    import pyarrow as pa
+
+    columns = list(zip(*rows))
+    table = pa.table(
+        {
+            name: list(values)
+            for name, values in zip(("id", *PII_FIELDS, "city"), columns)
+        }
+    )
+    return write_table(table, "parquet")
+
+
+def timed(label: str, fn) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed:8.3f}s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--distinct", type=int, default=50_000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.distinct)
+    datasets = {
+        "csv": (make_csv(rows), lambda data, s: obfuscate_csv(data, PII_FIELDS, s)),
+        "parquet": (
+            make_parquet(rows),
+            lambda data, s: obfuscate_columnar(data, PII_FIELDS, "parquet", s),
+        ),
+    }
+    print(f"{args.rows} rows, {args.distinct} distinct values per PII field\n")
+
+    for name, (data, obfuscate) in datasets.items():
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ[tokenization.VAULT_ENV] = os.path.join(directory, "vault.db")
+            tokenization._vaults.clear()
+            mask = timed(f"{name}: mask", lambda: obfuscate(data, "mask"))
+            cold = timed(
+                f"{name}: tokenize (new vault)", lambda: obfuscate(data, "tokenize")
+            )
+            tokenization._vaults.clear()
+            warm = timed(
+                f"{name}: tokenize (warm vault)", lambda: obfuscate(data, "tokenize")
+            )
+            print(f"{'':<34} x{cold / mask:.2f} / x{warm / mask:.2f} of mask\n")
+
+
+if __name__ == "__main__":
+    main()
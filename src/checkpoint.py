@@ -0,0 +1,291 @@
+# Checkpointed, resumable obfuscation of very large objects.
+#
+# A large CSV is read in segments with ranged GETs, each cut at the last
+# complete record, obfuscated, and uploaded as parts of one S3 multipart
+# upload. After every part the committed input byte offset, the CSV header and
+# the part list are saved in a small state object (CHECKPOINT_LOCATION: a
+# local directory or s3://bucket/prefix). If the invocation times out or
+# fails, the next attempt loads that state and continues from the offset
+# instead of starting again, so a very large file can be processed by a series
+# of time-bounded Lambda invocations.
+#
+# Parquet is not checkpointed: its footer describes every row group, so the
+# output cannot be assembled from parts written by separate invocations.
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import List, Optional
+from hashing import normalize_etag
+from obfuscator import obfuscate_csv
+from parallel_csv import first_record_end, last_record_boundary
+import tuning
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/checkpoint.log")
+
+CHECKPOINT_ENV = "CHECKPOINT_LOCATION"
+MIN_SIZE_ENV = "CHECKPOINT_MIN_SIZE"
+
+# Objects smaller than this are obfuscated in one go
+DEFAULT_MIN_SIZE = 256 * 1024 * 1024
+# S3 rejects multipart parts smaller than this (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def checkpoint_id(
+    bucket: str, key: str, output_bucket: str, output_key: str, plan: str
+) -> str:
+    """Identify one job: an input, an output location and a plan."""
+    identity = json.dumps([bucket, key, output_bucket, output_key, plan])
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+class LocalCheckpointStore:
+    """Checkpoint state as JSON files in a local directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def load(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, job_id: str, state: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temp file first so a crash never leaves half a checkpoint
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._path(job_id))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def delete(self, job_id: str):
+        try:
+            os.unlink(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+class S3CheckpointStore:
+    """Checkpoint state as small JSON objects in S3."""
+
+    def __init__(self, s3, bucket: str, prefix: str = ""):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/" if prefix else ""
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}.json"
+
+    def load(self, job_id: str) -> Optional[dict]:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._key(job_id))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def save(self, job_id: str, state: dict):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._key(job_id),
+            Body=json.dumps(state).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def delete(self, job_id: str):
+        self.s3.delete_object(Bucket=self.bucket, Key=self._key(job_id))
+
+
+def get_checkpoint_store(s3):
+    """The store configured by CHECKPOINT_LOCATION, if any."""
+    location = os.getenv(CHECKPOINT_ENV)
+    if not location:
+        return None
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        return S3CheckpointStore(s3, bucket, prefix)
+    return LocalCheckpointStore(location)
+
+
+def checkpoint_min_size() -> int:
+    return int(os.getenv(MIN_SIZE_ENV, DEFAULT_MIN_SIZE))
+
+
+def _read_range(s3, bucket: str, key: str, start: int, length: int, etag: str):
+    # If-Match: fail rather than stitch together two versions of the input
+    extra = {"IfMatch": etag} if etag else {}
+    response = s3.get_object(
+        Bucket=bucket, Key=key, Range=f"bytes={start}-{start + length - 1}", **extra
+    )
+    return response["Body"].read()
+
+
+def _abort(s3, store, job_id: str, state: dict, output_bucket: str, output_key: str):
+    from botocore.exceptions import ClientError
+
+    try:
+        s3.abort_multipart_upload(
+            Bucket=output_bucket, Key=output_key, UploadId=state["upload_id"]
+        )
+    except ClientError:
+        logger.warning("Could not abort a stale multipart upload.")
+    store.delete(job_id)
+
+
+def obfuscate_csv_checkpointed(
+    s3,
+    store,
+    bucket: str,
+    key: str,
+    size: int,
+    source_etag: str,
+    output_bucket: str,
+    output_key: str,
+    pii_fields: List[str],
+    plan: str,
+    metadata: dict = None,
+    deadline: float = None,
+    strategy: str = "mask",
+) -> dict:
+    """
+    Obfuscate a large CSV object into a multipart upload, resuming from and
+    saving to a checkpoint.
+
+    Args:
+        s3 (boto3.client): S3 client.
+        store: LocalCheckpointStore or S3CheckpointStore.
+        bucket (str), key (str): Input object.
+        size (int): Input size in bytes.
+        source_etag (str): Input ETag; a checkpoint for another version is
+            discarded and its upload aborted.
+        output_bucket (str), output_key (str): Output object.
+        pii_fields (List[str]): Fields to obfuscate.
+        plan (str): Plan hash, part of the job identity.
+        metadata (dict, optional): Metadata for the output object.
+        deadline (float, optional): time.monotonic() value after which no new
+            segment is started; the job then stops at its last checkpoint.
+        strategy (str): 'mask' or 'tokenize'. Tokens are stable, so a resumed
+            job tokenises exactly as an uninterrupted one.
+
+    Returns:
+        dict: 'complete' (bool), 'offset' (input bytes committed) and 'parts',
+        plus the output's 'etag' once complete.
+    """
+    from botocore.exceptions import ClientError
+
+    job_id = checkpoint_id(bucket, key, output_bucket, output_key, plan)
+    state = store.load(job_id)
+    if state is not None and state.get("source_etag") != source_etag:
+        logger.info("Input changed since the last checkpoint; starting again.")
+        _abort(s3, store, job_id, state, output_bucket, output_key)
+        state = None
+    if state is None:
+        upload = s3.create_multipart_upload(
+            Bucket=output_bucket, Key=output_key, Metadata=metadata or {}
+        )
+        state = {
+            "source_etag": source_etag,
+            "upload_id": upload["UploadId"],
+            "offset": 0,
+            "header": None,
+            "parts": [],
+        }
+        store.save(job_id, state)
+    else:
+        logger.info(
+            f"Resuming s3://{bucket}/{key} at byte {state['offset']} of {size} "
+            f"({len(state['parts'])} parts uploaded)."
+        )
+
+    # CHECKPOINT_SEGMENT_SIZE, or tuned to the memory available
+    segment_size = tuning.checkpoint_segment_size()
+    header = state["header"]
+    header_out = obfuscate_csv(header, pii_fields, strategy) if header else None
+    offset = state["offset"]
+    pending, pending_size = [], 0
+
+    try:
+        while offset < size:
+            if deadline is not None and not pending and time.monotonic() >= deadline:
+                logger.info(f"Stopping at checkpoint: byte {offset} of {size}.")
+                return {"complete": False, "offset": offset, "parts": state["parts"]}
+
+            # Read a segment and cut it after its last complete record; a
+            # record longer than the segment doubles the read until it fits
+            length = segment_size
+            while True:
+                data = _read_range(s3, bucket, key, offset, length, source_etag)
+                if offset + len(data) >= size:
+                    break
+                cut = last_record_boundary(data)
+                if cut:
+                    data = data[:cut]
+                    break
+                length *= 2
+            text = data.decode("utf-8")
+
+            if header is None:
+                # The first segment carries the header, written once
+                header = text[: first_record_end(text)]
+                header_out = obfuscate_csv(header, pii_fields, strategy)
+                output = obfuscate_csv(text, pii_fields, strategy)
+            else:
+                output = obfuscate_csv(header + text, pii_fields, strategy)
+                output = output[len(header_out) :]
+            offset += len(data)
+            pending.append(output)
+            pending_size += len(output)
+
+            if pending_size >= MIN_PART_SIZE or offset >= size:
+                part_number = len(state["parts"]) + 1
+                response = s3.upload_part(
+                    Bucket=output_bucket,
+                    Key=output_key,
+                    UploadId=state["upload_id"],
+                    PartNumber=part_number,
+                    Body=b"".join(pending),
+                )
+                state["parts"].append(
+                    {"PartNumber": part_number, "ETag": response["ETag"]}
+                )
+                state.update(offset=offset, header=header)
+                store.save(job_id, state)
+                pending, pending_size = [], 0
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("PreconditionFailed", "412"):
+            # The input was replaced mid-job: the parts so far are useless
+            _abort(s3, store, job_id, state, output_bucket, output_key)
+        raise
+    except (ValueError, TypeError, UnicodeDecodeError):
+        # Bad data fails the same way on every retry
+        _abort(s3, store, job_id, state, output_bucket, output_key)
+        raise
+
+    response = s3.complete_multipart_upload(
+        Bucket=output_bucket,
+        Key=output_key,
+        UploadId=state["upload_id"],
+        MultipartUpload={"Parts": state["parts"]},
+    )
+    store.delete(job_id)
+    return {
+        "complete": True,
+        "offset": offset,
+        "parts": state["parts"],
+        "etag": normalize_etag(response.get("ETag")),
+    }
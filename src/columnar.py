@@ -0,0 +1,358 @@
+# Shared columnar obfuscation core for Arrow-based formats (Parquet, Arrow IPC /
+# Feather, ORC).
+#
+# Obfuscation works column-wise on pyarrow Tables and RecordBatches: PII columns
+# are replaced by a constant '***' column (or by vault tokens, see
+# tokenization.py, or dropped without being read) and every other column is passed
+# through by reference, so untouched data is never copied or converted.
+# Per-format code is reduced to thin read/write adapters (see obfuscator.py).
+#
+# pyarrow is imported inside the functions so importing this module stays cheap.
+import logging
+from typing import Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MASK_VALUE = "***"
+
+# Formats handled by this module, with a label for log messages
+COLUMNAR_FORMATS = {"parquet": "Parquet", "arrow": "Arrow IPC", "orc": "ORC"}
+
+
+def resolve_pii_columns(
+    column_names: List[str], pii_fields: List[str], label: str = "Parquet"
+) -> List[str]:
+    """
+    Match PII field names (case-insensitively) against a schema's column names.
+
+    Args:
+        column_names (List[str]): Columns in the schema.
+        pii_fields (List[str]): Fields to obfuscate.
+        label (str): Format name used in log messages.
+
+    Returns:
+        List[str]: The actual column names to obfuscate.
+
+    Raises:
+        ValueError: If none of the PII fields exist in the schema.
+    """
+    column_map = {col.lower(): col for col in column_names}
+    found_fields = []
+    for field in pii_fields:
+        actual_field = column_map.get(field.lower())
+        if actual_field and actual_field not in found_fields:
+            found_fields.append(actual_field)
+
+    if not found_fields:
+        logger.warning(
+            f"⚠️ None of the specified PII fields were found in the {label} file."
+        )
+        raise ValueError("No matching PII fields found — obfuscation skipped.")
+
+    missing_fields = [field for field in pii_fields if field.lower() not in column_map]
+    if missing_fields:
+        logger.warning(
+            f"⚠️ Some PII fields were not found in {label}: {', '.join(missing_fields)}"
+        )
+    return found_fields
+
+
+def mask_columns(data, columns: List[str]):
+    """
+    Replace the given columns of a Table or RecordBatch with '***'.
+
+    Other columns are reused as-is (zero copy).
+
+    Args:
+        data (pyarrow.Table | pyarrow.RecordBatch): Input data.
+        columns (List[str]): Column names to mask (from resolve_pii_columns).
+
+    Returns:
+        Same type as data, with the PII columns masked.
+    """
+    import pyarrow as pa
+
+    for column in columns:
+        index = data.schema.get_field_index(column)
+        field = data.schema.field(index)
+        masked = pa.repeat(pa.scalar(MASK_VALUE, pa.string()), data.num_rows)
+        data = data.set_column(index, field.with_type(pa.string()), masked)
+    return data
+
+
+def tokenize_columns(data, columns: List[str]):
+    """
+    Replace the given columns of a Table or RecordBatch with vault tokens.
+
+    Each column is dictionary-encoded first, so every distinct value is looked
+    up once per batch; nulls and empty strings are kept.
+
+    Args:
+        data (pyarrow.Table | pyarrow.RecordBatch): Input data.
+        columns (List[str]): Column names to tokenise (from resolve_pii_columns).
+
+    Returns:
+        Same type as data, with the PII columns as string tokens.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from tokenization import tokenize_values
+
+    for column in columns:
+        index = data.schema.get_field_index(column)
+        field = data.schema.field(index)
+        values = data.column(index)
+        if isinstance(values, pa.ChunkedArray):
+            values = values.combine_chunks()
+        encoded = values.cast(pa.string()).dictionary_encode()
+        tokens = pa.array(tokenize_values(encoded.dictionary.to_pylist()), pa.string())
+        data = data.set_column(
+            index, field.with_type(pa.string()), pc.take(tokens, encoded.indices)
+        )
+    return data
+
+
+def obfuscate_table(table, pii_fields: List[str], label: str = "Parquet"):
+    """Resolve PII columns against a Table's schema and mask them."""
+    columns = resolve_pii_columns(table.schema.names, pii_fields, label)
+    return mask_columns(table, columns)
+
+
+def masked_schema(schema, columns: List[str]):
+    """The schema of the output once `columns` are masked as strings."""
+    import pyarrow as pa
+
+    for column in columns:
+        index = schema.get_field_index(column)
+        schema = schema.set(index, schema.field(index).with_type(pa.string()))
+    return schema
+
+
+def retained_columns(column_names: List[str], columns: List[str]) -> List[str]:
+    """
+    The columns left once `columns` are dropped.
+
+    Raises:
+        ValueError: If nothing would be left.
+    """
+    kept = [name for name in column_names if name not in columns]
+    if not kept:
+        raise ValueError("Dropping the PII fields would leave no columns.")
+    return kept
+
+
+# --- Readers: yield record batches (row groups / stripes) from raw bytes --------
+
+
+def open_batches(
+    content: bytes, file_format: str, columns: List[str] = None
+) -> Tuple[object, Iterator]:
+    """
+    Open columnar content without copying it.
+
+    Args:
+        content (bytes): File content.
+        file_format (str): 'parquet', 'arrow' or 'orc'.
+        columns (List[str], optional): Read only these top-level columns;
+            for Parquet and ORC the others are never decoded.
+
+    Returns:
+        tuple: (pyarrow.Schema, iterator of Tables/RecordBatches), one per
+        Parquet row group, IPC record batch or ORC stripe.
+
+    Raises:
+        ValueError: If the content cannot be read in that format.
+    """
+    import pyarrow as pa
+
+    label = COLUMNAR_FORMATS[file_format]
+    source = pa.BufferReader(content)  # zero-copy view over the bytes
+    try:
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            reader = pq.ParquetFile(source)
+            batches = (
+                reader.read_row_group(i, columns=columns)
+                for i in range(reader.num_row_groups)
+            )
+            return _project(reader.schema_arrow, columns), batches
+        if file_format == "arrow":
+            if content[:6] == b"ARROW1":
+                reader = pa.ipc.open_file(source)
+                batches = (
+                    reader.get_batch(i) for i in range(reader.num_record_batches)
+                )
+            else:
+                reader = pa.ipc.open_stream(source)
+                batches = iter(reader)
+            if columns is not None:
+                # Arrow IPC columns are sliced out of the buffer, never decoded
+                batches = (batch.select(columns) for batch in batches)
+            return _project(reader.schema, columns), batches
+        if file_format == "orc":
+            orc = _import_orc()
+            reader = orc.ORCFile(source)
+            batches = (
+                reader.read_stripe(i, columns=columns) for i in range(reader.nstripes)
+            )
+            return _project(reader.schema, columns), batches
+    except (pa.ArrowException, OSError):
+        logger.exception(f"Failed to read {label}")
+        raise ValueError(f"Invalid {label} format")
+    raise ValueError(f"Unsupported columnar format '{file_format}'.")
+
+
+def _project(schema, columns: List[str] = None):
+    if columns is None:
+        return schema
+    import pyarrow as pa
+
+    return pa.schema([schema.field(name) for name in columns], schema.metadata)
+
+
+def parquet_codec(metadata) -> str:
+    """The writer codec name for the compression a Parquet file already uses."""
+    if not metadata.num_row_groups or not metadata.num_columns:
+        return "snappy"
+    codec = metadata.row_group(0).column(0).compression.lower()
+    return {"uncompressed": "none", "lz4_raw": "lz4"}.get(codec, codec)
+
+
+def read_table(content: bytes, file_format: str):
+    """Read a whole columnar file into a pyarrow.Table."""
+    import pyarrow as pa
+
+    schema, batches = open_batches(content, file_format)
+    tables = [
+        pa.Table.from_batches([b]) if isinstance(b, pa.RecordBatch) else b
+        for b in batches
+    ]
+    if not tables:
+        return schema.empty_table()
+    return pa.concat_tables(tables)
+
+
+# --- Writers: stream batches into an in-memory output file ---------------------
+
+
+def write_batches(
+    schema, batches: Iterator, file_format: str, parquet_options: dict = None
+) -> bytes:
+    """
+    Write Tables/RecordBatches to a new columnar file, batch by batch.
+
+    Args:
+        schema (pyarrow.Schema): Output schema.
+        batches (Iterator): Tables or RecordBatches matching the schema.
+        file_format (str): 'parquet', 'arrow' or 'orc'.
+        parquet_options (dict, optional): 'compression' and 'row_group_size'.
+
+    Returns:
+        bytes: The encoded file.
+    """
+    import pyarrow as pa
+
+    sink = pa.BufferOutputStream()
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        options = parquet_options or {}
+        row_group_size = options.get("row_group_size")
+        with pq.ParquetWriter(
+            sink, schema, compression=options.get("compression", "snappy")
+        ) as writer:
+            for batch in batches:
+                if isinstance(batch, pa.RecordBatch):
+                    batch = pa.Table.from_batches([batch])
+                writer.write_table(batch, row_group_size=row_group_size)
+    elif file_format == "arrow":
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write(batch)
+    elif file_format == "orc":
+        orc = _import_orc()
+        writer = orc.ORCWriter(sink)
+        try:
+            for batch in batches:
+                if isinstance(batch, pa.RecordBatch):
+                    batch = pa.Table.from_batches([batch])
+                writer.write(batch)
+        finally:
+            writer.close()
+    else:
+        raise ValueError(f"Unsupported columnar format '{file_format}'.")
+    return sink.getvalue().to_pybytes()
+
+
+def write_table(table, file_format: str, parquet_options: dict = None) -> bytes:
+    """Write a whole pyarrow.Table to a columnar file."""
+    return write_batches(table.schema, [table], file_format, parquet_options)
+
+
+def obfuscated_batches(
+    content: bytes, pii_fields: List[str], file_format: str, strategy: str = "mask"
+):
+    """
+    The obfuscated schema and record batches of a columnar file, decoded and
+    obfuscated one batch at a time as they are consumed.
+
+    Args:
+        content (bytes): File content.
+        pii_fields (List[str]): Fields to obfuscate.
+        file_format (str): 'parquet', 'arrow' or 'orc'.
+        strategy (str): 'mask', 'tokenize' or 'drop' (see obfuscate_columnar).
+
+    Returns:
+        tuple: (pyarrow.Schema, iterator of pyarrow.RecordBatch)
+    """
+    label = COLUMNAR_FORMATS[file_format]
+    schema, batches = open_batches(content, file_format)
+    columns = resolve_pii_columns(schema.names, pii_fields, label)
+    if strategy == "drop":
+        kept = retained_columns(schema.names, columns)
+        return open_batches(content, file_format, columns=kept)
+    replace = tokenize_columns if strategy == "tokenize" else mask_columns
+    masked = (replace(batch, columns) for batch in batches)
+    return masked_schema(schema, columns), masked
+
+
+def obfuscate_columnar(
+    content: bytes, pii_fields: List[str], file_format: str, strategy: str = "mask"
+) -> bytes:
+    """
+    Obfuscate a columnar file batch by batch and re-encode it in the same format.
+
+    Only one row group / record batch / stripe is decoded at a time, and the
+    input's batch structure is preserved in the output.
+
+    Args:
+        content (bytes): File content.
+        pii_fields (List[str]): Fields to obfuscate.
+        file_format (str): 'parquet', 'arrow' or 'orc'.
+        strategy (str): 'mask', 'tokenize' (one vault batch per record batch)
+            or 'drop' (only the other columns are read and written; Parquet
+            keeps its compression).
+
+    Returns:
+        bytes: Obfuscated file in the same format.
+    """
+    schema, batches = obfuscated_batches(content, pii_fields, file_format, strategy)
+    options = None
+    if strategy == "drop" and file_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        metadata = pq.read_metadata(pa.BufferReader(content))
+        options = {"compression": parquet_codec(metadata)}
+    return write_batches(schema, batches, file_format, options)
+
+
+def _import_orc():
+    try:
+        import pyarrow.orc as orc
+    except ImportError:
+        from exceptions import UnsupportedFormatError
+
+        raise UnsupportedFormatError("This pyarrow build does not support ORC.")
+    return orc
@@ -0,0 +1,164 @@
+# Transparent (de)compression of input and output files.
+#
+# Inputs such as 'sample.csv.gz' or 'data.json.zst' are decompressed as a stream
+# straight from the S3 response body into the parsers, so the file is never
+# fully inflated in memory first. Outputs can optionally be compressed.
+#
+# gzip is always available; zstd needs 'zstandard' and snappy (framed format)
+# needs 'python-snappy'. They are imported only when used.
+import gzip
+import io
+import zlib
+from typing import BinaryIO, Optional, Tuple
+from exceptions import UnsupportedFormatError
+
+# codec → (file suffix, magic bytes at the start of the stream)
+CODECS = {
+    "gzip": (".gz", b"\x1f\x8b"),
+    "zstd": (".zst", b"\x28\xb5\x2f\xfd"),
+    "snappy": (".snappy", b"\xff\x06\x00\x00sNaPpY"),
+}
+
+# Read size used when pulling compressed bytes through a decompressor
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def split_compression_suffix(uri: str) -> Tuple[str, Optional[str]]:
+    """
+    Split a codec suffix off a URI.
+
+    Returns:
+        tuple: (uri without the codec suffix, codec name or None)
+            e.g. 's3://b/sample.csv.gz' → ('s3://b/sample.csv', 'gzip')
+    """
+    lower = uri.lower()
+    for codec, (suffix, _) in CODECS.items():
+        if lower.endswith(suffix):
+            return uri[: -len(suffix)], codec
+    return uri, None
+
+
+def sniff_compression(prefix: bytes) -> Optional[str]:
+    """Identify a codec from the first bytes of a stream, if it is compressed."""
+    for codec, (_, magic) in CODECS.items():
+        if prefix.startswith(magic):
+            return codec
+    return None
+
+
+def _import_codec(codec: str):
+    try:
+        if codec == "zstd":
+            import zstandard
+
+            return zstandard
+        if codec == "snappy":
+            import snappy
+
+            return snappy
+    except ImportError:
+        package = "zstandard" if codec == "zstd" else "python-snappy"
+        raise UnsupportedFormatError(
+            f"{codec} support requires the '{package}' package to be installed."
+        )
+    raise UnsupportedFormatError(f"Unsupported compression codec '{codec}'.")
+
+
+class _SnappyStreamReader(io.RawIOBase):
+    """File-like reader over a framed snappy stream, decompressing chunk by chunk."""
+
+    def __init__(self, source: BinaryIO):
+        snappy = _import_codec("snappy")
+        self._source = source
+        self._decompressor = snappy.StreamDecompressor()
+        self._pending = b""
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending and not self._eof:
+            chunk = self._source.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                self._decompressor.flush()
+                self._eof = True
+                break
+            self._pending = self._decompressor.decompress(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class _RawStreamReader(io.RawIOBase):
+    """File-like reader over a stream that only has read(), e.g. an S3 body."""
+
+    def __init__(self, source: BinaryIO):
+        self._source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._source.read(len(buffer))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+def open_decompressed(source: BinaryIO, codec: Optional[str]) -> BinaryIO:
+    """
+    Wrap a binary stream (e.g. an S3 StreamingBody) in a streaming decompressor.
+
+    Args:
+        source (BinaryIO): Compressed byte stream.
+        codec (str | None): 'gzip', 'zstd', 'snappy', or None for no compression.
+
+    Returns:
+        BinaryIO: A buffered stream yielding decompressed bytes.
+    """
+    if codec is None:
+        # Buffered like the decompressors, so text detection can peek()
+        return io.BufferedReader(
+            _RawStreamReader(source), buffer_size=STREAM_CHUNK_SIZE
+        )
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=source, mode="rb")
+    if codec == "zstd":
+        zstandard = _import_codec("zstd")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            source, read_size=STREAM_CHUNK_SIZE
+        )
+        return io.BufferedReader(reader, buffer_size=STREAM_CHUNK_SIZE)
+    if codec == "snappy":
+        return io.BufferedReader(
+            _SnappyStreamReader(source), buffer_size=STREAM_CHUNK_SIZE
+        )
+    raise UnsupportedFormatError(f"Unsupported compression codec '{codec}'.")
+
+
+def peek_decompressed(prefix: bytes, codec: str, size: int) -> bytes:
+    """
+    Decompress what can be decompressed from the first bytes of a compressed
+    file, e.g. to sniff its format. Returns at most `size` bytes.
+    """
+    if codec == "gzip":
+        return zlib.decompressobj(wbits=31).decompress(prefix, size)
+    if codec == "zstd":
+        decompressor = _import_codec("zstd").ZstdDecompressor().decompressobj()
+        return decompressor.decompress(prefix)[:size]
+    if codec == "snappy":
+        decompressor = _import_codec("snappy").StreamDecompressor()
+        return decompressor.decompress(prefix)[:size]
+    raise UnsupportedFormatError(f"Unsupported compression codec '{codec}'.")
+
+
+def compress_bytes(data: bytes, codec: str) -> bytes:
+    """Compress an output body with the given codec."""
+    if codec == "gzip":
+        return gzip.compress(data)
+    if codec == "zstd":
+        return _import_codec("zstd").ZstdCompressor().compress(data)
+    if codec == "snappy":
+        return _import_codec("snappy").StreamCompressor().add_chunk(data)
+    raise UnsupportedFormatError(f"Unsupported compression codec '{codec}'.")
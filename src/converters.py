@@ -0,0 +1,229 @@
+# Converts obfuscated output from the input format to another output format,
+# e.g. a large CSV export into Parquet so downstream jobs don't re-parse text.
+#
+# Conversion always runs on the already-obfuscated bytes, so no PII can leak
+# through a conversion path. pyarrow is only imported when a columnar format
+# (Parquet, Arrow IPC, ORC) is involved.
+#
+# Values are carried over as they are, never re-typed: every CSV column becomes
+# a string column (IDs like '007', zip codes and 'NA' survive intact), and a
+# JSON key whose values do not share one type becomes a string column of
+# their JSON text. CSV and columnar inputs are converted batch by batch; JSON
+# inputs are loaded whole, as their schema is the union of all records.
+import csv
+import io
+import json
+from typing import Iterator, Tuple
+from columnar import COLUMNAR_FORMATS
+import tuning
+
+OUTPUT_FORMATS = ("csv", "json", "ndjson", "parquet", "arrow", "orc")
+
+PARQUET_COMPRESSIONS = ("snappy", "gzip", "zstd", "brotli", "lz4", "none")
+DEFAULT_PARQUET_OPTIONS = {"compression": "snappy", "row_group_size": 128 * 1024}
+
+
+def validate_parquet_options(options: dict) -> dict:
+    """
+    Fill in defaults and check 'compression' and 'row_group_size'.
+
+    Raises:
+        TypeError: If options is not a dict.
+        ValueError: If a value is not supported.
+    """
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        raise TypeError("'parquet_options' must be an object.")
+
+    unknown = set(options) - set(DEFAULT_PARQUET_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown parquet_options: {', '.join(sorted(unknown))}")
+
+    merged = {**DEFAULT_PARQUET_OPTIONS, **options}
+    if "row_group_size" not in options:
+        # Sized to the memory available (tuning.py)
+        merged["row_group_size"] = tuning.parquet_row_group_size()
+    if merged["compression"] not in PARQUET_COMPRESSIONS:
+        raise ValueError(
+            f"Unsupported Parquet compression '{merged['compression']}'. "
+            f"Supported: {', '.join(PARQUET_COMPRESSIONS)}."
+        )
+    row_group_size = merged["row_group_size"]
+    if not isinstance(row_group_size, int) or row_group_size <= 0:
+        raise ValueError("'row_group_size' must be a positive integer.")
+    return merged
+
+
+def convert_output(
+    data: bytes, input_format: str, output_format: str, parquet_options: dict = None
+) -> bytes:
+    """
+    Convert obfuscated output bytes into another format.
+
+    Args:
+        data (bytes): Obfuscated content in input_format.
+        input_format (str): Format of data ('csv', 'json', 'ndjson', 'parquet',
+            'arrow' or 'orc').
+        output_format (str): Target format, one of OUTPUT_FORMATS.
+        parquet_options (dict, optional): 'compression' and 'row_group_size'
+            for Parquet output.
+
+    Returns:
+        bytes: Content in output_format.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output format '{output_format}'. "
+            f"Supported: {', '.join(OUTPUT_FORMATS)}."
+        )
+    if input_format == output_format:
+        return data
+
+    if output_format in COLUMNAR_FORMATS:
+        from columnar import write_batches
+
+        schema, batches = _open_arrow(data, input_format)
+        options = None
+        if output_format == "parquet":
+            options = validate_parquet_options(parquet_options)
+            batches = _rebatch(batches, options["row_group_size"])
+        return write_batches(schema, batches, output_format, options)
+
+    records = _iter_records(data, input_format)
+    if output_format == "ndjson":
+        return b"".join(
+            json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+            for record in records
+        )
+    if output_format == "json":
+        return json.dumps(
+            list(records), ensure_ascii=False, indent=2, default=str
+        ).encode("utf-8")
+    return _write_csv(records)
+
+
+def _iter_records(data: bytes, input_format: str) -> Iterator[dict]:
+    """Yield one dict per row/record, reading batch by batch where possible."""
+    if input_format == "csv":
+        yield from csv.DictReader(io.StringIO(data.decode("utf-8")))
+    elif input_format == "json":
+        parsed = json.loads(data)
+        yield from [parsed] if isinstance(parsed, dict) else parsed
+    elif input_format == "ndjson":
+        for line in io.TextIOWrapper(io.BytesIO(data), encoding="utf-8"):
+            if line.strip():
+                yield json.loads(line)
+    elif input_format in COLUMNAR_FORMATS:
+        from columnar import open_batches
+
+        _, batches = open_batches(data, input_format)
+        for batch in batches:
+            yield from batch.to_pylist()
+    else:
+        raise ValueError(f"Cannot convert from '{input_format}'.")
+
+
+def _open_arrow(data: bytes, input_format: str) -> Tuple[object, Iterator]:
+    """
+    Open obfuscated output as a pyarrow schema and an iterator of batches.
+
+    Returns:
+        tuple: (pyarrow.Schema, iterator of RecordBatches or Tables)
+    """
+    if input_format in COLUMNAR_FORMATS:
+        from columnar import open_batches
+
+        return open_batches(data, input_format)
+    if input_format == "csv":
+        return _open_csv(data)
+    if input_format in ("json", "ndjson"):
+        table = _records_to_table(list(_iter_records(data, input_format)))
+        return table.schema, iter([table])
+    raise ValueError(f"Cannot convert from '{input_format}' to a columnar format.")
+
+
+def _open_csv(data: bytes) -> Tuple[object, Iterator]:
+    """Stream CSV into string columns, without type inference or nulls."""
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    # The header names the columns, so their types can be fixed up front
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", newline="")
+    header = next(csv.reader(text), None)
+    if header is None:
+        return pa.schema([]), iter([])
+
+    reader = pacsv.open_csv(
+        pa.BufferReader(data),
+        read_options=pacsv.ReadOptions(column_names=header, skip_rows=1),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types={name: pa.string() for name in header},
+            null_values=[],
+            strings_can_be_null=False,
+            quoted_strings_can_be_null=False,
+        ),
+    )
+    return reader.schema, iter(reader)
+
+
+def _records_to_table(records: list):
+    """
+    Build a pyarrow.Table from JSON records that may not share keys or types.
+
+    Columns are the union of the records' keys (missing values are null). A
+    column whose values have no common Arrow type holds their JSON text.
+    """
+    import pyarrow as pa
+
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("JSON records must be objects to convert them.")
+    names = list(dict.fromkeys(key for record in records for key in record))
+    arrays = []
+    for name in names:
+        values = [record.get(name) for record in records]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(
+                pa.array(
+                    [
+                        v if v is None or isinstance(v, str) else json.dumps(v)
+                        for v in values
+                    ],
+                    pa.string(),
+                )
+            )
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def _rebatch(batches: Iterator, rows: int) -> Iterator:
+    """Regroup batches into Tables of `rows` rows (one Parquet row group each)."""
+    import pyarrow as pa
+
+    pending, pending_rows = [], 0
+    for batch in batches:
+        if isinstance(batch, pa.RecordBatch):
+            batch = pa.Table.from_batches([batch])
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= rows:
+            table = pa.concat_tables(pending)
+            yield table.slice(0, rows)
+            pending, pending_rows = [table.slice(rows)], pending_rows - rows
+    if pending_rows:
+        yield pa.concat_tables(pending)
+
+
+def _write_csv(records: Iterator[dict]) -> bytes:
+    # JSON records may not share the same keys: the header is their union
+    records = list(records)
+    fieldnames = list(dict.fromkeys(key for record in records for key in record))
+
+    output_buffer = io.StringIO()
+    writer = csv.DictWriter(output_buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(records)
+    return output_buffer.getvalue().encode("utf-8")
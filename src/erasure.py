@@ -0,0 +1,514 @@
+# Right to erasure: remove every row that belongs to a set of data subjects.
+#
+# Masking blanks PII fields but keeps the record; an erasure request must
+# remove the record itself. Rows are matched on one ID column (e.g.
+# 'student_id') against a SubjectSet, which may hold millions of IDs:
+#
+# - CSV and NDJSON are streamed row by row, each ID checked against a hash set;
+# - Parquet, Arrow IPC and ORC are filtered one row group / batch / stripe at a
+#   time with pyarrow.compute.is_in, against a value set built once per type.
+#
+# Every function returns the rewritten content and the number of rows removed.
+# IDs and matched rows are never logged, only counts.
+import bisect
+import csv
+import io
+import json
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple, Union
+from columnar import COLUMNAR_FORMATS
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/erasure.log")
+
+
+def normalise_id(value):
+    """The string form IDs are compared in (JSON 42 and CSV '42' match)."""
+    if value is None or isinstance(value, (bool, dict, list)):
+        return None
+    return str(value).strip()
+
+
+class SubjectSet:
+    """
+    IDs of the data subjects to erase.
+
+    IDs are held as strings in a frozenset; the Arrow value sets used for
+    columnar filtering are built lazily, once per column type.
+    """
+
+    def __init__(self, ids: Iterable):
+        self.ids = frozenset(
+            normalised for normalised in map(normalise_id, ids) if normalised
+        )
+        self._value_sets = {}
+        self._column_forms = {}
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, value) -> bool:
+        return normalise_id(value) in self.ids
+
+    def _sorted_ids(self):
+        if self._sorted is None:
+            strings = sorted(self.ids)
+            numbers = []
+            for value in self.ids:
+                try:
+                    numbers.append((float(value), value))
+                except ValueError:
+                    pass
+            numbers.sort()
+            self._sorted = (strings, [n for n, _ in numbers], [v for _, v in numbers])
+        return self._sorted
+
+    def in_range(self, low, high) -> List[str]:
+        """
+        The IDs that can lie within column statistics [low, high]: numbers
+        compare numerically, strings (and UTF-8 bytes) lexicographically.
+        Missing or other statistics rule nothing out.
+        """
+        strings, numbers, number_ids = self._sorted_ids()
+        if isinstance(low, bytes) and isinstance(high, bytes):
+            try:
+                low, high = low.decode("utf-8"), high.decode("utf-8")
+            except UnicodeDecodeError:
+                return strings
+        if isinstance(low, str) and isinstance(high, str):
+            return strings[
+                bisect.bisect_left(strings, low) : bisect.bisect_right(strings, high)
+            ]
+        if (
+            isinstance(low, (int, float))
+            and isinstance(high, (int, float))
+            and not isinstance(low, bool)
+            and not isinstance(high, bool)
+        ):
+            return number_ids[
+                bisect.bisect_left(numbers, low) : bisect.bisect_right(numbers, high)
+            ]
+        return strings
+
+    def value_set(self, arrow_type):
+        """
+        The IDs as a pyarrow array of `arrow_type`, or None if they cannot all
+        be represented in it (the column is then compared as strings).
+        """
+        import pyarrow as pa
+
+        if arrow_type not in self._value_sets:
+            strings = pa.array(sorted(self.ids), pa.string())
+            try:
+                value_set = strings.cast(arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                value_set = None
+            self._value_sets[arrow_type] = value_set
+        return self._value_sets[arrow_type]
+
+    def column_forms(self, arrow_type) -> Dict[str, str]:
+        """
+        Each ID → the string column_ids() renders for the value it matches in
+        a column of `arrow_type` (e.g. '007' → '7' for integers), so indexes
+        built with column_ids() agree with subject_mask().
+        """
+        if arrow_type not in self._column_forms:
+            ids = sorted(self.ids)
+            value_set = self.value_set(arrow_type)
+            forms = ids if value_set is None else column_ids(value_set).to_pylist()
+            self._column_forms[arrow_type] = dict(zip(ids, forms))
+        return self._column_forms[arrow_type]
+
+
+def load_subject_ids(source: Union[List, str], s3=None) -> SubjectSet:
+    """
+    Load subject IDs from a list, a local file or an s3:// object holding one
+    ID per line.
+
+    Raises:
+        TypeError: If source is neither a list nor a string.
+        ValueError: If no IDs are given.
+    """
+    if isinstance(source, str):
+        if source.startswith("s3://"):
+            from s3_utils import get_s3_client
+
+            bucket, key = source[len("s3://") :].split("/", 1)
+            body = (s3 or get_s3_client()).get_object(Bucket=bucket, Key=key)["Body"]
+            lines = io.TextIOWrapper(body, encoding="utf-8")
+            subjects = SubjectSet(line.rstrip("\r\n") for line in lines)
+        else:
+            with open(source, encoding="utf-8") as f:
+                subjects = SubjectSet(line.rstrip("\r\n") for line in f)
+    elif isinstance(source, list):
+        subjects = SubjectSet(source)
+    else:
+        raise TypeError("Subject IDs must be a list or a file/S3 URI.")
+    if not subjects:
+        raise ValueError("No subject IDs to erase.")
+    return subjects
+
+
+def find_id_field(names: List[str], id_field: str) -> Optional[str]:
+    """The actual name of `id_field` among `names` (case-insensitive), if any."""
+    name_map = {str(name).lower(): name for name in names}
+    return name_map.get(id_field.lower())
+
+
+def _resolve_id_field(names: List[str], id_field: str, label: str) -> str:
+    actual = find_id_field(names, id_field)
+    if actual is None:
+        logger.warning(f"⚠️ The subject ID field was not found in the {label} file.")
+        raise ValueError(f"Subject ID field '{id_field}' not found.")
+    return actual
+
+
+def erase_csv(
+    content: Union[str, TextIO], id_field: str, subjects: SubjectSet
+) -> Tuple[bytes, int]:
+    """
+    Remove the CSV rows whose `id_field` is in `subjects`.
+
+    Args:
+        content (str | TextIO): CSV content, or a text stream read row by row.
+        id_field (str): Column holding the subject ID (case-insensitive).
+        subjects (SubjectSet): IDs to erase.
+
+    Returns:
+        tuple: (CSV content encoded in UTF-8, rows removed)
+
+    Raises:
+        ValueError: If the content has no header or no `id_field` column.
+    """
+    reader = csv.reader(io.StringIO(content) if isinstance(content, str) else content)
+    header = next(reader, None)
+    if not header:
+        raise ValueError("CSV must have a header row.")
+    index = header.index(_resolve_id_field(header, id_field, "CSV"))
+    ids = subjects.ids
+
+    output_buffer = io.StringIO()
+    writer = csv.writer(output_buffer)
+    writer.writerow(header)
+    removed = 0
+    for row in reader:
+        if index < len(row) and normalise_id(row[index]) in ids:
+            removed += 1
+        else:
+            writer.writerow(row)
+    return output_buffer.getvalue().encode("utf-8"), removed
+
+
+def _record_id(record: dict, id_field: str):
+    for key, value in record.items():
+        if key.lower() == id_field:
+            return value
+    return None
+
+
+def erase_json(
+    content: Union[str, bytes, TextIO], id_field: str, subjects: SubjectSet
+) -> Tuple[bytes, int]:
+    """
+    Remove the records of a JSON object or list whose `id_field` is in
+    `subjects`. An erased single object becomes an empty list.
+
+    Returns:
+        tuple: (JSON content encoded in UTF-8, records removed)
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    try:
+        data = json.loads(content) if isinstance(content, str) else json.load(content)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON input")
+
+    records = [data] if isinstance(data, dict) else data
+    if not isinstance(records, list) or not all(
+        isinstance(record, dict) for record in records
+    ):
+        raise ValueError("Unsupported JSON format (must be object or list of objects)")
+
+    id_field = id_field.lower()
+    kept = [r for r in records if _record_id(r, id_field) not in subjects]
+    removed = len(records) - len(kept)
+    if isinstance(data, dict) and kept:
+        kept = kept[0]
+    return json.dumps(kept, ensure_ascii=False, indent=2).encode("utf-8"), removed
+
+
+def erase_ndjson(
+    content: Union[str, bytes, TextIO], id_field: str, subjects: SubjectSet
+) -> Tuple[bytes, int]:
+    """
+    Remove the NDJSON lines whose `id_field` is in `subjects`, streaming line
+    by line. Kept lines are copied verbatim.
+
+    Returns:
+        tuple: (NDJSON content encoded in UTF-8, lines removed)
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    lines = io.StringIO(content) if isinstance(content, str) else content
+
+    id_field = id_field.lower()
+    output_buffer = io.StringIO()
+    removed = 0
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            raise ValueError(f"Invalid NDJSON input on line {line_number}")
+        if not isinstance(record, dict):
+            raise ValueError("NDJSON lines must contain objects (dicts only).")
+        if _record_id(record, id_field) in subjects:
+            removed += 1
+            continue
+        output_buffer.write(line if line.endswith("\n") else line + "\n")
+    return output_buffer.getvalue().encode("utf-8"), removed
+
+
+def column_ids(column):
+    """A pyarrow column's values as trimmed strings, the form IDs are indexed in."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    return pc.utf8_trim_whitespace(pc.cast(column, pa.string()))
+
+
+def subject_mask(column, subjects: SubjectSet):
+    """
+    Boolean pyarrow array: True where `column` holds an ID in `subjects`.
+
+    The IDs are cast to the column's type when they all fit it (so '007'
+    matches the integer 7); otherwise the column is compared as column_ids().
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    value_set = subjects.value_set(column.type)
+    if value_set is None:
+        column = column_ids(column)
+        value_set = subjects.value_set(pa.string())
+    return pc.fill_null(pc.is_in(column, value_set=value_set), False)
+
+
+def erase_columnar(
+    content: bytes, id_field: str, subjects: SubjectSet, file_format: str
+) -> Tuple[bytes, int]:
+    """
+    Remove the rows whose `id_field` is in `subjects` from a Parquet, Arrow
+    IPC or ORC file, one row group / record batch / stripe at a time.
+
+    Returns:
+        tuple: (file in the same format, rows removed)
+    """
+    import pyarrow.compute as pc
+    from columnar import open_batches, write_batches
+
+    if file_format == "parquet":
+        return erase_parquet(content, id_field, subjects)
+
+    schema, batches = open_batches(content, file_format)
+    column = _resolve_id_field(schema.names, id_field, COLUMNAR_FORMATS[file_format])
+    removed = 0
+
+    def filtered():
+        nonlocal removed
+        for batch in batches:
+            matches = subject_mask(batch.column(column), subjects)
+            hits = pc.sum(matches).as_py() or 0
+            removed += hits
+            yield batch.filter(pc.invert(matches)) if hits else batch
+
+    output = write_batches(schema, filtered(), file_format)
+    # Nothing to erase: keep the original bytes rather than a re-encoded copy
+    return (output, removed) if removed else (content, 0)
+
+
+def erase_parquet(
+    content: bytes, id_field: str, subjects: SubjectSet
+) -> Tuple[bytes, int]:
+    """
+    Remove the rows of `subjects` from a Parquet file, pruning with statistics.
+
+    Row groups whose ID min/max statistics rule out every subject are never
+    decoded. Of the others only the ID column is read to find matches. If no
+    row matches, the original bytes are returned untouched; otherwise the
+    file is rewritten row group by row group with its compression kept, and
+    only the row groups with matches are filtered.
+
+    Returns:
+        tuple: (Parquet file, rows removed)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from columnar import parquet_codec, write_batches
+
+    try:
+        parquet = pq.ParquetFile(pa.BufferReader(content))
+    except (pa.ArrowException, OSError):
+        logger.exception("Failed to read Parquet")
+        raise ValueError("Invalid Parquet format")
+    schema, metadata = parquet.schema_arrow, parquet.metadata
+    field = _resolve_id_field(schema.names, id_field, "Parquet")
+    leaf = next(
+        (
+            j
+            for j in range(metadata.num_columns)
+            if metadata.num_row_groups
+            and metadata.row_group(0).column(j).path_in_schema == field
+        ),
+        None,
+    )
+
+    matches, read = {}, 0
+    for i in range(metadata.num_row_groups):
+        if leaf is not None:
+            stats = metadata.row_group(i).column(leaf).statistics
+            if (
+                stats is not None
+                and stats.has_min_max
+                and not subjects.in_range(stats.min, stats.max)
+            ):
+                continue
+        read += 1
+        ids = parquet.read_row_group(i, columns=[field]).column(field)
+        mask = subject_mask(ids, subjects)
+        if pc.any(mask).as_py():
+            matches[i] = mask
+    removed = sum(pc.sum(mask).as_py() for mask in matches.values())
+    logger.info(
+        f"Parquet erasure: {read} of {metadata.num_row_groups} row groups read, "
+        f"{len(matches)} rewritten with rows removed."
+    )
+    if not removed:
+        return content, 0
+
+    def row_groups():
+        for i in range(metadata.num_row_groups):
+            table = parquet.read_row_group(i)
+            if i in matches:
+                table = table.filter(pc.invert(matches[i]))
+            yield table
+
+    options = {"compression": parquet_codec(metadata)}
+    return write_batches(schema, row_groups(), "parquet", options), removed
+
+
+def erase_rows(
+    content, file_format: str, id_field: str, subjects: SubjectSet
+) -> Tuple[bytes, int]:
+    """
+    Remove the rows of `subjects` from content in any supported format.
+
+    Args:
+        content: bytes for columnar formats; str, bytes or a text stream
+            otherwise.
+        file_format (str): Registered format name (e.g. 'csv', 'parquet').
+        id_field (str): Field holding the subject ID.
+        subjects (SubjectSet): IDs to erase.
+
+    Returns:
+        tuple: (rewritten content as bytes, rows removed)
+    """
+    if file_format in COLUMNAR_FORMATS:
+        return erase_columnar(content, id_field, subjects, file_format)
+    if file_format == "csv":
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        return erase_csv(content, id_field, subjects)
+    if file_format == "json":
+        return erase_json(content, id_field, subjects)
+    if file_format == "ndjson":
+        return erase_ndjson(content, id_field, subjects)
+    raise ValueError(f"Erasure is not supported for '{file_format}' files.")
+
+
+def erase_from_prefix(
+    s3, bucket: str, prefix: str, id_field: str, subjects: SubjectSet
+) -> Dict[str, Optional[int]]:
+    """
+    Erase `subjects` from every object under `prefix`, in place.
+
+    The subject index (subject_index.py) narrows the objects read to those
+    that may contain a subject; objects not indexed yet are always read.
+    Rewritten objects keep their format, compression, encoding and metadata,
+    are only replaced if unchanged since they were read (If-Match), and are
+    re-indexed afterwards.
+
+    Returns:
+        dict: key → rows removed for every object read; None where the object
+        changed while it was being processed (run the erasure again).
+    """
+    from compression import compress_bytes
+    from s3_utils import put_object_if_match
+    from subject_index import index_key, index_object, objects_for_subjects, read_object
+
+    results = {}
+    for key, etag in objects_for_subjects(
+        s3, bucket, prefix, id_field, subjects
+    ).items():
+        obj = read_object(s3, bucket, key, etag)
+        try:
+            output, removed = erase_rows(
+                obj["content"], obj["format"], id_field, subjects
+            )
+        except ValueError:
+            # e.g. an object without the ID column holds no subjects
+            logger.warning(f"⚠️ Skipped s3://{bucket}/{key}: not erasable.")
+            results[key] = 0
+            continue
+        if removed:
+            if obj["encoding"]:
+                output = output.decode("utf-8").encode(obj["encoding"])
+            if obj["codec"]:
+                output = compress_bytes(output, obj["codec"])
+            extra = {"Metadata": obj["metadata"]}
+            if obj["content_type"]:
+                extra["ContentType"] = obj["content_type"]
+            if not put_object_if_match(s3, bucket, key, output, obj["etag"], **extra):
+                logger.warning(f"⚠️ s3://{bucket}/{key} changed during erasure.")
+                results[key] = None
+                continue
+            index_object(s3, bucket, prefix, id_field, key)
+            s3.delete_object(
+                Bucket=bucket, Key=index_key(prefix, id_field, key, obj["etag"])
+            )
+        results[key] = removed
+        logger.info(f"🧹 Erased {removed} rows from s3://{bucket}/{key}")
+
+    from metrics import emit
+
+    emit(
+        {
+            "ObjectsRead": len(results),
+            "RowsErased": sum(r or 0 for r in results.values()),
+        },
+        properties={"prefix": f"s3://{bucket}/{prefix}"},
+    )
+    return results
+
+
+def validate_erase_options(options) -> dict:
+    """
+    Check an 'erase_subjects' setting:
+    {'id_field': str, 'subject_ids': [..] or 's3://.../ids.txt'}.
+
+    Raises:
+        TypeError: If it is not an object or id_field is not a string.
+        KeyError: If 'id_field' or 'subject_ids' is missing.
+    """
+    if not isinstance(options, dict):
+        raise TypeError("'erase_subjects' must be an object.")
+    for key in ("id_field", "subject_ids"):
+        if key not in options:
+            raise KeyError(f"Missing 'erase_subjects.{key}'.")
+    if not isinstance(options["id_field"], str) or not options["id_field"]:
+        raise TypeError("'erase_subjects.id_field' must be a non-empty string.")
+    return options
@@ -0,0 +1,169 @@
+# Format registry: maps file extensions and content sniffers to obfuscation engines.
+#
+# obfuscate_handler asks the registry which format a file is in instead of
+# hard-coding an extension chain, so a new format (Avro, ORC, Excel, ...) only
+# needs a register_format() call:
+#
+#   register_format("avro", (".avro",), obfuscate_avro, binary=True,
+#                   sniffer=lambda prefix: prefix.startswith(b"Obj\x01"))
+#
+# Sniffers receive at most SNIFF_SIZE bytes from the start of the file and
+# must decide cheaply, without parsing the whole content.
+import json
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from obfuscator import obfuscate_json, obfuscate_ndjson
+from obfuscator import obfuscate_arrow_ipc, obfuscate_orc, obfuscate_parquet
+from parallel_csv import obfuscate_csv_parallel
+
+# How many bytes from the start of a file the sniffers look at
+SNIFF_SIZE = 4096
+
+# Extensions that say nothing about the content, so the content is sniffed
+SNIFFABLE_EXTENSIONS = ("", ".txt", ".dat", ".data")
+
+
+class FileFormat:
+    """A registered input format and the engine that obfuscates it."""
+
+    def __init__(
+        self,
+        name: str,
+        extensions: Tuple[str, ...],
+        engine: Callable,
+        binary: bool = False,
+        sniffer: Callable[[bytes], bool] = None,
+    ):
+        self.name = name
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.engine = engine
+        self.binary = binary
+        self.sniffer = sniffer
+
+    def __repr__(self):
+        return f"FileFormat({self.name!r})"
+
+
+_registry = OrderedDict()
+
+
+def register_format(
+    name: str,
+    extensions: Tuple[str, ...],
+    engine: Callable,
+    binary: bool = False,
+    sniffer: Callable[[bytes], bool] = None,
+) -> FileFormat:
+    """
+    Register (or replace) an input format.
+
+    Args:
+        name (str): Format name, e.g. 'csv'.
+        extensions (tuple): File extensions including the dot, e.g. ('.csv',).
+        engine (Callable): engine(content, pii_fields) -> bytes. Receives bytes
+            when binary is True, otherwise a str or text stream. Strategies
+            other than 'mask' are passed as a `strategy` keyword argument.
+        binary (bool): Whether the engine needs raw bytes.
+        sniffer (Callable, optional): sniffer(prefix: bytes) -> bool, used when
+            the extension does not identify the format. Sniffers run in
+            registration order, so register more specific formats first.
+
+    Returns:
+        FileFormat: The registered format.
+    """
+    file_format = FileFormat(name, extensions, engine, binary, sniffer)
+    _registry[name] = file_format
+    return file_format
+
+
+def get_format(name: str) -> Optional[FileFormat]:
+    return _registry.get(name)
+
+
+def registered_formats() -> Tuple[FileFormat, ...]:
+    return tuple(_registry.values())
+
+
+def supported_extensions() -> Tuple[str, ...]:
+    return tuple(ext for fmt in _registry.values() for ext in fmt.extensions)
+
+
+def file_extension(uri: str) -> str:
+    """Lower-cased extension of the file name in a URI ('' if none)."""
+    name = uri.rsplit("/", 1)[-1]
+    return "." + name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+
+def format_for_uri(uri: str) -> Optional[FileFormat]:
+    """Look a format up by the file extension of a URI (codec suffix removed)."""
+    extension = file_extension(uri)
+    for file_format in _registry.values():
+        if extension in file_format.extensions:
+            return file_format
+    return None
+
+
+def sniff_format(prefix: bytes) -> Optional[FileFormat]:
+    """Identify a format from the first SNIFF_SIZE bytes of a file."""
+    prefix = prefix[:SNIFF_SIZE]
+    for file_format in _registry.values():
+        if file_format.sniffer and file_format.sniffer(prefix):
+            return file_format
+    return None
+
+
+# --- Built-in sniffers ---------------------------------------------------------
+
+
+def _text_prefix(prefix: bytes) -> str:
+    # Strip a UTF-8 BOM; a multi-byte character cut at the end is ignored
+    return prefix.decode("utf-8-sig", errors="ignore").lstrip()
+
+
+def _sniff_parquet(prefix: bytes) -> bool:
+    return prefix.startswith(b"PAR1")
+
+
+def _sniff_arrow(prefix: bytes) -> bool:
+    # IPC file format starts with "ARROW1"; the stream format with a
+    # continuation marker followed by the schema message
+    return prefix.startswith(b"ARROW1") or prefix.startswith(b"\xff\xff\xff\xff")
+
+
+def _sniff_orc(prefix: bytes) -> bool:
+    return prefix.startswith(b"ORC")
+
+
+def _sniff_ndjson(prefix: bytes) -> bool:
+    lines = _text_prefix(prefix).split("\n")
+    # Needs one complete object line followed by the start of another
+    if len(lines) < 2 or not lines[1].lstrip().startswith("{"):
+        return False
+    try:
+        return isinstance(json.loads(lines[0]), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+def _sniff_json(prefix: bytes) -> bool:
+    return _text_prefix(prefix).startswith(("{", "["))
+
+
+def _sniff_csv(prefix: bytes) -> bool:
+    text = _text_prefix(prefix)
+    header = text.split("\n", 1)[0]
+    return bool(header) and "," in header and not text.startswith(("{", "["))
+
+
+register_format("parquet", (".parquet", ".pq"), obfuscate_parquet, True, _sniff_parquet)
+register_format(
+    "arrow",
+    (".arrow", ".feather", ".ipc", ".arrows"),
+    obfuscate_arrow_ipc,
+    True,
+    _sniff_arrow,
+)
+register_format("orc", (".orc",), obfuscate_orc, True, _sniff_orc)
+register_format("ndjson", (".ndjson", ".jsonl"), obfuscate_ndjson, False, _sniff_ndjson)
+register_format("json", (".json",), obfuscate_json, False, _sniff_json)
+register_format("csv", (".csv",), obfuscate_csv_parallel, False, _sniff_csv)
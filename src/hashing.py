@@ -0,0 +1,39 @@
+# Stable fingerprints used to recognise work that has already been done:
+# the "plan" (what is obfuscated and how) and the content of an output.
+import hashlib
+import json
+from typing import List
+
+
+def plan_hash(pii_fields: List[str], strategy: str = "mask", **options) -> str:
+    """
+    Fingerprint an obfuscation plan.
+
+    Field order and case do not matter (matching is case-insensitive), so
+    ["Email", "name"] and ["name", "email"] produce the same hash.
+
+    Args:
+        pii_fields (List[str]): Fields to obfuscate.
+        strategy (str): Obfuscation strategy.
+        **options: Any other settings that change the output (e.g. output format).
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    plan = {
+        "pii_fields": sorted({field.lower() for field in pii_fields}),
+        "strategy": strategy,
+        "options": {k: v for k, v in options.items() if v is not None},
+    }
+    encoded = json.dumps(plan, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def content_sha256(data: bytes) -> str:
+    """Hex SHA-256 digest of an output body."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_etag(etag: str) -> str:
+    """S3 returns ETags quoted in API responses but unquoted in event records."""
+    return etag.strip('"') if etag else etag
@@ -0,0 +1,347 @@
+# Incremental processing of append-only prefixes.
+#
+# A nightly run over a landing prefix should only obfuscate what arrived since
+# the last run. The processed-object manifest records the key, ETag and
+# processed-at time of every object already handled; a run lists the prefix
+# (paginated), diffs the listing against the manifest and processes only new
+# objects and objects whose ETag changed, so the work done is proportional to
+# the new data rather than to the whole prefix.
+#
+# PROCESSED_MANIFEST_LOCATION selects where manifests live: a local directory
+# or s3://bucket/prefix, with one manifest per source bucket and prefix.
+#
+# - An object is recorded once its outcome is final: written, already up to
+#   date, or output already present (409) for an object new to the manifest.
+#   An object whose ETag changed is processed with refresh semantics, so its
+#   output is rewritten rather than answered with 409.
+# - Permanent failures (unsupported format, unparseable content, object gone)
+#   are recorded as rejected and not retried until the object changes; only
+#   transient failures, unfinished checkpointed jobs and objects without a
+#   rule are tried again next run.
+# - The manifest is saved every MANIFEST_SAVE_SECONDS and at the end, so a run
+#   that stops early (deadline or crash) loses at most that much progress.
+# - Entries of objects no longer listed are dropped, so the manifest never
+#   outgrows the prefix.
+# - Subject index entries (_subject_index/) and outputs written back under
+#   the prefix (exclude_prefixes, e.g. a rule's output_prefix) are not data
+#   and are never listed as pending.
+#
+# Runs over one prefix must not overlap: the last manifest written wins.
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from hashing import normalize_etag
+from metrics import emit
+from subject_index import INDEX_DIR
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/incremental.log")
+
+MANIFEST_ENV = "PROCESSED_MANIFEST_LOCATION"
+
+MANIFEST_VERSION = 1
+# Save progress at least this often during a long run
+MANIFEST_SAVE_SECONDS = 30.0
+# Outcomes after which an object is not processed again; 409 (output already
+# present) only for objects the manifest has not seen before
+FINAL_STATUS_CODES = (200, 409)
+
+
+def manifest_name(bucket: str, prefix: str) -> str:
+    """Identify the manifest of one source bucket and prefix."""
+    identity = json.dumps([bucket, prefix])
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
+
+class LocalManifestStore:
+    """Manifests as JSON files in a local directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.json")
+
+    def load(self, name: str) -> Optional[dict]:
+        try:
+            with open(self._path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, name: str, manifest: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temp file first so a crash never leaves half a manifest
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def location(self, name: str) -> Optional[Tuple[str, str]]:
+        return None
+
+
+class S3ManifestStore:
+    """Manifests as JSON objects in S3."""
+
+    def __init__(self, s3, bucket: str, prefix: str = ""):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/" if prefix else ""
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}{name}.json"
+
+    def load(self, name: str) -> Optional[dict]:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def save(self, name: str, manifest: dict):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._key(name),
+            Body=json.dumps(manifest).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def location(self, name: str) -> Optional[Tuple[str, str]]:
+        """(bucket, key) of a manifest, e.g. to keep it out of listings."""
+        return self.bucket, self._key(name)
+
+
+def get_manifest_store(s3, location: str = None):
+    """
+    The store at `location`, or PROCESSED_MANIFEST_LOCATION.
+
+    Raises:
+        ValueError: If neither is set.
+    """
+    location = location or os.getenv(MANIFEST_ENV)
+    if not location:
+        raise ValueError(
+            f"Incremental runs need a processed-object manifest: set {MANIFEST_ENV}."
+        )
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        return S3ManifestStore(s3, bucket, prefix)
+    return LocalManifestStore(location)
+
+
+def parse_prefix_uri(uri) -> Tuple[str, str]:
+    """
+    e.g. 's3://bucket/landing/' → ('bucket', 'landing/')
+
+    Raises:
+        ValueError: If `uri` is not an s3:// URI with a bucket.
+    """
+    if not isinstance(uri, str) or not uri.startswith("s3://"):
+        raise ValueError("'incremental' must be an s3://bucket/prefix/ URI.")
+    bucket, _, prefix = uri[len("s3://") :].partition("/")
+    if not bucket:
+        raise ValueError("'incremental' must be an s3://bucket/prefix/ URI.")
+    return bucket, prefix
+
+
+def list_prefix(
+    s3, bucket: str, prefix: str, exclude=(), exclude_prefixes=()
+) -> Dict[str, str]:
+    """
+    Every data object under `prefix`: key → ETag, one paginated listing.
+
+    Args:
+        exclude: (bucket, key) pairs to leave out.
+        exclude_prefixes: Key prefixes to leave out. Subject index entries
+            are always left out.
+    """
+    objects = {}
+    exclude_prefixes = tuple(exclude_prefixes)
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/") or (bucket, key) in exclude:
+                continue
+            if f"/{INDEX_DIR}" in f"/{key}" or key.startswith(exclude_prefixes):
+                continue
+            objects[key] = normalize_etag(obj["ETag"])
+    return objects
+
+
+def pending_objects(listing: Dict[str, str], processed: dict) -> List[tuple]:
+    """(key, ETag) of listed objects that are new or changed since processed."""
+    return [
+        (key, etag)
+        for key, etag in listing.items()
+        if processed.get(key, {}).get("etag") != etag
+    ]
+
+
+def run_incremental(
+    s3,
+    bucket: str,
+    prefix: str,
+    process: Callable[[str, str, bool], dict],
+    store,
+    workers: int = 8,
+    deadline: float = None,
+    exclude_prefixes=(),
+) -> dict:
+    """
+    Process the objects under `prefix` that the manifest has not seen.
+
+    Args:
+        s3 (boto3.client): S3 client used for the listing.
+        bucket (str): Source bucket.
+        prefix (str): Source prefix.
+        process (Callable): process(key, etag, changed) -> dict with
+            'statusCode' (and 'incomplete' for unfinished checkpointed jobs,
+            'permanent' for failures a retry cannot fix). `changed` is True
+            when the manifest holds an older ETag of the object, whose
+            output must then be replaced.
+        store: Manifest store from get_manifest_store().
+        workers (int): Objects processed concurrently.
+        deadline (float, optional): time.monotonic() value after which no
+            new object is started.
+        exclude_prefixes: Key prefixes under `prefix` that hold no input,
+            e.g. where outputs are written.
+
+    Returns:
+        dict: 'listed', 'pending', 'processed' (recorded in the manifest),
+        'skipped' (no rule), 'rejected' (permanent failures, recorded in the
+        manifest), 'failed', 'remaining' (not started before the deadline)
+        and 'failures' with the key, status and body of each failure that
+        is retried next run.
+    """
+    name = manifest_name(bucket, prefix)
+    manifest = store.load(name) or {}
+    # The manifest itself may live under the prefix
+    listing = list_prefix(
+        s3,
+        bucket,
+        prefix,
+        exclude={store.location(name)},
+        exclude_prefixes=exclude_prefixes,
+    )
+    # Forget objects that are gone, so the manifest tracks the prefix
+    processed = {
+        key: entry
+        for key, entry in manifest.get("objects", {}).items()
+        if key in listing
+    }
+    pending = pending_objects(listing, processed)
+    logger.info(
+        f"🗂️ s3://{bucket}/{prefix}: {len(listing)} objects listed, "
+        f"{len(pending)} new or changed."
+    )
+
+    def save():
+        store.save(
+            name,
+            {
+                "version": MANIFEST_VERSION,
+                "bucket": bucket,
+                "prefix": prefix,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "objects": processed,
+            },
+        )
+
+    summary = dict.fromkeys(("processed", "skipped", "rejected", "failed"), 0)
+    failures = []
+    queue = iter(pending)
+    started = 0
+    saved = time.monotonic()
+    dirty = len(processed) != len(manifest.get("objects", {}))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        running = {}
+
+        def submit_next():
+            nonlocal started
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            item = next(queue, None)
+            if item is not None:
+                key, etag = item
+                changed = key in processed
+                running[pool.submit(process, key, etag, changed)] = item + (changed,)
+                started += 1
+
+        # Keep a few objects queued per worker, so no worker waits on the loop
+        for _ in range(max(1, workers) * 2):
+            submit_next()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, etag, changed = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.exception(f"Unexpected error while processing {key}")
+                    result = {"statusCode": 500, "body": str(e)}
+                status = result["statusCode"]
+                # A changed object answered with 409 still has a stale output
+                final = status in FINAL_STATUS_CODES and not (status == 409 and changed)
+                if final and not result.get("incomplete"):
+                    processed[key] = {
+                        "etag": etag,
+                        "processed_at": datetime.now(timezone.utc).isoformat(),
+                    }
+                    summary["processed"] += 1
+                    dirty = True
+                elif status == 204:
+                    summary["skipped"] += 1
+                elif result.get("permanent"):
+                    # Same ETag, same failure: wait for the object to change
+                    processed[key] = {
+                        "etag": etag,
+                        "processed_at": datetime.now(timezone.utc).isoformat(),
+                        "rejected": {"statusCode": status, "body": result.get("body")},
+                    }
+                    summary["rejected"] += 1
+                    dirty = True
+                else:
+                    summary["failed"] += 1
+                    failures.append(
+                        {"key": key, "statusCode": status, "body": result.get("body")}
+                    )
+                submit_next()
+            if dirty and time.monotonic() - saved >= MANIFEST_SAVE_SECONDS:
+                save()
+                saved, dirty = time.monotonic(), False
+    if dirty:
+        save()
+
+    summary.update(
+        listed=len(listing),
+        pending=len(pending),
+        remaining=len(pending) - started,
+        failures=failures,
+    )
+    emit(
+        {
+            "ObjectsListed": summary["listed"],
+            "ObjectsPending": summary["pending"],
+            "ObjectsProcessed": summary["processed"],
+            "ObjectsRejected": summary["rejected"],
+            "ObjectsFailed": summary["failed"],
+        },
+        {"Prefix": f"{bucket}/{prefix}"},
+    )
+    return summary
@@ -1,10 +1,71 @@
 # main handler (src/main.py)
+import csv
 import os
 import urllib.parse
 import argparse
 import json
-from s3_utils import fetch_file_from_s3, is_valid_s3_uri, get_s3_client
-from obfuscator import obfuscate_csv, obfuscate_json, obfuscate_parquet
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from s3_utils import (
+    ENCODING_SAMPLE_SIZE,
+    detect_encoding,
+    fetch_file_from_s3,
+    is_valid_s3_uri,
+    get_s3_client,
+    get_object_etag,
+    open_s3_stream,
+    open_text_stream,
+    put_object_if_absent,
+    read_s3_prefix,
+)
+from compression import (
+    CODECS,
+    compress_bytes,
+    open_decompressed,
+    peek_decompressed,
+    sniff_compression,
+    split_compression_suffix,
+)
+from result_cache import get_local_cache, get_manifest_cache, result_cache_key
+from hashing import plan_hash, content_sha256, normalize_etag
+from obfuscator import STRATEGIES
+from formats import (
+    SNIFF_SIZE,
+    SNIFFABLE_EXTENSIONS,
+    file_extension,
+    format_for_uri,
+    get_format,
+    sniff_format,
+    supported_extensions,
+)
+from rules import get_rule_table
+from erasure import (
+    erase_from_prefix,
+    erase_rows,
+    load_subject_ids,
+    validate_erase_options,
+)
+from metrics import emit
+from throttling import emit_s3_metrics
+from sharding import (
+    STREAMABLE_FORMATS,
+    delete_stale_parts,
+    manifest_key,
+    stream_sharded_output,
+    write_sharded_output,
+)
+from checkpoint import (
+    checkpoint_min_size,
+    get_checkpoint_store,
+    obfuscate_csv_checkpointed,
+)
+from converters import (
+    OUTPUT_FORMATS,
+    convert_output,
+    validate_parquet_options,
+)
 from exceptions import UnsupportedFormatError
 from utils.logging_utils import setup_file_logger
 from exceptions import S3ObjectNotFoundError
@@ -13,12 +74,28 @@ logger = setup_file_logger(__name__, "logs/main.log")
 
 
 # Fully validated: JSON, required keys, types, format, and extension ✅
-def obfuscate_handler(json_input: str, encoding_override: str = None) -> bytes:
+def obfuscate_handler(json_input: str, encoding_override: str = None, s3=None) -> bytes:
     """
     Main handler to process input, fetch the file, and return obfuscated output.
 
     Args:
         json_input (str): JSON string with 'file_to_obfuscate' and 'pii_fields'.
+            Optional keys: 'strategy' ('mask', 'tokenize' for reversible
+            tokens kept in the TOKEN_VAULT vault, or 'drop' to leave the PII
+            fields out of the output), 'output_format' (csv,
+            json, ndjson or parquet; defaults to the input format),
+            'parquet_options'
+            ({'compression': 'snappy', 'row_group_size': 131072}) and
+            'output_compression' (gzip, zstd or snappy). Inputs ending in
+            .gz, .zst or .snappy are decompressed transparently. 'profile':
+            true profiles the run (see profiling.py). 'erase_subjects'
+            ({'id_field': 'student_id', 'subject_ids': [...] or an s3:// list
+            of IDs}) removes those subjects' rows first; 'pii_fields' may
+            then be omitted. 'plan': true returns a JSON report of the
+            object (or of every object under a prefix ending in '/'), its
+            matched and missing fields and the estimated runtime, reading
+            only headers and footers (see planning.py).
+        s3 (boto3.client, optional): Shared S3 client to fetch the file with.
 
     Returns:
         bytes: Obfuscated file content as bytes for upload to S3.
@@ -28,50 +105,229 @@ def obfuscate_handler(json_input: str, encoding_override: str = None) -> bytes:
     except json.JSONDecodeError:
         raise ValueError("Invalid JSON input.")
 
+    if isinstance(payload, dict) and payload.get("profile") is not None:
+        from profiling import profiled, validate_profile_option
+
+        if validate_profile_option(payload.pop("profile")):
+            with profiled(str(payload.get("file_to_obfuscate") or "run"), s3=s3):
+                return obfuscate_handler(json.dumps(payload), encoding_override, s3)
+
     if "file_to_obfuscate" not in payload:
         raise KeyError("Missing 'file_to_obfuscate'.")
     if not payload["file_to_obfuscate"]:
         raise ValueError("Empty 'file_to_obfuscate'.")
 
+    erase = payload.get("erase_subjects")
+    if erase is not None:
+        validate_erase_options(erase)
+
     # KeyError raised when the key is missing
     # ValueError or TypeError raised only when values are present but invalid
-    if "pii_fields" not in payload:
+    if "pii_fields" not in payload and erase is None:
         raise KeyError("Missing 'pii_fields'.")
-    if not isinstance(payload["pii_fields"], list):
+    if not isinstance(payload.get("pii_fields", []), list):
         raise TypeError("'pii_fields' must be a list.")
-    if not payload["pii_fields"]:
+    if not payload.get("pii_fields") and erase is None:
         raise ValueError("'pii_fields' cannot be empty.")
 
+    strategy = payload.get("strategy", "mask")
+    if strategy not in STRATEGIES:
+        raise ValueError(
+            f"Unsupported strategy '{strategy}'. Supported: {', '.join(STRATEGIES)}."
+        )
+
+    output_format = payload.get("output_format")
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output format '{output_format}'. "
+            f"Supported: {', '.join(OUTPUT_FORMATS)}."
+        )
+    parquet_options = validate_parquet_options(payload.get("parquet_options"))
+
     s3_uri = payload["file_to_obfuscate"]
-    pii_fields = payload["pii_fields"]
+    pii_fields = payload.get("pii_fields", [])
+
+    output_compression = payload.get("output_compression")
+    if output_compression is not None and output_compression not in CODECS:
+        raise ValueError(
+            f"Unsupported output compression '{output_compression}'. "
+            f"Supported: {', '.join(CODECS)}."
+        )
 
     if not is_valid_s3_uri(s3_uri):
         raise ValueError("Invalid S3 URI format.")
 
-    if s3_uri.lower().endswith(".csv"):
-        file_format = "csv"
-        binary = False
-    elif s3_uri.lower().endswith(".json"):
-        file_format = "json"
-        binary = False
-    elif s3_uri.lower().endswith(".parquet"):
-        file_format = "parquet"
-        binary = True
+    # 📋 Dry run: report fields and estimated cost without reading any body
+    if payload.get("plan") is not None:
+        from planning import plan, validate_plan_option
+
+        if validate_plan_option(payload["plan"]):
+            report = plan(
+                s3 or get_s3_client(), s3_uri, pii_fields, payload.get("input_format")
+            )
+            return json.dumps(report, indent=2).encode("utf-8")
+
+    # e.g. sample.csv.gz → format from 'sample.csv', decompressed with gzip
+    base_uri, input_compression = split_compression_suffix(s3_uri)
+    file_format, input_compression = _resolve_format(
+        payload, base_uri, s3_uri, input_compression, s3
+    )
+    binary = file_format.binary
+
+    # ♻️ Result cache: an unchanged input with the same plan is served from disk
+    # after a single HEAD, without downloading or parsing the file again.
+    # Erasures are never cached: the subject list is not part of the key.
+    cache = get_local_cache() if erase is None else None
+    if cache is not None:
+        s3 = s3 or get_s3_client()
+        bucket, key = s3_uri.replace("s3://", "").split("/", 1)
+        cache_key = result_cache_key(
+            bucket,
+            key,
+            get_object_etag(s3, bucket, key),
+            pii_fields,
+            strategy,
+            input_format=file_format.name,
+            encoding=encoding_override,
+            output_format=output_format,
+            parquet_options=parquet_options if output_format == "parquet" else None,
+            output_compression=output_compression,
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info("♻️ Result cache hit. Skipping download and obfuscation.")
+            return cached
+
+    if input_compression:
+        # Decompress while parsing: the file is never fully inflated in memory
+        # (Parquet needs random access, so it is read into memory in full)
+        stream = open_decompressed(open_s3_stream(s3_uri, s3=s3), input_compression)
+        if binary:
+            file_data = stream.read()
+        else:
+            file_data = open_text_stream(stream, encoding_override)
+    else:
+        file_data = fetch_file_from_s3(s3_uri, encoding_override, binary=binary, s3=s3)
+
+    # 🧹 Right to erasure: drop the subjects' rows before masking the rest
+    if erase is not None:
+        subjects = load_subject_ids(erase["subject_ids"], s3=s3)
+        file_data, removed = erase_rows(
+            file_data, file_format.name, erase["id_field"], subjects
+        )
+        logger.info(f"🧹 Erased {removed} rows from {s3_uri}")
+        emit(
+            {"RowsErased": removed},
+            {"Format": file_format.name},
+            properties={"file": s3_uri},
+        )
+
+    # 🔍 Dispatch to the engine registered for the format
+    if pii_fields and strategy != "mask":
+        result = file_format.engine(file_data, pii_fields, strategy=strategy)
+    elif pii_fields:
+        result = file_format.engine(file_data, pii_fields)
     else:
+        result = file_data
+
+    if output_format and output_format != file_format.name:
+        result = convert_output(
+            result, file_format.name, output_format, parquet_options
+        )
+
+    if output_compression:
+        result = compress_bytes(result, output_compression)
+
+    if cache is not None:
+        cache.put(cache_key, result)
+    return result
+
+
+def _resolve_format(payload: dict, base_uri: str, s3_uri: str, compression, s3):
+    """
+    Pick the input format: explicit 'input_format', then the file extension,
+    then (for extension-less or generic names like .txt) a sniff of the first
+    few KB fetched with a ranged GET.
+
+    Returns:
+        tuple: (FileFormat, compression codec or None)
+    """
+    if payload.get("input_format") is not None:
+        file_format = get_format(payload["input_format"])
+        if file_format is None:
+            raise UnsupportedFormatError(
+                f"Unsupported input format '{payload['input_format']}'."
+            )
+        return file_format, compression
+
+    file_format = format_for_uri(base_uri)
+    if file_format is None and file_extension(base_uri) in SNIFFABLE_EXTENSIONS:
+        prefix = read_s3_prefix(s3_uri, SNIFF_SIZE, s3=s3)
+        compression = compression or sniff_compression(prefix)
+        if compression:
+            prefix = peek_decompressed(prefix, compression, SNIFF_SIZE)
+        file_format = sniff_format(prefix)
+        if file_format is not None:
+            logger.info(f"🔍 Sniffed input format: {file_format.name}")
+
+    if file_format is None:
         raise UnsupportedFormatError(
-            "Only .csv, .json, and .parquet files are supported."
+            f"Only {', '.join(supported_extensions())} files are supported "
+            "(optionally compressed with .gz, .zst or .snappy)."
         )
+    return file_format, compression
+
+
+def _write_shards(
+    s3,
+    s3_uri: str,
+    payload: dict,
+    output_bucket: str,
+    output_key: str,
+    shard: dict,
+    compression: str = None,
+    manifest_extra: dict = None,
+) -> dict:
+    """
+    Obfuscate an input into part files under shard_prefix(output_key).
+
+    CSV, NDJSON and columnar inputs are streamed: parts are uploaded while
+    the rest of the input is being obfuscated. JSON documents and outputs
+    converted to another format are obfuscated in full first.
 
-    file_data = fetch_file_from_s3(s3_uri, encoding_override, binary=binary)
+    Returns:
+        dict: The manifest of the parts (see sharding.py).
+    """
+    base_uri, codec = split_compression_suffix(s3_uri)
+    input_format, codec = _resolve_format(payload, base_uri, s3_uri, codec, s3)
+    output_format = payload.get("output_format") or input_format.name
+    if output_format != input_format.name or output_format not in STREAMABLE_FORMATS:
+        payload = dict(payload, output_format=output_format)
+        return write_sharded_output(
+            s3,
+            output_bucket,
+            output_key,
+            obfuscate_handler(json.dumps(payload), s3=s3),
+            output_format,
+            shard,
+            compression=compression,
+            manifest_extra=manifest_extra,
+        )
 
-    # 🔍 Check file extension
-    if file_format == "csv":
-        return obfuscate_csv(file_data, pii_fields)
-    elif file_format == "json":
-        return obfuscate_json(file_data, pii_fields)
-    elif file_format == "parquet":
-        return obfuscate_parquet(file_data, pii_fields)
-    # return obfuscate_csv(file_data, pii_fields)
+    stream = open_decompressed(open_s3_stream(s3_uri, s3=s3), codec)
+    source = stream.read() if input_format.binary else open_text_stream(stream)
+    return stream_sharded_output(
+        s3,
+        output_bucket,
+        output_key,
+        source,
+        output_format,
+        payload["pii_fields"],
+        payload["strategy"],
+        shard,
+        compression=compression,
+        manifest_extra=manifest_extra,
+    )
 
 
 # LAMBDA HANDLER
@@ -83,80 +339,621 @@ def obfuscate_handler(json_input: str, encoding_override: str = None) -> bytes:
 # Return a response (or optionally write back to S3)
 
 
-def lambda_handler(event, context):
+def _extract_s3_records(event) -> list:
     """
-    Lambda handler triggered by an S3 PutObject event.
+    Flatten an S3 or SQS-wrapped S3 notification into a list of targets.
 
-    Reads the uploaded file, obfuscates it, and writes the result to a new S3 location.
+    Returns:
+        list: dicts with 'bucket', 'key', 'etag' and 'message_id' (the SQS
+        messageId, or None for direct S3 notifications). SQS messages whose
+        body cannot be parsed are returned with an 'error' entry instead.
     """
+    targets = []
+    for record in event.get("Records", []):
+        if record.get("eventSource") == "aws:sqs":
+            message_id = record.get("messageId")
+            try:
+                s3_event = json.loads(record["body"])
+            except (KeyError, TypeError, json.JSONDecodeError):
+                targets.append(
+                    {"message_id": message_id, "error": "Invalid SQS message body"}
+                )
+                continue
+            # S3 sends an "s3:TestEvent" with no Records when wiring up a queue
+            inner_records = s3_event.get("Records", [])
+        else:
+            message_id = None
+            inner_records = [record]
+
+        for inner in inner_records:
+            try:
+                targets.append(
+                    {
+                        "message_id": message_id,
+                        "bucket": inner["s3"]["bucket"]["name"],
+                        "key": urllib.parse.unquote_plus(inner["s3"]["object"]["key"]),
+                        "etag": inner["s3"]["object"].get("eTag"),
+                    }
+                )
+            except (KeyError, TypeError):
+                targets.append({"message_id": message_id, "error": "Invalid S3 record"})
+    return targets
+
+
+def _resolve_force(event) -> bool:
+    # Check if the output file already exists
+    force = event.get("force")
+    if force is None:
+        env = os.getenv("ENV", "dev").lower()
+        if env == "dev":
+            force = True
+        else:
+            force = os.getenv("FORCE_OVERWRITE", "false").lower() == "true"
+    return force
+
+
+def _resolve_refresh(event) -> bool:
+    # Rewrite outputs only when their input or plan changed
+    refresh = event.get("refresh")
+    if refresh is None:
+        refresh = os.getenv("REFRESH_OUTPUTS", "false").lower() == "true"
+    return refresh
+
+
+# Outputs written by this container: (bucket, key) → (source ETag, plan hash).
+# Lets duplicate deliveries and retries skip work without any S3 round trip.
+_recent_outputs = OrderedDict()
+_recent_outputs_lock = threading.Lock()
+_RECENT_OUTPUTS_MAX = 1024
+
+
+def _remember_output(bucket: str, key: str, source_etag: str, plan: str):
+    if not source_etag:
+        return
+    with _recent_outputs_lock:
+        _recent_outputs[(bucket, key)] = (source_etag, plan)
+        _recent_outputs.move_to_end((bucket, key))
+        while len(_recent_outputs) > _RECENT_OUTPUTS_MAX:
+            _recent_outputs.popitem(last=False)
+
+
+def _is_recent_output(bucket: str, key: str, source_etag: str, plan: str) -> bool:
+    with _recent_outputs_lock:
+        return bool(source_etag) and _recent_outputs.get((bucket, key)) == (
+            source_etag,
+            plan,
+        )
+
+
+def _head_metadata(s3, bucket: str, key: str):
+    """Return (metadata, etag) of an object, or (None, None) if it is missing."""
     try:
-        # Extract bucket and key from the event
-        record = event["Records"][0]
-        bucket = record["s3"]["bucket"]["name"]
-        key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except s3.exceptions.ClientError as e:
+        # If 404 (NoSuchKey), there is nothing there yet
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        return None, None
+    return response.get("Metadata", {}), normalize_etag(response.get("ETag"))
 
-        s3_uri = f"s3://{bucket}/{key}"
 
-        # Hardcoded for demo: fields to obfuscate
-        pii_fields = ["name", "email"]
+def _replace_metadata(s3, bucket: str, key: str, etag: str, metadata: dict):
+    """Rewrite an object's metadata in place, unless it changed since `etag`."""
+    try:
+        s3.copy_object(
+            Bucket=bucket,
+            Key=key,
+            CopySource={"Bucket": bucket, "Key": key},
+            CopySourceIfMatch=etag,
+            Metadata=metadata,
+            MetadataDirective="REPLACE",
+        )
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] not in ("PreconditionFailed", "412"):
+            raise
+        # Another writer replaced the output; its metadata is its own
+        logger.info(f"s3://{bucket}/{key} changed; metadata left as it is.")
 
-        # Build JSON payload
-        payload = {"file_to_obfuscate": s3_uri, "pii_fields": pii_fields}
 
-        obfuscated_data = obfuscate_handler(json.dumps(payload))
+def _build_output_key(rule: dict, key: str) -> str:
+    """e.g. uploads/data.csv.gz → obfuscated/data.parquet.zst, per the rule."""
+    name, _ = split_compression_suffix(key.split("/")[-1])
+    if rule["output_format"]:
+        name = f"{name.rsplit('.', 1)[0]}.{rule['output_format']}"
+    if rule["output_compression"]:
+        name += CODECS[rule["output_compression"]][0]
+    return f"{rule['output_prefix']}{name}"
 
-        # Define output location: write to 'obfuscated/' folder in same bucket
-        output_key = f"obfuscated/{key.split('/')[-1]}"
-        s3 = get_s3_client()
 
-        # Check if the output file already exists
-        force = event.get("force")
-        if force is None:
-            env = os.getenv("ENV", "dev").lower()
-            if env == "dev":
-                force = True
-            else:
-                force = os.getenv("FORCE_OVERWRITE", "false").lower() == "true"
+def _checkpoint_size(s3, bucket: str, key: str, rule: dict):
+    """Size of the input if it qualifies for checkpointed processing, else None."""
+    file_format = format_for_uri(key)
+    if (
+        file_format is None
+        or file_format.name != "csv"
+        or rule["output_format"] not in (None, "csv")
+        or rule["output_compression"]
+        or rule.get("shard")
+    ):
+        return None
+    size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    if size < checkpoint_min_size():
+        return None
+    # Segments are cut at newlines, which is only safe for UTF-8 (and ASCII)
+    sample = read_s3_prefix(f"s3://{bucket}/{key}", ENCODING_SAMPLE_SIZE, s3=s3)
+    if detect_encoding(sample).lower() not in ("ascii", "utf-8"):
+        return None
+    return size
 
-        # logger.info(f"Lambda running in ENV={env.upper()}, force={force}")
-        logger.info(f"Force overwrite is set to: force={force}")
 
-        if not force:
-            try:
-                s3.head_object(Bucket=bucket, Key=output_key)
-                # If no exception: the object exists → don't overwrite
-                logger.warning(
-                    "⚠️ Output file already exists at "
-                    f"s3://{bucket}/{output_key}. Skipping write."
-                )
-                return {
-                    "statusCode": 409,
-                    "body": f"File already exists: s3://{bucket}/{output_key}",
-                }
-            except s3.exceptions.ClientError as e:
-                # If 404 (NoSuchKey), it's okay to write the new file
-                if e.response["Error"]["Code"] != "404":
-                    raise
+def _process_s3_object(
+    s3, bucket: str, key: str, force: bool, etag=None, deadline=None, refresh=False
+) -> dict:
+    """
+    Obfuscate one S3 object according to the rules table and write the result.
 
-        # logger.info(f"📝 Writing obfuscated file to s3://{bucket}/{output_key}")
-        # logger.info(f"Obfuscated data: {obfuscated_data[:100]}")  # preview
-        s3.put_object(Bucket=bucket, Key=output_key, Body=obfuscated_data)
+    With force, the output is always rewritten. Without it, the write is a
+    single conditional PUT and an existing output is a 409 conflict.
 
-        logger.info(f"✅ Obfuscated file written to s3://{bucket}/{output_key}")
+    Outputs carry the source ETag, plan hash and content SHA-256 as metadata.
+    With refresh (and no force), an existing output is only replaced when it
+    came from another version of the input or another plan: unchanged inputs
+    are not re-obfuscated, and identical results are not re-uploaded.
 
-        return {
+    With CHECKPOINT_LOCATION set, large UTF-8 CSVs are written as a multipart
+    upload with a checkpoint after every part; when `deadline` (a
+    time.monotonic() value) passes, processing stops at the last checkpoint
+    and a later attempt resumes from there.
+
+    Returns:
+        dict: 'statusCode' and 'body' for this object ('unchanged' is True
+        when the existing output was already up to date, 'incomplete' is True
+        when a checkpointed job stopped before the end and must be retried,
+        'permanent' is True when retrying the same object cannot succeed).
+    """
+    s3_uri = f"s3://{bucket}/{key}"
+
+    try:
+        # Fields, strategy and output location come from the rules table
+        rule = get_rule_table(s3=s3).resolve(key)
+        if rule is None:
+            logger.info(f"No obfuscation rule matches s3://{bucket}/{key}. Skipping.")
+            return {"statusCode": 204, "body": f"No rule matches {s3_uri}"}
+
+        output_key = _build_output_key(rule, key)
+        shard = rule.get("shard")
+        if shard:
+            # Parts are written first; the manifest marks the output complete
+            single_key, output_key = output_key, manifest_key(output_key)
+        output_bucket = rule["output_bucket"] or bucket
+        output_uri = f"s3://{output_bucket}/{output_key}"
+        plan = plan_hash(
+            rule["pii_fields"],
+            rule["strategy"],
+            output_format=rule["output_format"],
+            output_compression=rule["output_compression"],
+            shard=shard,
+        )
+        # S3 notifications carry the ETag; other callers cost one HEAD
+        source_etag = normalize_etag(etag)
+        if source_etag is None:
+            _, source_etag = _head_metadata(s3, bucket, key)
+        up_to_date = {
             "statusCode": 200,
-            "body": f"Obfuscated file written to s3://{bucket}/{output_key}",
+            "body": f"Output is up to date: {output_uri}",
+            "unchanged": True,
+        }
+
+        if not force and _is_recent_output(
+            output_bucket, output_key, source_etag, plan
+        ):
+            logger.info(f"Output {output_uri} already written for this input.")
+            return up_to_date
+
+        # Write over an existing output (always with force, else if stale)
+        overwrite = force or refresh
+        existing = existing_etag = None
+        if refresh and not force:
+            # One HEAD tells us whether the previous output came from this input
+            existing, existing_etag = _head_metadata(s3, output_bucket, output_key)
+            if (
+                existing
+                and existing.get("plan-hash") == plan
+                and existing.get("source-etag") == source_etag
+            ):
+                logger.info(f"Input unchanged since {output_uri} was written.")
+                _remember_output(output_bucket, output_key, source_etag, plan)
+                return up_to_date
+
+        # ♻️ Result cache: the same input and plan were already obfuscated
+        # elsewhere, so copy that output server-side instead of reprocessing.
+        manifest = get_manifest_cache(s3)
+        # None when the format is sniffed from the content (covered by the ETag)
+        input_format = format_for_uri(split_compression_suffix(s3_uri)[0])
+        cache_key = result_cache_key(
+            bucket,
+            key,
+            source_etag,
+            rule["pii_fields"],
+            rule["strategy"],
+            input_format=input_format and input_format.name,
+            output_format=rule["output_format"],
+            output_compression=rule["output_compression"],
+        )
+        if manifest is not None and source_etag and not shard:
+            entry = manifest.lookup(cache_key)
+            if entry and (entry["bucket"], entry["key"]) != (output_bucket, output_key):
+                if not overwrite and _head_metadata(s3, output_bucket, output_key)[1]:
+                    logger.warning(f"⚠️ Output file already exists at {output_uri}.")
+                    return {
+                        "statusCode": 409,
+                        "body": f"File already exists: {output_uri}",
+                    }
+                if manifest.copy_to(entry, output_bucket, output_key):
+                    _remember_output(output_bucket, output_key, source_etag, plan)
+                    logger.info(f"♻️ Copied cached output to {output_uri}")
+                    return {
+                        "statusCode": 200,
+                        "body": f"Copied cached output to {output_uri}",
+                        "cached": True,
+                    }
+
+        # ⏯️ Very large CSVs: resumable, checkpointed multipart upload
+        checkpoints = get_checkpoint_store(s3)
+        size = checkpoints and _checkpoint_size(s3, bucket, key, rule)
+        if size:
+            if not overwrite and _head_metadata(s3, output_bucket, output_key)[1]:
+                logger.warning(f"⚠️ Output file already exists at {output_uri}.")
+                return {"statusCode": 409, "body": f"File already exists: {output_uri}"}
+            metadata = {"plan-hash": plan}
+            if source_etag:
+                metadata["source-etag"] = source_etag
+            progress = obfuscate_csv_checkpointed(
+                s3,
+                checkpoints,
+                bucket,
+                key,
+                size,
+                source_etag,
+                output_bucket,
+                output_key,
+                rule["pii_fields"],
+                plan,
+                metadata=metadata,
+                deadline=deadline,
+                strategy=rule["strategy"],
+            )
+            if not progress["complete"]:
+                return {
+                    "statusCode": 202,
+                    "body": f"Checkpointed {s3_uri} at byte {progress['offset']} "
+                    f"of {size}; retry to resume.",
+                    "incomplete": True,
+                }
+            _remember_output(output_bucket, output_key, source_etag, plan)
+            if manifest is not None and source_etag:
+                manifest.record(cache_key, output_bucket, output_key, progress["etag"])
+            logger.info(f"✅ Obfuscated file written to {output_uri}")
+            return {
+                "statusCode": 200,
+                "body": f"Obfuscated file written to {output_uri}",
+            }
+
+        # Build JSON payload
+        payload = {
+            "file_to_obfuscate": s3_uri,
+            "pii_fields": rule["pii_fields"],
+            "strategy": rule["strategy"],
         }
+        for option in ("output_format", "output_compression"):
+            if rule[option]:
+                payload[option] = rule[option]
+        if shard:
+            if not overwrite and _head_metadata(s3, output_bucket, output_key)[1]:
+                logger.warning(f"⚠️ Output file already exists at {output_uri}.")
+                return {"statusCode": 409, "body": f"File already exists: {output_uri}"}
+            # Parts are uploaded as they are cut, so the manifest is always
+            # rewritten; parts are compressed one by one
+            payload.pop("output_compression", None)
+            shard_manifest = _write_shards(
+                s3,
+                s3_uri,
+                payload,
+                output_bucket,
+                single_key,
+                shard,
+                compression=rule["output_compression"],
+                manifest_extra={
+                    "source": s3_uri,
+                    "source_etag": source_etag,
+                    "plan_hash": plan,
+                },
+            )
+            digest = shard_manifest["content_sha256"]
+            obfuscated_data = json.dumps(shard_manifest, indent=2).encode("utf-8")
+        else:
+            obfuscated_data = obfuscate_handler(json.dumps(payload), s3=s3)
+            digest = content_sha256(obfuscated_data)
+
+        metadata = {"plan-hash": plan, "content-sha256": digest}
+        if source_etag:
+            metadata["source-etag"] = source_etag
+
+        if existing and existing.get("content-sha256") == digest and not shard:
+            # e.g. only PII values changed upstream: the output is identical.
+            # Stamp it with this input so the next refresh stops at the HEAD.
+            logger.info(f"Obfuscated output identical to {output_uri}.")
+            _replace_metadata(s3, output_bucket, output_key, existing_etag, metadata)
+            _remember_output(output_bucket, output_key, source_etag, plan)
+            return up_to_date
+
+        output_etag = None
+        if overwrite:
+            # logger.info(f"📝 Writing obfuscated file to {output_uri}")
+            output_etag = s3.put_object(
+                Bucket=output_bucket,
+                Key=output_key,
+                Body=obfuscated_data,
+                Metadata=metadata,
+            )["ETag"]
+        elif not put_object_if_absent(
+            s3, output_bucket, output_key, obfuscated_data, Metadata=metadata
+        ):
+            # The object exists → don't overwrite
+            logger.warning(
+                f"⚠️ Output file already exists at {output_uri}. Skipping write."
+            )
+            return {"statusCode": 409, "body": f"File already exists: {output_uri}"}
+
+        if shard:
+            # Only now that the new manifest is in place
+            delete_stale_parts(s3, output_bucket, single_key, shard_manifest)
+        _remember_output(output_bucket, output_key, source_etag, plan)
+        if manifest is not None and source_etag and not shard:
+            # The conditional PUT does not return the ETag of what it wrote
+            output_etag = (
+                output_etag or _head_metadata(s3, output_bucket, output_key)[1]
+            )
+            manifest.record(
+                cache_key, output_bucket, output_key, normalize_etag(output_etag)
+            )
+        logger.info(f"✅ Obfuscated file written to {output_uri}")
+
+        return {"statusCode": 200, "body": f"Obfuscated file written to {output_uri}"}
 
     except S3ObjectNotFoundError as e:
         logger.warning(f"Lambda: S3 object not found – {e.bucket}/{e.key}")
-        return {"statusCode": 404, "body": str(e)}
+        return {"statusCode": 404, "body": str(e), "permanent": True}
 
+    except (UnsupportedFormatError, ValueError, csv.Error) as e:
+        # The content itself cannot be processed: retrying the same version
+        # of the object fails the same way
+        logger.exception(f"Cannot process s3://{bucket}/{key}")
+        return {
+            "statusCode": 500,
+            "body": f"Internal server error: {str(e)}",
+            "permanent": True,
+        }
+
+    except Exception as e:
+        logger.exception(f"Unexpected error while processing s3://{bucket}/{key}")
+        return {"statusCode": 500, "body": f"Internal server error: {str(e)}"}
+
+
+def _deadline(context):
+    """time.monotonic() value at which work must stop, or None off Lambda."""
+    if not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    # Checkpointed jobs stop this long before the Lambda timeout
+    margin = float(os.getenv("CHECKPOINT_SAFETY_SECONDS", "60"))
+    remaining = context.get_remaining_time_in_millis() / 1000
+    return time.monotonic() + remaining - margin
+
+
+def _max_workers() -> int:
+    return max(1, int(os.getenv("LAMBDA_MAX_WORKERS", "8")))
+
+
+def run_incremental_batch(
+    s3,
+    uri: str,
+    force: bool,
+    deadline=None,
+    manifest_location: str = None,
+    refresh: bool = False,
+) -> dict:
+    """
+    Obfuscate, according to the rules table, only the objects under the
+    prefix `uri` that its processed-object manifest has not seen yet.
+
+    Returns:
+        dict: 'statusCode' (200, or 207 if any object failed or was left for
+        the next run), 'body' and the counts of incremental.run_incremental.
+
+    Raises:
+        ValueError: If `uri` is not an s3:// prefix or no manifest location is
+        configured.
+    """
+    from incremental import get_manifest_store, parse_prefix_uri, run_incremental
+
+    bucket, prefix = parse_prefix_uri(uri)
+    store = get_manifest_store(s3, manifest_location)
+    # Outputs written back under the prefix must not be taken for new input
+    rules = get_rule_table(s3=s3)
+    output_prefixes = {
+        rule["output_prefix"]
+        for rule in rules.rules + [rules.default]
+        if rule is not None
+        and (rule["output_bucket"] or bucket) == bucket
+        and rule["output_prefix"]
+        and rule["output_prefix"].startswith(prefix)
+    }
+
+    def process(key, etag, changed):
+        # A changed object replaces the output of its previous version
+        return _process_s3_object(
+            s3,
+            bucket,
+            key,
+            force,
+            etag=etag,
+            deadline=deadline,
+            refresh=refresh or changed,
+        )
+
+    summary = run_incremental(
+        s3,
+        bucket,
+        prefix,
+        process,
+        store,
+        _max_workers(),
+        deadline,
+        exclude_prefixes=output_prefixes,
+    )
+    complete = not summary["failed"] and not summary["remaining"]
+    return dict(
+        summary,
+        statusCode=200 if complete else 207,
+        body=f"{summary['pending']} of {summary['listed']} objects under {uri} "
+        f"were new: {summary['processed']} processed, {summary['failed']} failed, "
+        f"{summary['remaining']} left for the next run.",
+    )
+
+
+def lambda_handler(event, context):
+    """
+    Lambda handler triggered by S3 PutObject events, directly or through SQS.
+
+    Every record in the batch is obfuscated concurrently on a bounded thread
+    pool (LAMBDA_MAX_WORKERS, default 8) sharing one S3 client, and each result
+    is written to a new S3 location.
+
+    Returns:
+        dict: 'statusCode'/'body' (those of the single record, or a summary
+        with 207 if any record in a batch did not succeed), 'results' with one
+        entry per record and, for SQS events, 'batchItemFailures' listing the
+        messages to retry (records that failed with a 5xx or stopped at a
+        checkpoint). With "profile": true in the event, records are processed
+        one at a time under the profiler and 'profile' gives the locations of
+        the results.
+
+        "force": true rewrites every output; "refresh": true (or
+        REFRESH_OUTPUTS=true) only rewrites outputs whose input or plan
+        changed since they were written.
+
+        A scheduled event {"incremental": "s3://bucket/prefix/"} instead
+        processes the objects under that prefix that are not in its
+        processed-object manifest yet (see run_incremental_batch).
+    """
+    if event.get("incremental") is not None:
+        try:
+            s3 = get_s3_client()
+            response = run_incremental_batch(
+                s3,
+                event["incremental"],
+                _resolve_force(event),
+                _deadline(context),
+                refresh=_resolve_refresh(event),
+            )
+        except ValueError as e:
+            return {"statusCode": 400, "body": str(e)}
+        except Exception as e:
+            logger.exception("Unexpected error during incremental run")
+            return {"statusCode": 500, "body": f"Internal server error: {str(e)}"}
+        emit_s3_metrics()
+        return response
+
+    try:
+        targets = _extract_s3_records(event)
+        force = _resolve_force(event)
+        refresh = _resolve_refresh(event)
+        s3 = get_s3_client()
+        profile = event.get("profile") is not None
+        if profile:
+            from profiling import profiled, validate_profile_option
+
+            profile = validate_profile_option(event["profile"])
     except Exception as e:
         logger.exception("Unexpected error during Lambda execution")
         return {"statusCode": 500, "body": f"Internal server error: {str(e)}"}
 
+    # logger.info(f"Lambda running in ENV={env.upper()}, force={force}")
+    logger.info(f"Force overwrite is set to: force={force}")
+
+    if not targets:
+        logger.warning("Lambda: event contained no S3 records")
+        return {"statusCode": 400, "body": "No S3 records found in event."}
+
+    deadline = _deadline(context)
+
+    def run(target):
+        if "error" in target:
+            return {"statusCode": 400, "body": target["error"]}
+        return _process_s3_object(
+            s3,
+            target["bucket"],
+            target["key"],
+            force,
+            etag=target.get("etag"),
+            deadline=deadline,
+            refresh=refresh,
+        )
+
+    max_workers = min(_max_workers(), len(targets))
+    profile_files = None
+    if profile:
+        # cProfile only sees this thread, so records run one after another
+        with profiled(getattr(context, "aws_request_id", "lambda"), s3=s3) as written:
+            outcomes = [run(target) for target in targets]
+        profile_files = written
+    elif max_workers == 1:
+        outcomes = [run(target) for target in targets]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            outcomes = list(pool.map(run, targets))
+
+    results = []
+    for target, outcome in zip(targets, outcomes):
+        result = {key: target.get(key) for key in ("bucket", "key", "message_id")}
+        result.update(outcome)
+        results.append(result)
+
+    if len(results) == 1:
+        response = {"statusCode": results[0]["statusCode"], "body": results[0]["body"]}
+    else:
+        succeeded = sum(
+            1
+            for r in results
+            if 200 <= r["statusCode"] < 300 and not r.get("incomplete")
+        )
+        response = {
+            "statusCode": 200 if succeeded == len(results) else 207,
+            "body": f"Processed {len(results)} records: {succeeded} succeeded, "
+            f"{len(results) - succeeded} did not.",
+        }
+    response["results"] = results
+    if profile_files is not None:
+        response["profile"] = profile_files
+
+    # SQS partial batch response: only messages with a retryable failure
+    # (5xx) or an unfinished checkpointed job are returned to the queue;
+    # 404/409 would fail again on retry.
+    if any(r.get("eventSource") == "aws:sqs" for r in event.get("Records", [])):
+        failed_ids = []
+        for result in results:
+            message_id = result["message_id"]
+            retry = result["statusCode"] >= 500 or result.get("incomplete")
+            if retry and message_id not in failed_ids:
+                failed_ids.append(message_id)
+        response["batchItemFailures"] = [
+            {"itemIdentifier": message_id} for message_id in failed_ids
+        ]
+
+    # S3 requests, retries and throttles of this invocation (see throttling.py)
+    emit_s3_metrics()
+    return response
+
 
 ############################################
 
@@ -170,11 +967,14 @@ def main():
     )
     parser.add_argument(
         "--s3",
-        required=True,
         help="S3 URI of the input CSV file (e.g., s3://bucket/file.csv)",
     )
+    parser.add_argument("--fields", nargs="+", help="List of PII fields to obfuscate")
     parser.add_argument(
-        "--fields", nargs="+", required=True, help="List of PII fields to obfuscate"
+        "--strategy",
+        choices=STRATEGIES,
+        help="(Optional) 'mask' (default), 'tokenize' (reversible tokens kept "
+        "in the TOKEN_VAULT vault) or 'drop' (PII fields left out of the output)",
     )
     parser.add_argument(
         "--output", help="(Optional) Output file path to save obfuscated result"
@@ -183,16 +983,174 @@ def main():
         "--encoding",
         help="(Optional) Force a specific encoding (e.g. utf-8, utf-16, latin-1)",
     )
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        help="(Optional) Convert the output (e.g. CSV in → Parquet out)",
+    )
+    parser.add_argument(
+        "--parquet-compression",
+        help="(Optional) Parquet codec for --output-format parquet (default snappy)",
+    )
+    parser.add_argument(
+        "--output-compression",
+        choices=list(CODECS),
+        help="(Optional) Compress the output (gzip, zstd or snappy)",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=int,
+        help="(Optional) Rows per Parquet row group for --output-format parquet",
+    )
+
+    parser.add_argument(
+        "--erase-field",
+        help="(Optional) Column holding subject IDs; rows of the subjects in "
+        "--erase-ids are removed",
+    )
+    parser.add_argument(
+        "--erase-ids",
+        help="(Optional) File or s3:// object with one subject ID per line",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="(Optional) Build or update the subject-ID index on --erase-field "
+        "for the objects under the --s3 prefix",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="(Optional) Obfuscate, per the rules table, only the objects under "
+        "the --s3 prefix that are not in its processed-object manifest yet",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="(Optional) Directory or s3://bucket/prefix of the --incremental "
+        "manifests (default PROCESSED_MANIFEST_LOCATION)",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="(Optional) Dry run: report matched and missing fields and the "
+        "estimated runtime of --s3 (an object or a prefix ending in /) without "
+        "downloading it; without --fields, the rules table decides",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="(Optional) Profile the run with cProfile and tracemalloc",
+    )
+    parser.add_argument(
+        "--profile-output",
+        help="(Optional) Directory or s3://bucket/prefix for --profile results "
+        "(default PROFILE_OUTPUT or profiles/)",
+    )
+
+    parser.add_argument(
+        "--serve",
+        metavar="ADDRESS",
+        help="(Optional) Run as a service on host:port or unix:/path/to.sock, "
+        "accepting the JSON payload via POST /obfuscate",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="(Optional) Concurrent obfuscations in --serve mode (default CPU count)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        help="(Optional) Requests that may wait for a worker in --serve mode "
+        "before new ones are rejected with 503 (default 64)",
+    )
 
     args = parser.parse_args()
 
-    input_payload = {"file_to_obfuscate": args.s3, "pii_fields": args.fields}
+    if args.serve:
+        from service import serve
 
-    try:
-        obfuscated_data = obfuscate_handler(
-            json.dumps(input_payload), encoding_override=args.encoding
+        serve(obfuscate_handler, args.serve, args.workers, args.queue_size)
+        return
+    if args.index:
+        if not args.s3 or not args.erase_field:
+            parser.error("--index needs --s3 s3://bucket/prefix and --erase-field")
+        from subject_index import update_index
+
+        bucket, _, prefix = args.s3[len("s3://") :].partition("/")
+        summary = update_index(get_s3_client(), bucket, prefix, args.erase_field)
+        print(json.dumps(dict(summary, indexed=len(summary["indexed"]))))
+        return
+    if args.incremental:
+        if not args.s3:
+            parser.error("--incremental needs --s3 s3://bucket/prefix/")
+        s3 = get_s3_client()
+        try:
+            summary = run_incremental_batch(
+                s3, args.s3, _resolve_force({}), manifest_location=args.manifest
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        emit_s3_metrics()
+        print(json.dumps(summary, indent=2))
+        return
+    if args.plan:
+        if not args.s3:
+            parser.error("--plan needs --s3 s3://bucket/key or s3://bucket/prefix/")
+        from planning import plan
+
+        print(json.dumps(plan(get_s3_client(), args.s3, args.fields), indent=2))
+        return
+    if bool(args.erase_field) != bool(args.erase_ids):
+        parser.error("--erase-field and --erase-ids must be given together")
+    if args.erase_field and args.s3 and args.s3.endswith("/"):
+        # A prefix: erase in place from every object that may hold a subject
+        bucket, _, prefix = args.s3[len("s3://") :].partition("/")
+        s3 = get_s3_client()
+        subjects = load_subject_ids(args.erase_ids, s3=s3)
+        results = erase_from_prefix(s3, bucket, prefix, args.erase_field, subjects)
+        print(json.dumps(results, indent=2))
+        return
+    if not args.s3 or not (args.fields or args.erase_field):
+        parser.error(
+            "--s3 and --fields (or --erase-field) are required unless --serve is given"
         )
 
+    input_payload = {"file_to_obfuscate": args.s3, "pii_fields": args.fields or []}
+    if args.erase_field:
+        input_payload["erase_subjects"] = {
+            "id_field": args.erase_field,
+            "subject_ids": args.erase_ids,
+        }
+    if args.strategy:
+        input_payload["strategy"] = args.strategy
+    if args.output_format:
+        input_payload["output_format"] = args.output_format
+    if args.output_compression:
+        input_payload["output_compression"] = args.output_compression
+    parquet_options = {
+        "compression": args.parquet_compression,
+        "row_group_size": args.row_group_size,
+    }
+    parquet_options = {k: v for k, v in parquet_options.items() if v is not None}
+    if parquet_options:
+        input_payload["parquet_options"] = parquet_options
+
+    try:
+        if args.profile:
+            from profiling import profiled
+
+            with profiled(args.s3, destination=args.profile_output) as written:
+                obfuscated_data = obfuscate_handler(
+                    json.dumps(input_payload), encoding_override=args.encoding
+                )
+            if written:
+                print(f"Profile written to {written['summary']}")
+        else:
+            obfuscated_data = obfuscate_handler(
+                json.dumps(input_payload), encoding_override=args.encoding
+            )
+
         if args.output:
             with open(args.output, "wb") as f:
                 f.write(obfuscated_data)
@@ -241,4 +1199,5 @@ if __name__ == "__main__":
     #     "obfuscated_sample.parquet",
     # ]
     main()
+    emit_s3_metrics()
     # print(lambda_handler(test_event, context=None))
@@ -0,0 +1,61 @@
+# Metrics as CloudWatch Embedded Metric Format (EMF) log lines.
+#
+# In Lambda, EMF records printed to stdout become CloudWatch metrics without
+# any API calls; elsewhere they are written to logs/metrics.log. Values must
+# never contain file content or PII, only sizes, counts, timings and settings.
+import json
+import os
+import sys
+import time
+from typing import Dict, Optional
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/metrics.log")
+
+NAMESPACE_ENV = "METRICS_NAMESPACE"
+DEFAULT_NAMESPACE = "GDPRObfuscator"
+
+
+def emit(
+    metrics: Dict[str, float],
+    dimensions: Optional[Dict[str, str]] = None,
+    properties: Optional[dict] = None,
+    units: Optional[Dict[str, str]] = None,
+) -> dict:
+    """
+    Emit one EMF record.
+
+    Args:
+        metrics (dict): Metric name → numeric value.
+        dimensions (dict, optional): Dimension name → value.
+        properties (dict, optional): Extra searchable fields (not metrics).
+        units (dict, optional): Metric name → CloudWatch unit (e.g. 'Bytes').
+
+    Returns:
+        dict: The record that was written.
+    """
+    dimensions = dimensions or {}
+    units = units or {}
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": os.getenv(NAMESPACE_ENV, DEFAULT_NAMESPACE),
+                    "Dimensions": [sorted(dimensions)],
+                    "Metrics": [
+                        {"Name": name, "Unit": units.get(name, "None")}
+                        for name in metrics
+                    ],
+                }
+            ],
+        },
+        **(properties or {}),
+        **dimensions,
+        **metrics,
+    }
+    line = json.dumps(record, default=str)
+    logger.info(line)
+    if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+        sys.stdout.write(line + "\n")
+    return record
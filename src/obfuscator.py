@@ -1,13 +1,45 @@
 # Handles obfuscation of PII fields in CSV:
-import pandas as pd
+# pyarrow is only imported on the columnar paths (Parquet, Arrow IPC, ORC;
+# see columnar.py)
 import csv
 import io
 import logging
 import json
-from typing import List, Union
+import operator
+from typing import List, Optional, TextIO, Union
+from columnar import obfuscate_columnar
 
 logger = logging.getLogger(__name__)
 
+# Supported ways of obfuscating a PII field: "mask" replaces values with '***',
+# "tokenize" with reversible tokens kept in a vault (see tokenization.py) and
+# "drop" removes the field from the output altogether
+STRATEGIES = ("mask", "tokenize", "drop")
+
+# Rows (CSV) or lines (NDJSON) whose values go to the token vault in one batch
+TOKENIZE_BATCH_ROWS = 4096
+
+
+def _flush_tokens(slots: list, writer=None, rows: list = None):
+    """Tokenise the buffered slots, then write the buffered rows."""
+    from tokenization import tokenize_fields
+
+    tokenize_fields(slots)
+    if writer is not None:
+        writer.writerows(rows)
+
+
+def _kept_columns(rows, keep: List[int], width: int):
+    """The values at the `keep` positions of each non-blank CSV row."""
+    pick = operator.itemgetter(*keep)
+    for row in rows:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        yield (pick(row),) if len(keep) == 1 else pick(row)
+
+
 # The following function handles:
 # Empty values ✅
 # Already obfuscated values ✅
@@ -16,30 +48,47 @@ logger = logging.getLogger(__name__)
 # Skips missing fields (by design) ✅
 
 
-def obfuscate_csv(content: str, pii_fields: List[str]) -> bytes:
+def obfuscate_csv(
+    content: Union[str, TextIO],
+    pii_fields: List[str],
+    strategy: str = "mask",
+    output: TextIO = None,
+) -> Optional[bytes]:
     """
     Obfuscates specified fields in a CSV string and returns the result as bytes.
 
     Args:
-        content (str): The CSV file content as a string.
+        content (str | TextIO): The CSV file content as a string, or a text
+            stream (e.g. a decompressed S3 object) that is read row by row.
         pii_fields (List[str]): List of field names to obfuscate.
+        strategy (str): 'mask', 'tokenize' (rows are then tokenised
+            TOKENIZE_BATCH_ROWS at a time) or 'drop' (the PII columns are
+            left out of the output).
+        output (TextIO, optional): Stream the obfuscated CSV is written to as
+            it is produced, one record per write() call, instead of being
+            returned.
 
     Returns:
-        bytes: Obfuscated CSV content encoded in UTF-8.
+        bytes: Obfuscated CSV content encoded in UTF-8 (None with `output`).
 
     Raises:
         ValueError: If content is not a valid CSV.
         TypeError: If pii_fields contains non-strings.
     """
 
-    # Early rejection: JSON-style content (starts with { or [)
-    if content.strip().startswith("{") or content.strip().startswith("["):
-        raise ValueError("Input is not a valid CSV. JSON detected.")
+    if isinstance(content, str):
+        input_buffer = io.StringIO(content)
+    else:
+        input_buffer = content
 
     found_fields = set()
-    input_buffer = io.StringIO(content)
     reader = csv.DictReader(input_buffer)
 
+    # Early rejection: JSON-style content (starts with { or [).
+    # Only the header line is inspected, never a copy of the whole content.
+    if reader.fieldnames and reader.fieldnames[0].lstrip().startswith(("{", "[")):
+        raise ValueError("Input is not a valid CSV. JSON detected.")
+
     if not reader.fieldnames or len(reader.fieldnames) < 2:
         raise ValueError("CSV must have at least two columns in the header.")
 
@@ -51,19 +100,45 @@ def obfuscate_csv(content: str, pii_fields: List[str]) -> bytes:
     for field in pii_fields:
         if not isinstance(field, str):
             raise TypeError("All PII field names must be strings.")
-    pii_fields_normalized = [field.lower() for field in pii_fields]
-
-    output_buffer = io.StringIO()
-    writer = csv.DictWriter(output_buffer, fieldnames=reader.fieldnames)
-    writer.writeheader()
+    pii_fields_normalized = list(dict.fromkeys(f.lower() for f in pii_fields))
+
+    output_buffer = io.StringIO() if output is None else output
+    if strategy == "drop":
+        dropped = {header_map.get(field) for field in pii_fields_normalized}
+        keep = [i for i, name in enumerate(reader.fieldnames) if name not in dropped]
+        if not keep:
+            raise ValueError("Dropping the PII fields would leave no columns.")
+        # Rows are never turned into dicts: only the kept positions are copied
+        writer = csv.writer(output_buffer)
+        writer.writerow([reader.fieldnames[i] for i in keep])
+        writer.writerows(_kept_columns(reader.reader, keep, len(reader.fieldnames)))
+        if reader.line_num > 1:
+            found_fields.update(name for name in dropped if name)
+    else:
+        writer = csv.DictWriter(output_buffer, fieldnames=reader.fieldnames)
+        writer.writeheader()
 
+    tokenize = strategy == "tokenize"
+    rows, slots = [], []
+    # After a drop the reader is exhausted and this loop does nothing
     for row in reader:
         for field_lower in pii_fields_normalized:
             actual_field = header_map.get(field_lower)
             if actual_field and actual_field in row:
-                row[actual_field] = "***"
+                if tokenize:
+                    slots.append((row, actual_field))
+                else:
+                    row[actual_field] = "***"
                 found_fields.add(actual_field)
-        writer.writerow(row)
+        if not tokenize:
+            writer.writerow(row)
+            continue
+        rows.append(row)
+        if len(rows) >= TOKENIZE_BATCH_ROWS:
+            _flush_tokens(slots, writer, rows)
+            rows, slots = [], []
+    if rows:
+        _flush_tokens(slots, writer, rows)
 
     missing_fields = [f for f in pii_fields if f.lower() not in header_map]
 
@@ -77,7 +152,11 @@ def obfuscate_csv(content: str, pii_fields: List[str]) -> bytes:
             raise ValueError("No matching PII fields found — obfuscation skipped.")
 
     if missing_fields:
-        logger.warning(f"⚠️ Some PII fields were not found: {', '.join(missing_fields)}")
+        logger.warning(
+            f"⚠️ Some PII fields were not found: {', '.join(missing_fields)}"
+        )
+    if output is not None:
+        return None
     return output_buffer.getvalue().encode("utf-8")
 
 
@@ -90,13 +169,17 @@ def obfuscate_csv(content: str, pii_fields: List[str]) -> bytes:
 # Returns a UTF-8 encoded JSON string as bytes
 
 
-def obfuscate_json(content: Union[str, bytes], pii_fields: List[str]) -> bytes:
+def obfuscate_json(
+    content: Union[str, bytes, TextIO], pii_fields: List[str], strategy: str = "mask"
+) -> bytes:
     """
     Obfuscates specified fields in a JSON object or list of objects.
 
     Args:
-        content (str | bytes): JSON string or bytes from S3.
+        content (str | bytes | TextIO): JSON string, bytes or text stream from S3.
         pii_fields (List[str]): Fields to obfuscate.
+        strategy (str): 'mask', 'tokenize' (one vault batch per document) or
+            'drop' (the PII keys are removed).
 
     Returns:
         bytes: Obfuscated JSON content encoded as UTF-8.
@@ -105,19 +188,28 @@ def obfuscate_json(content: Union[str, bytes], pii_fields: List[str]) -> bytes:
         content = content.decode("utf-8")
 
     try:
-        data = json.loads(content)
+        if isinstance(content, str):
+            data = json.loads(content)
+        else:
+            data = json.load(content)
     except json.JSONDecodeError:
         raise ValueError("Invalid JSON input")
 
-    pii_fields_normalized = [field.lower() for field in pii_fields]
+    pii_fields_normalized = list(dict.fromkeys(f.lower() for f in pii_fields))
     found_fields = set()
+    slots = [] if strategy == "tokenize" else None
 
     def obfuscate_record(record: dict):
         lower_record = {k.lower(): k for k in record}
         for pii_field in pii_fields_normalized:
             actual_key = lower_record.get(pii_field)
             if actual_key in record:
-                record[actual_key] = "***"
+                if strategy == "drop":
+                    del record[actual_key]
+                elif slots is None:
+                    record[actual_key] = "***"
+                else:
+                    slots.append((record, actual_key))
                 found_fields.add(actual_key)
         return record
 
@@ -129,6 +221,8 @@ def obfuscate_json(content: Union[str, bytes], pii_fields: List[str]) -> bytes:
         obfuscated = [obfuscate_record(rec) for rec in data]
     else:
         raise ValueError("Unsupported JSON format (must be object or list of objects)")
+    if slots:
+        _flush_tokens(slots)
 
     if not found_fields:
         logger.warning(
@@ -149,13 +243,107 @@ def obfuscate_json(content: Union[str, bytes], pii_fields: List[str]) -> bytes:
     return json.dumps(obfuscated, ensure_ascii=False, indent=2).encode("utf-8")
 
 
-def obfuscate_parquet(content: Union[bytes, str], pii_fields: List[str]) -> bytes:
+# the following function:
+# Accepts newline-delimited JSON (one object per line)
+# Streams line by line, so large exports are never parsed as a whole
+# Returns UTF-8 encoded NDJSON as bytes
+
+
+def obfuscate_ndjson(
+    content: Union[str, bytes, TextIO],
+    pii_fields: List[str],
+    strategy: str = "mask",
+    output: TextIO = None,
+) -> Optional[bytes]:
+    """
+    Obfuscates specified fields in newline-delimited JSON (NDJSON / JSON Lines).
+
+    Args:
+        content (str | bytes | TextIO): NDJSON string, bytes or text stream.
+        pii_fields (List[str]): Fields to obfuscate.
+        strategy (str): 'mask', 'tokenize' (lines are then tokenised
+            TOKENIZE_BATCH_ROWS at a time) or 'drop' (the PII keys are
+            removed).
+        output (TextIO, optional): Stream the obfuscated lines are written to
+            as they are produced, one line per write() call, instead of being
+            returned.
+
+    Returns:
+        bytes: Obfuscated NDJSON content encoded as UTF-8 (None with `output`).
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    lines = io.StringIO(content) if isinstance(content, str) else content
+
+    pii_fields_normalized = list(dict.fromkeys(f.lower() for f in pii_fields))
+    found_fields = set()
+    output_buffer = io.StringIO() if output is None else output
+    tokenize = strategy == "tokenize"
+    records, slots = [], []
+
+    def write_records():
+        _flush_tokens(slots)
+        for buffered in records:
+            output_buffer.write(json.dumps(buffered, ensure_ascii=False) + "\n")
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            raise ValueError(f"Invalid NDJSON input on line {line_number}")
+        if not isinstance(record, dict):
+            raise ValueError("NDJSON lines must contain objects (dicts only).")
+
+        lower_record = {k.lower(): k for k in record}
+        for pii_field in pii_fields_normalized:
+            actual_key = lower_record.get(pii_field)
+            if actual_key is not None:
+                if tokenize:
+                    slots.append((record, actual_key))
+                elif strategy == "drop":
+                    del record[actual_key]
+                else:
+                    record[actual_key] = "***"
+                found_fields.add(actual_key.lower())
+        if not tokenize:
+            output_buffer.write(json.dumps(record, ensure_ascii=False) + "\n")
+            continue
+        records.append(record)
+        if len(records) >= TOKENIZE_BATCH_ROWS:
+            write_records()
+            records, slots = [], []
+    if records:
+        write_records()
+
+    if not found_fields:
+        logger.warning(
+            "⚠️ None of the specified PII fields were found in the NDJSON data."
+        )
+        raise ValueError("No matching PII fields found — obfuscation skipped.")
+
+    missing_fields = [f for f in pii_fields if f.lower() not in found_fields]
+    if missing_fields:
+        logger.warning(
+            f"⚠️ Some PII fields were not found in NDJSON: {', '.join(missing_fields)}"
+        )
+
+    if output is not None:
+        return None
+    return output_buffer.getvalue().encode("utf-8")
+
+
+def obfuscate_parquet(
+    content: Union[bytes, str], pii_fields: List[str], strategy: str = "mask"
+) -> bytes:
     """
     Obfuscates PII fields in a Parquet file and returns as byte stream.
 
     Args:
         content (bytes): Parquet file content from S3.
         pii_fields (List[str]): List of fields to obfuscate.
+        strategy (str): 'mask', 'tokenize' or 'drop'.
 
     Returns:
         bytes: Obfuscated Parquet file as byte stream.
@@ -166,38 +354,42 @@ def obfuscate_parquet(content: Union[bytes, str], pii_fields: List[str]) -> byte
     if isinstance(content, str):
         content = content.encode("utf-8")
 
-    buffer = io.BytesIO(content)
-    try:
-        df = pd.read_parquet(buffer, engine="pyarrow")
-        logger.info(f"📄 Read Parquet: {df.shape[0]} rows, {df.shape[1]} cols")
-    except Exception:
-        logger.exception("Failed to read parquet")
-        raise ValueError("Invalid Parquet format")
+    return obfuscate_columnar(content, pii_fields, "parquet", strategy)
 
-    pii_fields_normalized = [field.lower() for field in pii_fields]
-    column_map = {col.lower(): col for col in df.columns}
 
-    found_fields = set()
+def obfuscate_arrow_ipc(
+    content: bytes, pii_fields: List[str], strategy: str = "mask"
+) -> bytes:
+    """
+    Obfuscates PII fields in an Arrow IPC (Feather v2) file or stream.
 
-    for field_lower in pii_fields_normalized:
-        actual_field = column_map.get(field_lower)
-        if actual_field and actual_field in df.columns:
-            df[actual_field] = "***"
-            found_fields.add(actual_field)
+    Args:
+        content (bytes): Arrow IPC content from S3.
+        pii_fields (List[str]): List of fields to obfuscate.
+        strategy (str): 'mask', 'tokenize' or 'drop'.
 
-    if not found_fields:
-        logger.warning(
-            "⚠️ None of the specified PII fields were found in the Parquet file."
-        )
-        raise ValueError("No matching PII fields found — obfuscation skipped.")
+    Returns:
+        bytes: Obfuscated Arrow IPC file as byte stream.
+    """
+    logger.info("📦 Inside obfuscate_arrow_ipc")
+    logger.info(f"Received {len(content)} bytes")
+    return obfuscate_columnar(content, pii_fields, "arrow", strategy)
 
-    missing_fields = [field for field in pii_fields if field.lower() not in column_map]
-    if missing_fields:
-        logger.warning(
-            f"⚠️ Some PII fields were not found in Parquet: {', '.join(missing_fields)}"
-        )
 
-    out_buffer = io.BytesIO()
-    df.to_parquet(out_buffer, index=False, engine="pyarrow")
+def obfuscate_orc(
+    content: bytes, pii_fields: List[str], strategy: str = "mask"
+) -> bytes:
+    """
+    Obfuscates PII fields in an ORC file, stripe by stripe.
+
+    Args:
+        content (bytes): ORC file content from S3.
+        pii_fields (List[str]): List of fields to obfuscate.
+        strategy (str): 'mask', 'tokenize' or 'drop'.
 
-    return out_buffer.getvalue()
+    Returns:
+        bytes: Obfuscated ORC file as byte stream.
+    """
+    logger.info("📦 Inside obfuscate_orc")
+    logger.info(f"Received {len(content)} bytes")
+    return obfuscate_columnar(content, pii_fields, "orc", strategy)
@@ -0,0 +1,467 @@
+# Dry-run planning ("plan": true in the payload, or --plan on the CLI).
+#
+# Before a large backfill, a plan tells how many objects and bytes are
+# involved, which of the requested PII fields each file actually has, and
+# roughly how long obfuscating it would take, without downloading any body:
+#
+# - a prefix costs one paginated listing (keys, sizes and ETags); a single
+#   object costs one HEAD;
+# - CSV, NDJSON and JSON: a ranged GET of the first PLAN_PREFIX_SIZE bytes
+#   (decompressed if needed) gives the header row or the first record, read
+#   further only if the first record does not fit;
+# - Parquet, Arrow and ORC: the schema is read from the footer (or the stream
+#   header) through ranged GETs, so a multi-GB file costs a few KB.
+#
+# JSON fields are those of the first record; later records may have others.
+#
+# Runtimes are estimates for one worker: the download at PLAN_TRANSFER_RATE
+# plus the (decompressed) bytes at the format's obfuscation throughput, as
+# measured by benchmarks/bench_throughput.py. CSV uses the rate observed by
+# earlier runs in this process when there is one; PLAN_THROUGHPUT (a JSON
+# object of bytes/second per format) overrides both.
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from compression import peek_decompressed, sniff_compression, split_compression_suffix
+from columnar import COLUMNAR_FORMATS, _import_orc
+from exceptions import S3ObjectNotFoundError
+from formats import (
+    SNIFF_SIZE,
+    SNIFFABLE_EXTENSIONS,
+    file_extension,
+    format_for_uri,
+    get_format,
+    sniff_format,
+)
+from hashing import normalize_etag
+from s3_utils import ENCODING_SAMPLE_SIZE, detect_encoding
+import tuning
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/planning.log")
+
+PREFIX_SIZE_ENV = "PLAN_PREFIX_SIZE"
+THROUGHPUT_ENV = "PLAN_THROUGHPUT"
+TRANSFER_RATE_ENV = "PLAN_TRANSFER_RATE"
+
+DEFAULT_PREFIX_SIZE = 64 * 1024
+# Give up on finding the first JSON record after this many bytes
+MAX_PREFIX_SIZE = 4 * 1024 * 1024
+# Bytes of input obfuscated per second by one worker ('mask'), rounded down
+# from benchmarks/bench_throughput.py on one vCPU
+DEFAULT_THROUGHPUT = {
+    "csv": 12e6,
+    "json": 10e6,
+    "ndjson": 9e6,
+    "parquet": 40e6,
+    "arrow": 400e6,
+    "orc": 100e6,
+}
+# Rate of one S3 GET stream into Lambda or EC2
+DEFAULT_TRANSFER_RATE = 80e6
+
+
+def validate_plan_option(option) -> bool:
+    """
+    Check a payload 'plan' setting.
+
+    Raises:
+        TypeError: If it is not a boolean.
+    """
+    if option is None:
+        return False
+    if not isinstance(option, bool):
+        raise TypeError("'plan' must be true or false.")
+    return option
+
+
+def throughput_rates() -> dict:
+    """
+    Obfuscation throughput per format, in bytes/second.
+
+    Raises:
+        ValueError: If PLAN_THROUGHPUT is not a JSON object of numbers.
+    """
+    rates = dict(DEFAULT_THROUGHPUT)
+    observed = tuning.throughput.rate("csv")
+    if observed:
+        rates["csv"] = observed
+    override = os.getenv(THROUGHPUT_ENV)
+    if override:
+        try:
+            rates.update({name: float(v) for name, v in json.loads(override).items()})
+        except (ValueError, TypeError, AttributeError):
+            raise ValueError(
+                f"{THROUGHPUT_ENV} must be a JSON object of bytes/second per "
+                'format, e.g. {"csv": 50000000}.'
+            )
+    return rates
+
+
+def estimate_seconds(size: int, file_format: str, rates: dict, ratio=1.0) -> float:
+    """
+    Estimated time for one worker to download and obfuscate an object.
+
+    Args:
+        size (int): Object size in bytes.
+        file_format (str): Input format name.
+        rates (dict): Output of throughput_rates().
+        ratio (float): Decompressed bytes per stored byte.
+    """
+    transfer = float(os.getenv(TRANSFER_RATE_ENV, DEFAULT_TRANSFER_RATE))
+    return size / transfer + size * ratio / rates[file_format]
+
+
+class RangedObject(io.RawIOBase):
+    """
+    Read-only, seekable view of an S3 object where every read is a ranged GET.
+
+    Reads are rounded up to `block_size` (default PLAN_PREFIX_SIZE) and the
+    last block is kept and extended by reads that continue it, so libraries
+    reading a footer a few bytes at a time cost one or two GETs.
+    With `etag`, every GET is conditional on it (If-Match), so all reads see
+    the same version of the object.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, size: int, etag=None, block_size=0):
+        self.s3, self.bucket, self.key = s3, bucket, key
+        self.size = size
+        self.etag = etag
+        self.block_size = block_size or int(
+            os.getenv(PREFIX_SIZE_ENV, DEFAULT_PREFIX_SIZE)
+        )
+        self.requests = self.bytes_read = 0
+        self._position = 0
+        self._block = (0, b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}
+        self._position = max(0, base[whence] + offset)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        data = self.read_range(self._position, len(buffer))
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def read_range(self, start: int, length: int) -> bytes:
+        """Bytes [start, start + length), clipped to the object."""
+        end = min(start + length, self.size)
+        if start >= end:
+            return b""
+        block_start, block = self._block
+        block_end = block_start + len(block)
+        if block_start <= start <= block_end and block:
+            if end > block_end:
+                # Reading on from the block: fetch only what follows it
+                fetch_end = min(self.size, max(end, block_end + self.block_size))
+                block += self._get(block_end, fetch_end)
+                self._block = (block_start, block)
+        else:
+            # Read ahead a block, or back if the read ends at the object's end
+            fetch_end = min(self.size, max(end, start + self.block_size))
+            fetch_start = start
+            if fetch_end == self.size:
+                fetch_start = min(start, max(0, self.size - self.block_size))
+            block_start, block = fetch_start, self._get(fetch_start, fetch_end)
+            self._block = (block_start, block)
+        return block[start - block_start : end - block_start]
+
+    def _get(self, start: int, end: int) -> bytes:
+        kwargs = {"IfMatch": f'"{self.etag}"'} if self.etag else {}
+        response = self.s3.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}", **kwargs
+        )
+        data = response["Body"].read()
+        self.requests += 1
+        self.bytes_read += len(data)
+        return data
+
+
+def _decode(data: bytes) -> str:
+    encoding = detect_encoding(data[:ENCODING_SAMPLE_SIZE])
+    # A multi-byte character may be cut at the end of the prefix
+    return data.decode(encoding, errors="replace").lstrip("\ufeff")
+
+
+def _first_record_fields(text: str, file_format: str, complete: bool):
+    """
+    Field names from the start of a text file, or None if more is needed.
+
+    Raises:
+        ValueError: If the start of the file is not valid in that format.
+    """
+    if file_format == "csv":
+        if "\n" not in text and not complete:
+            return None
+        return next(csv.reader(io.StringIO(text)), [])
+
+    if file_format == "ndjson":
+        line = next((line for line in text.splitlines(True) if line.strip()), "")
+        if not line.endswith("\n") and not complete:
+            return None
+        document, position = line, 0
+    else:
+        document = text.lstrip()
+        position = 1 if document.startswith("[") else 0
+
+    decoder = json.JSONDecoder()
+    while position < len(document) and document[position].isspace():
+        position += 1
+    if position >= len(document) or document[position] == "]":
+        return []
+    try:
+        record, _ = decoder.raw_decode(document, position)
+    except json.JSONDecodeError:
+        if complete:
+            raise ValueError(f"Invalid {file_format.upper()} at the start of the file")
+        return None
+    return list(record) if isinstance(record, dict) else []
+
+
+def read_text_fields(source: RangedObject, file_format: str, compression=None):
+    """
+    Header or first-record field names of a CSV, NDJSON or JSON object.
+
+    Returns:
+        tuple: (field names or None if the first record is longer than
+        MAX_PREFIX_SIZE, decompressed bytes per stored byte)
+    """
+    size = int(os.getenv(PREFIX_SIZE_ENV, DEFAULT_PREFIX_SIZE))
+    while True:
+        raw = source.read_range(0, size)
+        complete = len(raw) >= source.size
+        data = raw
+        if compression:
+            data = peek_decompressed(raw, compression, MAX_PREFIX_SIZE * 64)
+        fields = _first_record_fields(_decode(data), file_format, complete)
+        ratio = len(data) / len(raw) if raw else 1.0
+        if fields is not None or complete or size >= MAX_PREFIX_SIZE:
+            return fields, ratio
+        size *= 4
+
+
+def read_schema_fields(source: RangedObject, file_format: str) -> List[str]:
+    """
+    Top-level column names of a Parquet, Arrow or ORC object, read from its
+    footer (Arrow streams: from the schema message at the start).
+
+    Raises:
+        ValueError: If the object cannot be read in that format.
+    """
+    import pyarrow as pa
+
+    label = COLUMNAR_FORMATS[file_format]
+    handle = pa.PythonFile(source, mode="r")
+    try:
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            schema = pq.read_schema(handle)
+        elif file_format == "arrow":
+            if source.read_range(0, 6) == b"ARROW1":
+                schema = pa.ipc.open_file(handle).schema
+            else:
+                schema = pa.ipc.open_stream(handle).schema
+        else:
+            schema = _import_orc().ORCFile(handle).schema
+    except (pa.ArrowException, OSError):
+        logger.exception(f"Failed to read the {label} schema of {source.key}")
+        raise ValueError(f"Invalid {label} format")
+    return list(schema.names)
+
+
+def match_fields(columns: List[str], pii_fields: List[str]) -> dict:
+    """Requested fields found (as spelled in the file) and missing, ignoring case."""
+    column_map = {column.lower(): column for column in columns}
+    matched = []
+    for field in pii_fields:
+        column = column_map.get(field.lower())
+        if column and column not in matched:
+            matched.append(column)
+    missing = [field for field in pii_fields if field.lower() not in column_map]
+    return {"matched": matched, "missing": missing}
+
+
+def _resolve_format(source: RangedObject, input_format: str = None):
+    """(format name or None, compression codec or None) of an object."""
+    base, compression = split_compression_suffix(source.key)
+    if input_format:
+        file_format = get_format(input_format)
+    else:
+        file_format = format_for_uri(base)
+    if file_format is None and file_extension(base) in SNIFFABLE_EXTENSIONS:
+        prefix = source.read_range(0, SNIFF_SIZE)
+        compression = compression or sniff_compression(prefix)
+        if compression:
+            prefix = peek_decompressed(prefix, compression, SNIFF_SIZE)
+        file_format = sniff_format(prefix)
+    return (file_format.name if file_format else None), compression
+
+
+def plan_object(
+    s3,
+    bucket: str,
+    obj: dict,
+    pii_fields: Optional[List[str]],
+    rates: dict,
+    input_format: str = None,
+) -> dict:
+    """
+    Plan one object: its format, fields, matches and estimated runtime.
+
+    Args:
+        obj (dict): 'key', 'size' and 'etag' of the object.
+        pii_fields (List[str] | None): Fields to look for; None looks up the
+            object's rule in the rules table.
+
+    Returns:
+        dict: 'key', 'size', 'etag', 'format', 'compression', 'columns',
+        'matched', 'missing', 'estimated_seconds' and 'bytes_read', or
+        'skipped' / 'error' with a reason instead of the fields.
+    """
+    key = obj["key"]
+    entry = {"key": key, "size": obj["size"], "etag": obj["etag"]}
+    if pii_fields is None:
+        from rules import get_rule_table
+
+        rule = get_rule_table(s3=s3).resolve(key)
+        if rule is None:
+            return dict(entry, skipped="No obfuscation rule matches")
+        pii_fields = rule["pii_fields"]
+
+    source = RangedObject(s3, bucket, key, obj["size"], obj["etag"])
+    try:
+        file_format, compression = _resolve_format(source, input_format)
+        entry.update(format=file_format, compression=compression)
+        if file_format is None:
+            return dict(entry, skipped="Unsupported format")
+        ratio = 1.0
+        if file_format in COLUMNAR_FORMATS:
+            if compression:
+                # No footer without decompressing the whole object
+                return dict(
+                    entry, skipped=f"Compressed {file_format} needs a full read"
+                )
+            columns = read_schema_fields(source, file_format)
+        else:
+            columns, ratio = read_text_fields(source, file_format, compression)
+    except Exception as e:
+        logger.warning(f"Could not plan s3://{bucket}/{key}: {e}")
+        return dict(entry, error=str(e), bytes_read=source.bytes_read)
+
+    entry["columns"] = columns
+    if columns is None:
+        entry["error"] = f"First record not found in {MAX_PREFIX_SIZE} bytes"
+    else:
+        entry.update(match_fields(columns, pii_fields))
+    entry["estimated_seconds"] = round(
+        estimate_seconds(obj["size"], file_format, rates, ratio), 3
+    )
+    entry["bytes_read"] = source.bytes_read
+    return entry
+
+
+def list_objects(s3, bucket: str, prefix: str) -> List[dict]:
+    """'key', 'size' and 'etag' of every object under `prefix` (paginated)."""
+    from subject_index import INDEX_DIR
+
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/") or f"/{INDEX_DIR}" in f"/{key}":
+                continue
+            objects.append(
+                {"key": key, "size": obj["Size"], "etag": normalize_etag(obj["ETag"])}
+            )
+    return objects
+
+
+def head_object(s3, bucket: str, key: str) -> dict:
+    """
+    'key', 'size' and 'etag' of one object, from a HEAD.
+
+    Raises:
+        S3ObjectNotFoundError: If the object does not exist.
+    """
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            raise S3ObjectNotFoundError(bucket, key)
+        raise
+    return {
+        "key": key,
+        "size": response["ContentLength"],
+        "etag": normalize_etag(response.get("ETag")),
+    }
+
+
+def plan(
+    s3, s3_uri: str, pii_fields: List[str] = None, input_format: str = None
+) -> dict:
+    """
+    Plan obfuscating one object, or every object under a prefix (a URI
+    ending in '/'), without downloading any body.
+
+    Args:
+        s3 (boto3.client): S3 client.
+        s3_uri (str): s3://bucket/key or s3://bucket/prefix/.
+        pii_fields (List[str], optional): Fields to look for; by default each
+            object's rule in the rules table decides.
+        input_format (str, optional): Format of every object, instead of
+            extensions and sniffing.
+
+    Returns:
+        dict: Totals ('objects', 'bytes', 'bytes_read', 'estimated_seconds',
+        'files_with_missing_fields', 'files_without_matches', 'skipped',
+        'errors') and 'files' with one plan_object() entry per object.
+    """
+    bucket, _, key = s3_uri[len("s3://") :].partition("/")
+    if not key or key.endswith("/"):
+        objects = list_objects(s3, bucket, key)
+    else:
+        objects = [head_object(s3, bucket, key)]
+    rates = throughput_rates()
+
+    def run(obj):
+        return plan_object(s3, bucket, obj, pii_fields, rates, input_format)
+
+    with ThreadPoolExecutor(max_workers=tuning.upload_workers()) as pool:
+        files = list(pool.map(run, objects))
+
+    planned = [f for f in files if "matched" in f]
+    summary = {
+        "uri": s3_uri,
+        "objects": len(files),
+        "bytes": sum(f["size"] for f in files),
+        "bytes_read": sum(f.get("bytes_read", 0) for f in files),
+        "estimated_seconds": round(
+            sum(f.get("estimated_seconds", 0) for f in files), 3
+        ),
+        "files_with_missing_fields": sum(1 for f in planned if f["missing"]),
+        "files_without_matches": sum(1 for f in planned if not f["matched"]),
+        "skipped": sum(1 for f in files if "skipped" in f),
+        "errors": sum(1 for f in files if "error" in f),
+        "files": files,
+    }
+    logger.info(
+        f"📋 Planned {summary['objects']} objects ({summary['bytes']} bytes) "
+        f"under {s3_uri}, reading {summary['bytes_read']} bytes."
+    )
+    return summary
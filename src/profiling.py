@@ -0,0 +1,196 @@
+# On-demand profiling of a run in its real environment.
+#
+# `--profile` on the CLI or "profile": true in a payload wraps the run in
+# cProfile and tracemalloc. Two files are written per run to PROFILE_OUTPUT
+# (a local directory, default profiles/, or s3://bucket/prefix):
+#
+# - <run>.pstats: the raw profile, for `python -m pstats` or snakeviz;
+# - <run>.txt: wall time, peak traced memory, the top functions by
+#   cumulative time and the top allocation sites.
+#
+# Only function names, file paths, timings and sizes are written, never data.
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/profiling.log")
+
+PROFILE_OUTPUT_ENV = "PROFILE_OUTPUT"
+PROFILE_TOP_ENV = "PROFILE_TOP"
+
+DEFAULT_OUTPUT = "profiles"
+DEFAULT_TOP = 30
+# Frames kept per allocation; more costs time and memory while tracing
+TRACEMALLOC_FRAMES = 5
+
+# tracemalloc is process-wide: it is stopped when the last profiled run ends
+_tracing_runs = 0
+_tracing_lock = threading.Lock()
+
+
+def validate_profile_option(option) -> bool:
+    """
+    Check a payload 'profile' setting.
+
+    Raises:
+        TypeError: If it is not a boolean.
+    """
+    if option is None:
+        return False
+    if not isinstance(option, bool):
+        raise TypeError("'profile' must be true or false.")
+    return option
+
+
+def run_name(label: str) -> str:
+    """e.g. 's3://bucket/in/data.csv' → '20240101T120000Z-data.csv'"""
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", label.rstrip("/").rsplit("/", 1)[-1])
+    return f"{stamp}-{name or 'run'}"
+
+
+def _start_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        _tracing_runs += 1
+
+
+def _stop_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracing_runs -= 1
+        if _tracing_runs == 0:
+            tracemalloc.stop()
+    return snapshot, peak
+
+
+def summarise(
+    stats: pstats.Stats, snapshot, peak: int, elapsed: float, top: int
+) -> str:
+    """Plain-text report: timings, memory, hot functions and allocation sites."""
+    out = io.StringIO()
+    out.write(f"Wall time: {elapsed:.3f} s\n")
+    out.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MB\n\n")
+
+    out.write(f"Top {top} functions by cumulative time\n")
+    stats.stream = out
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+    out.write(f"Top {top} allocation sites\n")
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        out.write(
+            f"{stat.size / 1024:>12.1f} KiB {stat.count:>8} blocks  "
+            f"{frame.filename}:{frame.lineno}\n"
+        )
+    return out.getvalue()
+
+
+def write_profile(
+    destination: str, name: str, stats: pstats.Stats, summary: str, s3=None
+):
+    """
+    Write <name>.pstats and <name>.txt to a local directory or s3://bucket/prefix.
+
+    Returns:
+        dict: 'pstats' and 'summary' locations.
+    """
+    # pstats can only dump to a path, so S3 uploads go through a temp file
+    if destination.startswith("s3://"):
+        import tempfile
+        from s3_utils import get_s3_client
+
+        s3 = s3 or get_s3_client()
+        bucket, _, prefix = destination[len("s3://") :].partition("/")
+        prefix = prefix.rstrip("/") + "/" if prefix else ""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"{name}.pstats")
+            stats.dump_stats(path)
+            with open(path, "rb") as f:
+                s3.put_object(
+                    Bucket=bucket, Key=f"{prefix}{name}.pstats", Body=f.read()
+                )
+        s3.put_object(
+            Bucket=bucket, Key=f"{prefix}{name}.txt", Body=summary.encode("utf-8")
+        )
+        base = f"s3://{bucket}/{prefix}{name}"
+        return {"pstats": f"{base}.pstats", "summary": f"{base}.txt"}
+
+    # If the directory is not writable (like in Lambda), fall back to /tmp/
+    try:
+        os.makedirs(destination, exist_ok=True)
+        writable = os.access(destination, os.W_OK)
+    except OSError:
+        writable = False
+    if not writable:
+        destination = os.path.join("/tmp", os.path.basename(destination.rstrip("/")))
+        os.makedirs(destination, exist_ok=True)
+    base = os.path.join(destination, name)
+    stats.dump_stats(f"{base}.pstats")
+    with open(f"{base}.txt", "w", encoding="utf-8") as f:
+        f.write(summary)
+    return {"pstats": f"{base}.pstats", "summary": f"{base}.txt"}
+
+
+@contextmanager
+def profiled(label: str, destination: str = None, s3=None, top: int = None):
+    """
+    Profile the block with cProfile and tracemalloc and write the results.
+
+    cProfile only sees the calling thread, so callers that fan out to threads
+    should run serially while profiling.
+
+    Args:
+        label (str): Names the run (e.g. the input URI).
+        destination (str, optional): Directory or s3://bucket/prefix
+            (PROFILE_OUTPUT, default profiles/).
+        s3 (boto3.client, optional): Client for S3 destinations.
+        top (int, optional): Entries in each summary table (PROFILE_TOP,
+            default 30).
+
+    Yields:
+        dict: Filled with the 'pstats' and 'summary' locations on exit.
+    """
+    destination = destination or os.getenv(PROFILE_OUTPUT_ENV, DEFAULT_OUTPUT)
+    top = top or int(os.getenv(PROFILE_TOP_ENV, DEFAULT_TOP))
+    written = {}
+    profiler = cProfile.Profile()
+    _start_tracing()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield written
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        snapshot, peak = _stop_tracing()
+        name = run_name(label)
+        stats = pstats.Stats(profiler)
+        try:
+            written.update(
+                write_profile(
+                    destination,
+                    name,
+                    stats,
+                    summarise(stats, snapshot, peak, elapsed, top),
+                    s3=s3,
+                )
+            )
+            logger.info(f"📈 Profile written to {written['summary']}")
+        except Exception:
+            # A failed profile upload must not fail the run it measured
+            logger.exception("Could not write the profile.")
@@ -0,0 +1,237 @@
+# Content-addressed cache of obfuscation results.
+#
+# A result is identified by the input object (bucket, key, ETag/version) and the
+# plan (pii_fields, strategy, options). Two backends are provided:
+#
+# - LocalResultCache: stores output bytes on local disk (RESULT_CACHE_DIR),
+#   so obfuscate_handler can answer a repeat request without downloading
+#   or parsing the input again. The directory is kept under
+#   RESULT_CACHE_MAX_BYTES by evicting the least recently used results.
+# - S3ManifestCache: stores a small manifest entry per result pointing at an
+#   output object already in S3 (RESULT_CACHE_MANIFEST=s3://bucket/prefix), so
+#   the Lambda can satisfy a hit with copy_object and never moves the body.
+#   The entry records the output's ETag and the copy is conditional on it, so
+#   an output overwritten or deleted since it was recorded is a miss.
+import hashlib
+import json
+import os
+import tempfile
+from typing import List, Optional, Tuple
+from hashing import plan_hash
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/result_cache.log")
+
+LOCAL_CACHE_ENV = "RESULT_CACHE_DIR"
+MANIFEST_CACHE_ENV = "RESULT_CACHE_MANIFEST"
+MAX_BYTES_ENV = "RESULT_CACHE_MAX_BYTES"
+
+DEFAULT_MAX_BYTES = 1024**3
+
+_local_caches = {}
+
+
+def result_cache_key(
+    bucket: str,
+    key: str,
+    version: str,
+    pii_fields: List[str],
+    strategy: str = "mask",
+    **options,
+) -> str:
+    """
+    Build the cache key for one (input object, plan) pair.
+
+    Args:
+        bucket (str): Input bucket
+        key (str): Input key
+        version (str): Input ETag or version id
+        pii_fields (List[str]): Fields to obfuscate
+        strategy (str): Obfuscation strategy
+        **options: Other settings that change the output
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    plan = plan_hash(pii_fields, strategy, **options)
+    identity = json.dumps([bucket, key, version, plan], separators=(",", ":"))
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+class LocalResultCache:
+    """
+    Obfuscated outputs stored as files named by their cache key.
+
+    A hit refreshes the file's mtime, and a put that takes the directory over
+    `max_bytes` deletes the files with the oldest mtime first (LRU).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Bytes on disk, counted on the first put and kept up to date after
+        self._size = None
+
+    def _path(self, cache_key: str) -> str:
+        return os.path.join(self.directory, cache_key[:2], cache_key)
+
+    def get(self, cache_key: str) -> Optional[bytes]:
+        path = self._path(cache_key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Mark as recently used (atime is often not updated on reads)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, cache_key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            logger.info("Result larger than the cache; not cached.")
+            return
+        path = self._path(cache_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial result
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        """(path, size, mtime) of every cached result."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Evicted or replaced by another process meanwhile
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        """Delete least recently used results until the cache fits max_bytes."""
+        # Rescan: other processes may share the directory
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        evicted = 0
+        for path, entry_size, _ in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            evicted += 1
+        self._size = size
+        logger.info(f"Evicted {evicted} results from the local result cache.")
+
+
+class S3ManifestCache:
+    """Manifest entries in S3 pointing at previously written outputs."""
+
+    def __init__(self, s3, bucket: str, prefix: str = ""):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/" if prefix else ""
+
+    def _manifest_key(self, cache_key: str) -> str:
+        return f"{self.prefix}{cache_key}.json"
+
+    def lookup(self, cache_key: str) -> Optional[dict]:
+        """Return {'bucket', 'key', 'etag'} of the cached output, or None."""
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3.get_object(
+                Bucket=self.bucket, Key=self._manifest_key(cache_key)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def record(self, cache_key: str, bucket: str, key: str, etag: str):
+        """Point `cache_key` at the output just written at `bucket`/`key`."""
+        entry = {"bucket": bucket, "key": key, "etag": etag}
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._manifest_key(cache_key),
+            Body=json.dumps(entry).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def copy_to(self, entry: dict, bucket: str, key: str) -> bool:
+        """
+        Server-side copy of a cached output to a new location.
+
+        The copy only happens if the output still has the ETag it was recorded
+        with, so an output overwritten since is never served.
+
+        Returns:
+            bool: False if the cached output was deleted or replaced (a stale
+            entry).
+        """
+        from botocore.exceptions import ClientError
+
+        if not entry.get("etag"):
+            logger.info("Result cache entry without an ETag; treated as a miss.")
+            return False
+        try:
+            self.s3.copy_object(
+                Bucket=bucket,
+                Key=key,
+                CopySource={"Bucket": entry["bucket"], "Key": entry["key"]},
+                CopySourceIfMatch=entry["etag"],
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                logger.info("Stale result cache entry; output no longer exists.")
+                return False
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "412"):
+                logger.info("Stale result cache entry; output was overwritten.")
+                return False
+            raise
+        return True
+
+
+def get_local_cache() -> Optional[LocalResultCache]:
+    """
+    The local disk cache configured by RESULT_CACHE_DIR, if any, bounded by
+    RESULT_CACHE_MAX_BYTES.
+    """
+    directory = os.getenv(LOCAL_CACHE_ENV)
+    if not directory:
+        return None
+    max_bytes = int(os.getenv(MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+    # One instance per directory, so its size is not recounted on every call
+    cache = _local_caches.get((directory, max_bytes))
+    if cache is None:
+        cache = _local_caches[(directory, max_bytes)] = LocalResultCache(
+            directory, max_bytes
+        )
+    return cache
+
+
+def get_manifest_cache(s3) -> Optional[S3ManifestCache]:
+    """The S3 manifest cache configured by RESULT_CACHE_MANIFEST, if any."""
+    location = os.getenv(MANIFEST_CACHE_ENV)
+    if not location:
+        return None
+    bucket, _, prefix = location.replace("s3://", "").partition("/")
+    return S3ManifestCache(s3, bucket, prefix)
@@ -0,0 +1,269 @@
+# Obfuscation rules: which fields to obfuscate, how, and where to write the output
+# for each incoming S3 key. Lets one Lambda serve many datasets.
+#
+# The rules table is a JSON document, read from a local file or an S3 object:
+#
+# {
+#   "rules": [
+#     {"prefix": "hr/", "pii_fields": ["name", "salary"], "output_prefix": "safe/hr/"},
+#     {"match": "students/*.csv", "pii_fields": ["name", "email"]}
+#   ],
+#   "default": {"pii_fields": ["name", "email"], "output_prefix": "obfuscated/"}
+# }
+#
+# The first matching rule wins ("prefix" is a key prefix, "match" is a glob).
+# Each rule may set "pii_fields", "strategy", "output_prefix", "output_bucket",
+# "output_format", "output_compression" and "shard" (split the output into
+# part files, e.g. {"target_bytes": 134217728}); anything it leaves out is
+# taken from "default".
+#
+# The table is loaded once per container and cached. After the TTL expires it
+# is revalidated (ETag for S3, mtime for local files) instead of re-downloaded,
+# by one thread while the others keep using the cached table. If a reload
+# fails (S3 error, invalid JSON or rules), the last good table stays in use.
+import fnmatch
+import json
+import os
+import threading
+import time
+from typing import Optional
+from obfuscator import STRATEGIES
+from converters import OUTPUT_FORMATS
+from compression import CODECS
+from sharding import validate_shard_options
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/rules.log")
+
+RULES_SOURCE_ENV = "OBFUSCATION_RULES"
+RULES_TTL_ENV = "OBFUSCATION_RULES_TTL"
+DEFAULT_TTL_SECONDS = 300
+
+# Used when no rules table is configured (the original hard-coded behaviour)
+BUILTIN_DEFAULT = {
+    "pii_fields": ["name", "email"],
+    "strategy": "mask",
+    "output_prefix": "obfuscated/",
+    "output_bucket": None,
+    "output_format": None,
+    "output_compression": None,
+    "shard": None,
+}
+
+_RULE_KEYS = {
+    "prefix",
+    "match",
+    "pii_fields",
+    "strategy",
+    "output_prefix",
+    "output_bucket",
+    "output_format",
+    "output_compression",
+    "shard",
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+# One lock per source, held while it is fetched (never while _cache_lock is)
+_load_locks = {}
+
+
+class RuleTable:
+    """An ordered, validated list of rules plus a default."""
+
+    def __init__(self, config: dict):
+        if not isinstance(config, dict):
+            raise ValueError("Rules config must be a JSON object.")
+
+        rules = config.get("rules", [])
+        if not isinstance(rules, list):
+            raise ValueError("'rules' must be a list.")
+
+        self.default = None
+        if config.get("default") is not None:
+            self.default = _validate_rule(
+                {**BUILTIN_DEFAULT, **config["default"]}, "default"
+            )
+
+        self.rules = []
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict):
+                raise ValueError(f"Rule {index} must be an object.")
+            if "prefix" not in rule and "match" not in rule:
+                raise ValueError(f"Rule {index} needs a 'prefix' or 'match'.")
+            base = self.default or BUILTIN_DEFAULT
+            self.rules.append(_validate_rule({**base, **rule}, f"Rule {index}"))
+
+    def resolve(self, key: str) -> Optional[dict]:
+        """
+        Return the settings for an S3 key, or None if no rule (or default) applies.
+
+        Returns:
+            dict | None: 'pii_fields', 'strategy', 'output_prefix', 'output_bucket',
+            'output_format', 'output_compression', 'shard'.
+        """
+        for rule in self.rules:
+            if "prefix" in rule and not key.startswith(rule["prefix"]):
+                continue
+            if "match" in rule and not fnmatch.fnmatchcase(key, rule["match"]):
+                continue
+            return rule
+        return self.default
+
+
+def _validate_rule(rule: dict, label: str) -> dict:
+    unknown = set(rule) - _RULE_KEYS
+    if unknown:
+        raise ValueError(f"{label} has unknown settings: {', '.join(sorted(unknown))}")
+
+    pii_fields = rule.get("pii_fields")
+    if not isinstance(pii_fields, list) or not pii_fields:
+        raise ValueError(f"{label}: 'pii_fields' must be a non-empty list.")
+    if not all(isinstance(field, str) for field in pii_fields):
+        raise ValueError(f"{label}: all PII field names must be strings.")
+
+    if rule.get("strategy") not in STRATEGIES:
+        raise ValueError(
+            f"{label}: unsupported strategy '{rule.get('strategy')}'. "
+            f"Supported: {', '.join(STRATEGIES)}."
+        )
+    if not isinstance(rule.get("output_prefix"), str):
+        raise ValueError(f"{label}: 'output_prefix' must be a string.")
+    output_format = rule.get("output_format")
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"{label}: unsupported output_format '{output_format}'.")
+    output_compression = rule.get("output_compression")
+    if output_compression is not None and output_compression not in CODECS:
+        raise ValueError(
+            f"{label}: unsupported output_compression '{output_compression}'."
+        )
+    try:
+        validate_shard_options(rule.get("shard"))
+    except ValueError as e:
+        raise ValueError(f"{label}: {e}")
+    return rule
+
+
+class _CachedTable:
+    def __init__(self, table: RuleTable, version, loaded_at: float):
+        self.table = table
+        self.version = version
+        self.checked_at = loaded_at
+        self.reloading = False
+
+
+def _load_from_s3(source: str, s3, version=None):
+    """Return (config, etag), or (None, version) if the ETag is unchanged."""
+    from botocore.exceptions import ClientError
+
+    bucket, key = source.replace("s3://", "").split("/", 1)
+    request = {"Bucket": bucket, "Key": key}
+    if version:
+        request["IfNoneMatch"] = version
+    try:
+        response = s3.get_object(**request)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("304", "NotModified"):
+            return None, version
+        raise
+    return json.loads(response["Body"].read()), response.get("ETag")
+
+
+def _load_from_file(source: str, version=None):
+    """Return (config, mtime), or (None, version) if the file is unchanged."""
+    mtime = os.stat(source).st_mtime_ns
+    if version is not None and mtime == version:
+        return None, version
+    with open(source, "r", encoding="utf-8") as f:
+        return json.load(f), mtime
+
+
+def get_rule_table(source: str = None, s3=None, ttl: float = None) -> RuleTable:
+    """
+    Return the rules table for this container, loading or revalidating as needed.
+
+    Args:
+        source (str, optional): Local path or s3:// URI. Defaults to the
+            OBFUSCATION_RULES env var; built-in defaults are used when unset.
+        s3 (boto3.client, optional): Client used for s3:// sources.
+        ttl (float, optional): Seconds before revalidation. Defaults to
+            OBFUSCATION_RULES_TTL (300).
+
+    Returns:
+        RuleTable: The cached (or freshly loaded) table. A failed reload
+        logs a warning and returns the last good table until the next TTL.
+
+    Raises:
+        Exception: If the very first load fails (nothing to fall back on).
+    """
+    source = source if source is not None else os.getenv(RULES_SOURCE_ENV, "")
+    if not source:
+        return RuleTable({"default": BUILTIN_DEFAULT})
+
+    if ttl is None:
+        ttl = float(os.getenv(RULES_TTL_ENV, DEFAULT_TTL_SECONDS))
+
+    with _cache_lock:
+        cached = _cache.get(source)
+        if cached is not None and (
+            cached.reloading or time.monotonic() - cached.checked_at < ttl
+        ):
+            # Fresh, or being revalidated by another thread: serve it as is
+            return cached.table
+        if cached is not None:
+            cached.reloading = True
+        load_lock = _load_locks.setdefault(source, threading.Lock())
+
+    # The fetch runs outside _cache_lock: other threads keep serving the
+    # cached table meanwhile, and only first loads wait for it
+    with load_lock:
+        with _cache_lock:
+            current = _cache.get(source)
+        if current is not None and current is not cached:
+            return current.table  # loaded by another thread while we waited
+        try:
+            return _reload(source, s3, cached)
+        except Exception:
+            if cached is None:
+                raise
+            logger.warning(
+                f"⚠️ Could not reload the rules table from {source}; "
+                "keeping the last good copy.",
+                exc_info=True,
+            )
+            cached.checked_at = time.monotonic()
+            return cached.table
+        finally:
+            if cached is not None:
+                cached.reloading = False
+
+
+def _reload(source: str, s3, cached: Optional[_CachedTable]) -> RuleTable:
+    """Fetch (or revalidate) a rules table and cache it."""
+    previous_version = cached.version if cached else None
+    if source.startswith("s3://"):
+        if s3 is None:
+            from s3_utils import get_s3_client
+
+            s3 = get_s3_client()
+        config, version = _load_from_s3(source, s3, previous_version)
+    else:
+        config, version = _load_from_file(source, previous_version)
+    now = time.monotonic()
+
+    if config is None:
+        logger.info("Rules table unchanged, keeping cached copy.")
+        cached.checked_at = now
+        return cached.table
+
+    table = RuleTable(config)
+    logger.info(f"Loaded {len(table.rules)} obfuscation rules from {source}")
+    with _cache_lock:
+        _cache[source] = _CachedTable(table, version, now)
+    return table
+
+
+def clear_rule_cache():
+    """Forget any cached rules tables (used by tests and config reloads)."""
+    with _cache_lock:
+        _cache.clear()
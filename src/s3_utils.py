@@ -1,23 +1,29 @@
 # Downloads CSV content from S3:
-import boto3
+# boto3, botocore and chardet are imported inside the functions that need them,
+# so a Lambda cold start (or a CLI validation error) does not pay for them up front.
+import io
 import re
 import os
-import chardet
-from botocore.exceptions import ClientError
+import threading
 from utils.logging_utils import setup_file_logger
 from exceptions import S3ObjectNotFoundError
 
 logger = setup_file_logger(__name__, "logs/s3_utils.log")
 
+# Warm Lambda containers reuse one client per endpoint instead of rebuilding it
+_client_cache = {}
+_client_lock = threading.Lock()
+
 
 def fetch_file_from_s3(
-    s3_uri: str, encoding_override: str = None, binary: bool = False
+    s3_uri: str, encoding_override: str = None, binary: bool = False, s3=None
 ) -> str:
     """
     Fetch a file from an S3 bucket using a boto3 client.
 
     Args:
         s3_uri (str): The S3 URI in the format s3://bucket/key
+        s3 (boto3.client, optional): Client to reuse; a new one is created if None
 
     Returns:
         str: The file content as a UTF-8 string.
@@ -25,17 +31,9 @@ def fetch_file_from_s3(
     Raises:
         FileNotFoundError: If the file does not exist.
     """
-    # endpoint_url = os.getenv("AWS_ENDPOINT_URL", "http://localhost:4566")
-    endpoint_url = os.getenv("AWS_ENDPOINT_URL", None)
-
-    s3 = boto3.client(
-        "s3",
-        region_name="eu-west-2",
-        endpoint_url=endpoint_url,
-        # nosec in lines 34 and 35 tells Bandit to skip security checks on these lines.
-        aws_access_key_id="test",  # nosec
-        aws_secret_access_key="test",  # nosec
-    )
+    if s3 is None:
+        # endpoint_url = os.getenv("AWS_ENDPOINT_URL", "http://localhost:4566")
+        s3 = _new_client(os.getenv("AWS_ENDPOINT_URL", None))
 
     bucket, key = s3_uri.replace("s3://", "").split("/", 1)
     raw_data = safe_get_s3_object(s3, bucket, key)
@@ -48,19 +46,92 @@ def fetch_file_from_s3(
         logger.info(f"Using manually specified encoding: {encoding_override}")
         return raw_data.decode(encoding_override)
 
-    # Auto-detect encoding using chardet
-    detection = chardet.detect(raw_data)
-    encoding = detection.get("encoding", "utf-8")
+    return raw_data.decode(detect_encoding(raw_data))
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Auto-detect the text encoding of a file from (a sample of) its bytes.
+
+    Args:
+        sample (bytes): The file content, or its first few KB.
+
+    Returns:
+        str: The encoding name reported by chardet (utf-8 if undetermined).
+    """
+    import chardet
+
+    detection = chardet.detect(sample)
+    encoding = detection.get("encoding") or "utf-8"
     confidence = detection.get("confidence", 1.0)
 
     if confidence < 0.7:
         logger.warning(
             f"⚠️ Low confidence in encoding detection ({confidence:.2f}). "
-            "Proceeding with {encoding}."
+            f"Proceeding with {encoding}."
         )
 
     logger.info(f"Detected file encoding: {encoding} (confidence: {confidence:.2f})")
-    return raw_data.decode(encoding)
+    return encoding
+
+
+# How much of a streamed file is inspected to guess its encoding
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def open_s3_stream(s3_uri: str, s3=None):
+    """
+    Open an S3 object for streaming reads instead of downloading it in one go.
+
+    Args:
+        s3_uri (str): The S3 URI in the format s3://bucket/key
+        s3 (boto3.client, optional): Client to reuse
+
+    Returns:
+        botocore.response.StreamingBody: The object's body stream.
+
+    Raises:
+        S3ObjectNotFoundError: If the object does not exist
+    """
+    from botocore.exceptions import ClientError
+
+    s3 = s3 or get_s3_client()
+    bucket, key = s3_uri.replace("s3://", "").split("/", 1)
+    try:
+        return s3.get_object(Bucket=bucket, Key=key)["Body"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            logger.error(
+                f"📁 Missing file: '{key}' in bucket: '{bucket}' "
+                "- S3 returned NoSuchKey."
+            )
+            raise S3ObjectNotFoundError(bucket, key)
+        raise
+
+
+def open_text_stream(stream, encoding_override: str = None):
+    """
+    Wrap a buffered binary stream in a text stream, guessing its encoding from
+    the first ENCODING_SAMPLE_SIZE bytes only.
+
+    Args:
+        stream: A binary stream supporting peek() (e.g. a decompressor)
+        encoding_override (str, optional): Skip detection and use this encoding
+
+    Returns:
+        io.TextIOWrapper: Text stream suitable for the csv and json modules.
+    """
+    if encoding_override:
+        logger.info(f"Using manually specified encoding: {encoding_override}")
+        encoding = encoding_override
+    else:
+        encoding = detect_encoding(
+            stream.peek(ENCODING_SAMPLE_SIZE)[:ENCODING_SAMPLE_SIZE]
+        )
+        # A pure-ASCII sample says nothing about the rest of the file
+        if encoding.lower() == "ascii":
+            encoding = "utf-8"
+    return io.TextIOWrapper(stream, encoding=encoding, newline="")
 
 
 def is_valid_s3_uri(uri: str) -> bool:
@@ -83,6 +154,8 @@ def safe_get_s3_object(s3, bucket: str, key: str) -> bytes:
     Raises:
         FileNotFoundError: If the object does not exist
     """
+    from botocore.exceptions import ClientError
+
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
         return response["Body"].read()
@@ -98,18 +171,173 @@ def safe_get_s3_object(s3, bucket: str, key: str) -> bytes:
             raise
 
 
-def get_s3_client() -> boto3.client:
-    endpoint_url = os.getenv("AWS_ENDPOINT_URL")
+def _new_client(endpoint_url: str = None):
+    """A boto3 S3 client with the retry policy and prefix throttling applied."""
+    import boto3
+    from throttling import client_config, install_throttling
 
-    if endpoint_url:
-        print(f"Using LocalStack or custom S3 endpoint: {endpoint_url}")
-    else:
-        print("Using real AWS S3")
-    return boto3.client(
+    client = boto3.client(
         "s3",
         region_name="eu-west-2",
         endpoint_url=endpoint_url,
-        # nosec in lines 34 and 35 tells Bandit to skip security checks on these lines.
+        # nosec tells Bandit to skip security checks on these lines.
         aws_access_key_id="test",  # nosec
         aws_secret_access_key="test",  # nosec
+        # Adaptive retries with jittered backoff; SlowDown is retried, not fatal
+        config=client_config(),
     )
+    return install_throttling(client)
+
+
+def get_s3_client():
+    """
+    Return a boto3 S3 client, created once per endpoint and reused afterwards.
+
+    boto3 clients are thread-safe, so the cached client can be shared across
+    warm Lambda invocations and worker threads. Every client shares the
+    per-prefix rate limiter in throttling.py.
+    """
+    endpoint_url = os.getenv("AWS_ENDPOINT_URL")
+
+    with _client_lock:
+        client = _client_cache.get(endpoint_url)
+        if client is None:
+            if endpoint_url:
+                print(f"Using LocalStack or custom S3 endpoint: {endpoint_url}")
+            else:
+                print("Using real AWS S3")
+            client = _new_client(endpoint_url)
+            _client_cache[endpoint_url] = client
+    return client
+
+
+def put_object_if_absent(s3, bucket: str, key: str, body: bytes, **extra) -> bool:
+    """
+    Write an object only if the key does not exist yet.
+
+    Uses a single conditional PUT (If-None-Match: *), which is atomic when two
+    invocations race for the same key. When conditional writes are disabled
+    (S3_CONDITIONAL_WRITES=false, e.g. for emulators that ignore the header) or
+    the installed botocore/endpoint does not support them, it falls back to a
+    head_object check followed by a plain put_object.
+
+    Args:
+        s3 (boto3.client): An S3 boto3 client
+        bucket (str): Bucket name
+        key (str): Destination key
+        body (bytes): Object content
+        **extra: Additional put_object arguments (e.g. Metadata)
+
+    Returns:
+        bool: True if the object was written, False if it already existed.
+    """
+    from botocore.exceptions import ClientError, ParamValidationError
+
+    if os.getenv("S3_CONDITIONAL_WRITES", "true").lower() != "false":
+        try:
+            s3.put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch="*", **extra)
+            return True
+        except ParamValidationError:
+            logger.info("Conditional writes not supported by botocore; using HEAD.")
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            # 412: the key exists; 409: a concurrent conditional write won the race
+            if error_code in ("PreconditionFailed", "412"):
+                return False
+            if error_code in ("ConditionalRequestConflict", "409"):
+                return False
+            if error_code not in ("NotImplemented", "501"):
+                raise
+            logger.info("Conditional writes not supported by endpoint; using HEAD.")
+
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return False
+    except ClientError as e:
+        # If 404 (NoSuchKey), it's okay to write the new file
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+
+    s3.put_object(Bucket=bucket, Key=key, Body=body, **extra)
+    return True
+
+
+def put_object_if_match(
+    s3, bucket: str, key: str, body: bytes, etag: str, **extra
+) -> bool:
+    """
+    Replace an object only if it is still the version with `etag`.
+
+    Uses a conditional PUT (If-Match), so a concurrent writer's version is
+    never overwritten. When conditional writes are disabled or unsupported, it
+    falls back to comparing the ETag from head_object before a plain PUT.
+
+    Returns:
+        bool: True if the object was written, False if it had changed.
+    """
+    from botocore.exceptions import ClientError, ParamValidationError
+
+    if os.getenv("S3_CONDITIONAL_WRITES", "true").lower() != "false":
+        try:
+            s3.put_object(Bucket=bucket, Key=key, Body=body, IfMatch=etag, **extra)
+            return True
+        except ParamValidationError:
+            logger.info("Conditional writes not supported by botocore; using HEAD.")
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code in ("PreconditionFailed", "412", "NoSuchKey", "404"):
+                return False
+            if error_code in ("ConditionalRequestConflict", "409"):
+                return False
+            if error_code not in ("NotImplemented", "501"):
+                raise
+            logger.info("Conditional writes not supported by endpoint; using HEAD.")
+
+    try:
+        current = s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        return False
+    if current != etag:
+        return False
+    s3.put_object(Bucket=bucket, Key=key, Body=body, **extra)
+    return True
+
+
+def get_object_etag(s3, bucket: str, key: str) -> str:
+    """
+    Return an object's ETag (unquoted) with a HEAD request, without its body.
+
+    Raises:
+        S3ObjectNotFoundError: If the object does not exist
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            raise S3ObjectNotFoundError(bucket, key)
+        raise
+    return response["ETag"].strip('"')
+
+
+def read_s3_prefix(s3_uri: str, size: int, s3=None) -> bytes:
+    """
+    Read only the first `size` bytes of an S3 object with a ranged GET.
+
+    Raises:
+        S3ObjectNotFoundError: If the object does not exist
+    """
+    from botocore.exceptions import ClientError
+
+    s3 = s3 or get_s3_client()
+    bucket, key = s3_uri.replace("s3://", "").split("/", 1)
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{size - 1}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            raise S3ObjectNotFoundError(bucket, key)
+        raise
+    return response["Body"].read()
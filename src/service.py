@@ -0,0 +1,248 @@
+# Long-running obfuscation service (python src/main.py --serve ...).
+#
+# Every CLI run pays interpreter, pandas/pyarrow and boto3 start-up. In service
+# mode those are paid once: the process keeps a warm S3 client, the rules table
+# and the format engines loaded, and accepts the same JSON payload as
+# obfuscate_handler over HTTP (TCP or a Unix socket):
+#
+#   POST /obfuscate     body: {"file_to_obfuscate": ..., "pii_fields": [...]}
+#                       → 200 with the obfuscated bytes
+#   GET  /health        → {"status": "ok", "active": n, "queued": m, ...}
+#
+# At most `workers` requests are obfuscated at once and at most `queue_size`
+# more wait for a worker; beyond that requests are rejected with 503 and a
+# Retry-After header, so callers back off instead of piling up connections.
+import json
+import os
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+from exceptions import S3ObjectNotFoundError, UnsupportedFormatError
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/service.log")
+
+WORKERS_ENV = "SERVICE_WORKERS"
+QUEUE_SIZE_ENV = "SERVICE_QUEUE_SIZE"
+
+DEFAULT_QUEUE_SIZE = 64
+# Largest request body accepted; payloads are small JSON documents
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class QueueFullError(Exception):
+    """Raised when the service is at its concurrency and queue limits."""
+
+
+class ObfuscationService:
+    """A bounded worker pool in front of obfuscate_handler."""
+
+    def __init__(self, handler: Callable, workers: int = None, queue_size: int = None):
+        """
+        Args:
+            handler (Callable): handler(json_input, encoding_override, s3) -> bytes,
+                i.e. main.obfuscate_handler.
+            workers (int, optional): Concurrent obfuscations (SERVICE_WORKERS,
+                default the CPU count).
+            queue_size (int, optional): Requests allowed to wait for a worker
+                (SERVICE_QUEUE_SIZE, default 64).
+        """
+        self.handler = handler
+        self.workers = workers or int(os.getenv(WORKERS_ENV, os.cpu_count() or 1))
+        self.queue_size = (
+            queue_size
+            if queue_size is not None
+            else int(os.getenv(QUEUE_SIZE_ENV, DEFAULT_QUEUE_SIZE))
+        )
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="obfuscate"
+        )
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self.s3 = None
+
+    def warm_up(self):
+        """Load what every request needs once: S3 client, rules and engines."""
+        from s3_utils import get_s3_client
+        from rules import get_rule_table
+        import formats  # noqa: F401 - registers and imports the engines
+        import pyarrow  # noqa: F401
+
+        self.s3 = get_s3_client()
+        try:
+            get_rule_table(s3=self.s3)
+        except Exception:
+            # The rules table is optional for direct payloads
+            logger.warning("Rules table could not be loaded during warm-up.")
+        logger.info(f"Service warm: {self.workers} workers, queue {self.queue_size}.")
+
+    def submit(self, json_input: str, encoding_override: str = None) -> bytes:
+        """
+        Obfuscate one payload, waiting for a worker if needed.
+
+        Raises:
+            QueueFullError: If all workers are busy and the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError("Service is at capacity; retry later.")
+        with self._lock:
+            self._pending += 1
+        try:
+            return self._pool.submit(self._run, json_input, encoding_override).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def _run(self, json_input: str, encoding_override: str = None) -> bytes:
+        with self._lock:
+            self._active += 1
+        try:
+            return self.handler(json_input, encoding_override, self.s3)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "status": "ok",
+                "workers": self.workers,
+                "active": self._active,
+                "queued": self._pending - self._active,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def _status_for(error: Exception) -> HTTPStatus:
+    if isinstance(error, QueueFullError):
+        return HTTPStatus.SERVICE_UNAVAILABLE
+    if isinstance(error, S3ObjectNotFoundError):
+        return HTTPStatus.NOT_FOUND
+    if isinstance(error, (KeyError, TypeError, ValueError, UnsupportedFormatError)):
+        return HTTPStatus.BAD_REQUEST
+    return HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end; self.server.service is the ObfuscationService."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._send_json(HTTPStatus.OK, self.server.service.stats())
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found."})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/obfuscate":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found."})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self._send_json(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Payload too large."}
+            )
+            return
+        json_input = self.rfile.read(length).decode("utf-8")
+        encoding = parse_qs(url.query).get("encoding", [None])[0]
+
+        try:
+            result = self.server.service.submit(json_input, encoding)
+        except Exception as e:
+            status = _status_for(e)
+            if status == HTTPStatus.INTERNAL_SERVER_ERROR:
+                logger.exception("Service request failed.")
+            headers = {"Retry-After": "1"} if isinstance(e, QueueFullError) else {}
+            # KeyError wraps its message in quotes; report the bare message
+            message = e.args[0] if isinstance(e, KeyError) and e.args else str(e)
+            self._send_json(status, {"error": message}, headers)
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(result)))
+        self.end_headers()
+        self.wfile.write(result)
+
+    def _send_json(self, status: HTTPStatus, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service: ObfuscationService, address: str):
+    """
+    Bind the HTTP front end.
+
+    Args:
+        service (ObfuscationService): The service to expose.
+        address (str): 'host:port' for TCP, or 'unix:/path/to.sock'.
+
+    Returns:
+        socketserver.BaseServer: Bound server, not yet serving.
+    """
+    if address.startswith("unix:"):
+        path = address[len("unix:") :]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = UnixHTTPServer(path, ServiceRequestHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = ThreadingHTTPServer(
+            (host or "127.0.0.1", int(port)), ServiceRequestHandler
+        )
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(handler: Callable, address: str, workers: int = None, queue_size: int = None):
+    """Run the service until interrupted (blocking)."""
+    service = ObfuscationService(handler, workers, queue_size)
+    service.warm_up()
+    server = create_server(service, address)
+    print(f"Obfuscation service listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if address.startswith("unix:"):
+            os.unlink(address[len("unix:") :])
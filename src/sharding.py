@@ -0,0 +1,442 @@
+# Sharded output: split a large obfuscated result into size-bounded part files.
+#
+# Downstream engines (Spark, Athena) parallelise over files, so one huge output
+# object is split into parts written under a directory named after the output:
+#
+#   obfuscated/data.csv  →  obfuscated/data/part-00000.csv
+#                           obfuscated/data/part-00001.csv
+#                           obfuscated/data/manifest.json
+#
+# Parts are bounded by "target_bytes" and/or "rows_per_part". Every CSV part
+# repeats the header and every columnar part is a complete file, so each part
+# can be read on its own. Parts are uploaded on a thread pool while the next
+# ones are encoded. The manifest lists the parts with their row counts, sizes
+# and SHA-256 checksums, and is written last, once every part is in place.
+#
+# stream_sharded_output cuts parts while the obfuscator runs: CSV and NDJSON
+# engines write into a sink that hands each full part to the uploader, and
+# columnar files are obfuscated one record batch at a time. A bounded number
+# of parts is held in memory (encoded or uploading) at any time; the engine
+# waits for an upload slot before the next part is cut.
+# Parts left over from an earlier run (e.g. one that produced more parts) are
+# deleted after the new manifest is written, so listing the directory gives
+# the same parts as the manifest.
+import csv
+import hashlib
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+from columnar import COLUMNAR_FORMATS
+from compression import CODECS, compress_bytes, split_compression_suffix
+from hashing import content_sha256
+import tuning
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/sharding.log")
+
+# Parquet/Arrow/ORC parts are decoded and re-encoded in slices of this many rows
+COLUMNAR_SLICE_ROWS = 64 * 1024
+MANIFEST_NAME = "manifest.json"
+
+_SHARD_KEYS = {"target_bytes", "rows_per_part"}
+# Formats whose parts are cut while obfuscating (stream_sharded_output)
+STREAMABLE_FORMATS = ("csv", "ndjson", *COLUMNAR_FORMATS)
+
+
+def validate_shard_options(options: Optional[dict]) -> Optional[dict]:
+    """
+    Check a 'shard' setting: {'target_bytes': int, 'rows_per_part': int}.
+
+    Raises:
+        ValueError: If the options are not a dict of positive integers with at
+            least one of the two keys.
+    """
+    if options is None:
+        return None
+    if not isinstance(options, dict):
+        raise ValueError("'shard' must be an object.")
+    unknown = set(options) - _SHARD_KEYS
+    if unknown:
+        raise ValueError(f"Unknown shard options: {', '.join(sorted(unknown))}")
+    if not options:
+        raise ValueError("'shard' needs 'target_bytes' or 'rows_per_part'.")
+    for name, value in options.items():
+        if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+            raise ValueError(f"'{name}' must be a positive integer.")
+    return options
+
+
+def shard_prefix(output_key: str) -> str:
+    """e.g. 'obfuscated/data.csv.gz' → 'obfuscated/data/'"""
+    directory, _, name = output_key.rpartition("/")
+    base = split_compression_suffix(name)[0].rsplit(".", 1)[0]
+    return f"{directory}/{base}/" if directory else f"{base}/"
+
+
+def part_key(prefix: str, index: int, file_format: str, compression=None) -> str:
+    suffix = CODECS[compression][0] if compression else ""
+    return f"{prefix}part-{index:05d}.{file_format}{suffix}"
+
+
+def _full(size: int, rows: int, target_bytes, rows_per_part) -> bool:
+    return bool(
+        (target_bytes and size >= target_bytes)
+        or (rows_per_part and rows >= rows_per_part)
+    )
+
+
+def iter_parts(
+    data: bytes, file_format: str, target_bytes: int = None, rows_per_part: int = None
+) -> Iterator[Tuple[bytes, int]]:
+    """
+    Split an obfuscated file into self-contained parts.
+
+    Args:
+        data (bytes): Obfuscated content.
+        file_format (str): 'csv', 'ndjson', 'json', 'parquet', 'arrow' or 'orc'.
+        target_bytes (int, optional): Approximate maximum part size (for
+            columnar formats, of the decoded data).
+        rows_per_part (int, optional): Maximum rows per part.
+
+    Yields:
+        tuple: (part bytes, row count)
+    """
+    if file_format == "csv":
+        yield from _csv_parts(data, target_bytes, rows_per_part)
+    elif file_format in ("ndjson", "json"):
+        yield from _json_parts(data, file_format, target_bytes, rows_per_part)
+    elif file_format in COLUMNAR_FORMATS:
+        yield from _columnar_parts(data, file_format, target_bytes, rows_per_part)
+    else:
+        raise ValueError(f"Cannot shard '{file_format}' output.")
+
+
+def _csv_parts(data: bytes, target_bytes, rows_per_part):
+    # Rows are re-written with the same dialect obfuscate_csv uses, so the
+    # parts are byte-for-byte slices of the original (plus the header)
+    reader = csv.reader(io.StringIO(data.decode("utf-8"), newline=""))
+    header = next(reader, None)
+    if header is None:
+        return
+    buffer, rows = None, 0
+    for row in reader:
+        if buffer is None:
+            buffer, rows = io.StringIO(), 0
+            writer = csv.writer(buffer)
+            writer.writerow(header)
+        writer.writerow(row)
+        rows += 1
+        if _full(buffer.tell(), rows, target_bytes, rows_per_part):
+            yield buffer.getvalue().encode("utf-8"), rows
+            buffer = None
+    if buffer is not None:
+        yield buffer.getvalue().encode("utf-8"), rows
+    elif rows == 0:
+        # Header only: still one (empty) part so the dataset has a schema
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(header)
+        yield buffer.getvalue().encode("utf-8"), 0
+
+
+def _json_parts(data: bytes, file_format: str, target_bytes, rows_per_part):
+    def encode(records):
+        if file_format == "json":
+            return json.dumps(records, ensure_ascii=False, indent=2).encode("utf-8")
+        return b"".join(
+            json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+            for record in records
+        )
+
+    if file_format == "json":
+        parsed = json.loads(data)
+        records = [parsed] if isinstance(parsed, dict) else parsed
+        sizes = (len(json.dumps(record, ensure_ascii=False)) for record in records)
+    else:
+        lines = [line for line in data.decode("utf-8").split("\n") if line.strip()]
+        records = (json.loads(line) for line in lines)
+        sizes = (len(line) + 1 for line in lines)
+
+    batch, size = [], 0
+    for record, record_size in zip(records, sizes):
+        batch.append(record)
+        size += record_size
+        if _full(size, len(batch), target_bytes, rows_per_part):
+            yield encode(batch), len(batch)
+            batch, size = [], 0
+    if batch:
+        yield encode(batch), len(batch)
+
+
+def _columnar_parts(data: bytes, file_format: str, target_bytes, rows_per_part):
+    from columnar import open_batches
+
+    schema, batches = open_batches(data, file_format)
+    yield from _batch_parts(schema, batches, file_format, target_bytes, rows_per_part)
+
+
+def _batch_parts(
+    schema, batches, file_format: str, target_bytes=None, rows_per_part=None
+):
+    from columnar import write_batches
+
+    slices, rows, size, emitted = [], 0, 0, 0
+    for batch in batches:
+        offset = 0
+        while offset < batch.num_rows:
+            take = COLUMNAR_SLICE_ROWS
+            if rows_per_part:
+                take = min(take, rows_per_part - rows)
+            piece = batch.slice(offset, take)
+            offset += piece.num_rows
+            slices.append(piece)
+            rows += piece.num_rows
+            size += piece.nbytes
+            if _full(size, rows, target_bytes, rows_per_part):
+                yield write_batches(schema, slices, file_format), rows
+                slices, rows, size, emitted = [], 0, 0, emitted + 1
+    if slices or not emitted:
+        yield write_batches(schema, slices, file_format), rows
+
+
+class _RecordParts:
+    """
+    Text stream a CSV or NDJSON engine writes to, one record per write()
+    call (the CSV header first); each full part is passed to `emit` as
+    (part bytes, row count) as soon as it fills up.
+    """
+
+    def __init__(
+        self,
+        file_format: str,
+        emit: Callable[[bytes, int], None],
+        target_bytes: int = None,
+        rows_per_part: int = None,
+    ):
+        self.emit = emit
+        self.target_bytes = target_bytes
+        self.rows_per_part = rows_per_part
+        # NDJSON parts have no header
+        self.header = None if file_format == "csv" else ""
+        self.records, self.size, self.emitted = [], 0, 0
+
+    def write(self, text: str) -> int:
+        if self.header is None:
+            self.header = text
+            return len(text)
+        self.records.append(text)
+        self.size += len(text)
+        if _full(
+            len(self.header) + self.size,
+            len(self.records),
+            self.target_bytes,
+            self.rows_per_part,
+        ):
+            self._flush()
+        return len(text)
+
+    def _flush(self):
+        body = "".join([self.header, *self.records]).encode("utf-8")
+        self.emit(body, len(self.records))
+        self.records, self.size, self.emitted = [], 0, self.emitted + 1
+
+    def close(self):
+        """Emit the last part; a header-only CSV still gets one empty part."""
+        if self.records or (self.header and not self.emitted):
+            self._flush()
+
+
+class _PartUploader:
+    """
+    Compress, checksum and upload parts on a thread pool in the order they
+    are added, holding at most two parts per upload thread in memory.
+    """
+
+    def __init__(
+        self, s3, bucket: str, output_key: str, file_format: str, compression=None
+    ):
+        self.s3, self.bucket = s3, bucket
+        self.prefix = shard_prefix(output_key)
+        self.file_format, self.compression = file_format, compression
+        # SHARD_UPLOAD_WORKERS, or tuned to the CPUs available
+        self.workers = tuning.upload_workers()
+        # Bound the encoded parts waiting for an upload thread
+        self.in_flight = threading.BoundedSemaphore(self.workers * 2)
+        self.parts: List[dict] = []
+        self.futures = []
+        # Identifies the content independently of the compression
+        self.digest = hashlib.sha256()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _upload(self, key: str, body: bytes):
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=body)
+        finally:
+            self.in_flight.release()
+
+    def add(self, body: bytes, rows: int):
+        self.digest.update(body)
+        if self.compression:
+            body = compress_bytes(body, self.compression)
+        key = part_key(self.prefix, len(self.parts), self.file_format, self.compression)
+        self.parts.append(
+            {
+                "key": key,
+                "rows": rows,
+                "bytes": len(body),
+                "sha256": content_sha256(body),
+            }
+        )
+        self.in_flight.acquire()
+        self.futures.append(self.pool.submit(self._upload, key, body))
+
+    def manifest(self, manifest_extra: dict = None) -> dict:
+        """Wait for every upload, then describe the parts."""
+        for future in self.futures:
+            future.result()
+        logger.info(
+            f"Wrote {len(self.parts)} parts to s3://{self.bucket}/{self.prefix}"
+        )
+        return {
+            **(manifest_extra or {}),
+            "format": self.file_format,
+            "compression": self.compression,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "total_rows": sum(part["rows"] for part in self.parts),
+            "content_sha256": self.digest.hexdigest(),
+            "parts": self.parts,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.shutdown(wait=True)
+
+
+def write_sharded_output(
+    s3,
+    bucket: str,
+    output_key: str,
+    data: bytes,
+    file_format: str,
+    shard: dict,
+    compression: str = None,
+    manifest_extra: dict = None,
+) -> dict:
+    """
+    Upload an obfuscated output that is already in memory as part files.
+
+    Used where parts cannot be cut while obfuscating (JSON documents,
+    converted outputs); see stream_sharded_output.
+
+    Args:
+        s3 (boto3.client): S3 client.
+        bucket (str): Output bucket.
+        output_key (str): The key a single output would have had; parts go to
+            shard_prefix(output_key).
+        data (bytes): Uncompressed obfuscated content.
+        file_format (str): Format of data.
+        shard (dict): 'target_bytes' and/or 'rows_per_part'.
+        compression (str, optional): Codec applied to every part.
+        manifest_extra (dict, optional): Extra fields for the manifest.
+
+    Returns:
+        dict: The manifest (not yet uploaded; see manifest_key()), with the
+        SHA-256 of the uncompressed parts in order as 'content_sha256'.
+    """
+    with _PartUploader(s3, bucket, output_key, file_format, compression) as parts:
+        for body, rows in iter_parts(data, file_format, **shard):
+            parts.add(body, rows)
+        return parts.manifest(manifest_extra)
+
+
+def stream_sharded_output(
+    s3,
+    bucket: str,
+    output_key: str,
+    source: Union[bytes, Iterable[str]],
+    file_format: str,
+    pii_fields: List[str],
+    strategy: str,
+    shard: dict,
+    compression: str = None,
+    manifest_extra: dict = None,
+) -> dict:
+    """
+    Obfuscate `source` and upload the result as part files, cutting and
+    uploading each part while the rest is still being obfuscated.
+
+    Args:
+        s3 (boto3.client): S3 client.
+        bucket (str): Output bucket.
+        output_key (str): The key a single output would have had.
+        source (bytes | TextIO): A text stream for 'csv' and 'ndjson', the
+            file content for 'parquet', 'arrow' and 'orc'.
+        file_format (str): Format of the input, and of the parts.
+        pii_fields (List[str]): Fields to obfuscate.
+        strategy (str): 'mask', 'tokenize' or 'drop'.
+        shard (dict): 'target_bytes' and/or 'rows_per_part'.
+        compression (str, optional): Codec applied to every part.
+        manifest_extra (dict, optional): Extra fields for the manifest.
+
+    Returns:
+        dict: The manifest, as write_sharded_output returns it. The parts are
+        the ones write_sharded_output cuts from the same obfuscated output.
+    """
+    from obfuscator import obfuscate_csv, obfuscate_ndjson
+
+    engines = {"csv": obfuscate_csv, "ndjson": obfuscate_ndjson}
+    if file_format not in STREAMABLE_FORMATS:
+        raise ValueError(f"Cannot stream '{file_format}' output into parts.")
+
+    with _PartUploader(s3, bucket, output_key, file_format, compression) as parts:
+        if file_format in engines:
+            sink = _RecordParts(file_format, parts.add, **shard)
+            engines[file_format](source, pii_fields, strategy, output=sink)
+            sink.close()
+        else:
+            from columnar import obfuscated_batches
+
+            schema, batches = obfuscated_batches(
+                source, pii_fields, file_format, strategy
+            )
+            for body, rows in _batch_parts(schema, batches, file_format, **shard):
+                parts.add(body, rows)
+        return parts.manifest(manifest_extra)
+
+
+def manifest_key(output_key: str) -> str:
+    return shard_prefix(output_key) + MANIFEST_NAME
+
+
+def delete_stale_parts(s3, bucket: str, output_key: str, manifest: dict) -> int:
+    """
+    Delete the part files under shard_prefix(output_key) that `manifest` does
+    not list. Call it once the manifest is written.
+
+    Returns:
+        int: Number of parts deleted.
+    """
+    prefix = shard_prefix(output_key)
+    current = {part["key"] for part in manifest["parts"]}
+    stale = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}part-"):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key not in current and "/" not in key[len(prefix) :]:
+                stale.append(key)
+
+    # delete_objects takes up to 1000 keys per request
+    for start in range(0, len(stale), 1000):
+        batch = stale[start : start + 1000]
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+    if stale:
+        logger.info(f"Deleted {len(stale)} stale parts from s3://{bucket}/{prefix}")
+    return len(stale)
@@ -0,0 +1,105 @@
+# Shared-memory hand-off of chunks between the parent and worker processes.
+#
+# Pickling a multi-MB chunk into a ProcessPoolExecutor copies it through a pipe
+# twice (parent → worker, result → parent). Instead the parent places the input
+# in one multiprocessing.shared_memory segment and sends workers a ChunkRef
+# (segment name + byte range); workers write their output into a region of a
+# preallocated output segment and send back only its length.
+#
+# Shared memory needs /dev/shm, which e.g. AWS Lambda does not provide;
+# callers check shared_memory_available() and fall back to pickling.
+from multiprocessing import shared_memory
+from typing import NamedTuple, Optional
+
+
+class ChunkRef(NamedTuple):
+    """A byte range of a named shared-memory segment; cheap to pickle."""
+
+    name: str
+    start: int
+    end: int
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+
+class SharedBuffer:
+    """
+    A shared-memory segment owned by the creating (parent) process.
+
+    Use as a context manager so the segment is always unlinked:
+
+        with SharedBuffer.from_bytes(data) as shared:
+            ref = shared.ref(0, 1024)
+    """
+
+    def __init__(self, size: int):
+        # A zero-size segment is not allowed
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.size = size
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SharedBuffer":
+        shared = cls(len(data))
+        shared._shm.buf[: len(data)] = data
+        return shared
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def ref(self, start: int, end: int) -> ChunkRef:
+        return ChunkRef(self._shm.name, start, end)
+
+    def read(self, start: int, end: int) -> bytes:
+        return bytes(self._shm.buf[start:end])
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_ref(*refs: ChunkRef) -> bytes:
+    """Worker side: copy the referenced ranges out of shared memory, joined."""
+    parts = []
+    for ref in refs:
+        shm = shared_memory.SharedMemory(name=ref.name)
+        try:
+            parts.append(bytes(shm.buf[ref.start : ref.end]))
+        finally:
+            shm.close()
+    return b"".join(parts)
+
+
+def write_ref(ref: ChunkRef, data: bytes) -> Optional[int]:
+    """
+    Worker side: write data at the start of the referenced range.
+
+    Returns:
+        int | None: Bytes written, or None if data does not fit (the caller
+        then returns the data by value instead).
+    """
+    if len(data) > ref.size:
+        return None
+    shm = shared_memory.SharedMemory(name=ref.name)
+    try:
+        shm.buf[ref.start : ref.start + len(data)] = data
+    finally:
+        shm.close()
+    return len(data)
+
+
+def shared_memory_available() -> bool:
+    """Whether this host can create shared-memory segments."""
+    try:
+        SharedBuffer(1).close()
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,478 @@
+# Subject-ID index: which objects under a prefix can contain which subjects.
+#
+# Erasing one person should not mean rewriting, or even reading, every object
+# in a bucket. For each data object the indexing job records the values of one
+# ID column as a Bloom filter, plus per-row-group min/max statistics for
+# Parquet (read from the footer, without decoding). The entries are stored
+# alongside the data:
+#
+#   data/2024/students.parquet
+#   data/_subject_index/student_id/2024/students.parquet@<etag>.json
+#
+# The source ETag is part of the entry's key, so one listing of the data and
+# one of the index tell which entries are current; update_index() only reads
+# new or changed objects and deletes entries of deleted or replaced ones.
+#
+# IDs are indexed in the form erasure matches them in: normalise_id() for CSV
+# and JSON, column_ids() for columnar formats, whose entries also record the
+# column type so subjects are looked up as that type renders them ('007' is
+# looked up as '7' in an integer column, which erasure matches). Row-group
+# statistics are only kept for numbers and strings, whose order SubjectSet
+# compares correctly; dates, timestamps and decimals are never pruned.
+#
+# A Bloom filter never misses a subject that is present; a false positive only
+# costs reading one extra object. Objects without a current entry are always
+# treated as candidates, so an out-of-date index never causes a missed erasure.
+import base64
+import hashlib
+import io
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+from compression import open_decompressed, split_compression_suffix
+from columnar import COLUMNAR_FORMATS
+from erasure import SubjectSet, column_ids, find_id_field, normalise_id
+from formats import format_for_uri
+from hashing import normalize_etag
+import tuning
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/subject_index.log")
+
+INDEX_DIR = "_subject_index/"
+DEFAULT_ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over normalised ID strings (double hashing)."""
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.size = max(
+            64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    @staticmethod
+    def hash_pair(value: str) -> Tuple[int, int]:
+        """Hash an ID once; the pair can be tested against any filter."""
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        return (
+            int.from_bytes(digest[:8], "little"),
+            int.from_bytes(digest[8:], "little") | 1,
+        )
+
+    def _positions(self, pair: Tuple[int, int]):
+        h1, h2 = pair
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value: str):
+        for position in self._positions(self.hash_pair(value)):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def contains_pair(self, pair: Tuple[int, int]) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(pair)
+        )
+
+    def __contains__(self, value: str) -> bool:
+        return self.contains_pair(self.hash_pair(value))
+
+    def to_dict(self) -> dict:
+        return {
+            "size": self.size,
+            "hashes": self.hashes,
+            "bits": base64.b64encode(bytes(self.bits)).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BloomFilter":
+        bloom = cls.__new__(cls)
+        bloom.size = data["size"]
+        bloom.hashes = data["hashes"]
+        bloom.bits = bytearray(base64.b64decode(data["bits"]))
+        return bloom
+
+
+def _json_value(value):
+    """
+    Statistics as JSON: numbers and strings, which SubjectSet.in_range orders
+    correctly. Others (dates, timestamps, decimals) become None, which rules
+    nothing out: their string forms do not sort like their values.
+    """
+    if isinstance(value, bytes):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def _type_to_json(arrow_type) -> str:
+    import pyarrow as pa
+
+    schema = pa.schema([pa.field("id", arrow_type)])
+    return base64.b64encode(schema.serialize().to_pybytes()).decode("ascii")
+
+
+def _type_from_json(data: str):
+    import pyarrow as pa
+
+    return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(data))).field(0).type
+
+
+def _text_ids(content: str, file_format: str, id_field: str):
+    """(field name, rows, IDs) for CSV, JSON and NDJSON; None without the field."""
+    import csv
+
+    if file_format == "csv":
+        reader = csv.reader(io.StringIO(content))
+        header = next(reader, None) or []
+        field = find_id_field(header, id_field)
+        if field is None:
+            return None
+        index = header.index(field)
+        ids, rows = set(), 0
+        for row in reader:
+            rows += 1
+            if index < len(row):
+                ids.add(normalise_id(row[index]))
+        ids.discard("")
+        return field, rows, ids
+
+    if file_format == "json":
+        data = json.loads(content)
+        records = [data] if isinstance(data, dict) else data
+    else:
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    lowered, field, ids = id_field.lower(), None, set()
+    for record in records:
+        for key, value in record.items():
+            if key.lower() == lowered:
+                field = key
+                normalised = normalise_id(value)
+                if normalised:
+                    ids.add(normalised)
+    if field is None:
+        return None
+    return field, len(records), ids
+
+
+def _parquet_row_groups(parquet, field: str) -> List[dict]:
+    """Rows and ID min/max per row group, from the footer alone."""
+    column_index = parquet.schema_arrow.get_field_index(field)
+    row_groups = []
+    for i in range(parquet.num_row_groups):
+        row_group = parquet.metadata.row_group(i)
+        stats = row_group.column(column_index).statistics
+        has_range = stats is not None and stats.has_min_max
+        row_groups.append(
+            {
+                "rows": row_group.num_rows,
+                "min": _json_value(stats.min) if has_range else None,
+                "max": _json_value(stats.max) if has_range else None,
+            }
+        )
+    return row_groups
+
+
+def _columnar_ids(content: bytes, file_format: str, id_field: str):
+    """
+    (field name, rows, IDs, row-group statistics, ID column type); None
+    without the field.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from columnar import open_batches
+
+    row_groups = None
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(pa.BufferReader(content))
+        field = find_id_field(parquet.schema_arrow.names, id_field)
+        if field is None:
+            return None
+        row_groups = _parquet_row_groups(parquet, field)
+        id_type = parquet.schema_arrow.field(field).type
+        # Only the ID column is decoded
+        batches = (
+            parquet.read_row_group(i, columns=[field])
+            for i in range(parquet.num_row_groups)
+        )
+    else:
+        schema, batches = open_batches(content, file_format)
+        field = find_id_field(schema.names, id_field)
+        if field is None:
+            return None
+        id_type = schema.field(field).type
+
+    ids, rows = set(), 0
+    for batch in batches:
+        column = batch.column(field)
+        rows += len(column)
+        ids.update(pc.unique(column_ids(column)).to_pylist())
+    ids.discard(None)
+    ids.discard("")
+    return field, rows, ids, row_groups, id_type
+
+
+def build_object_index(content, file_format: str, id_field: str) -> dict:
+    """
+    Index the subject IDs in one object's content.
+
+    Args:
+        content: bytes for columnar formats, str otherwise.
+        file_format (str): Registered format name.
+        id_field (str): ID column (case-insensitive).
+
+    Returns:
+        dict: 'id_field', 'rows', 'distinct_ids', 'bloom', for columnar
+        formats 'id_type' and, for Parquet, 'row_groups' with per-row-group
+        'rows', 'min' and 'max'. When the
+        object has no such column, 'bloom' is None: it holds no subjects.
+    """
+    if file_format in COLUMNAR_FORMATS:
+        found = _columnar_ids(content, file_format, id_field)
+    else:
+        found = _text_ids(content, file_format, id_field)
+    if found is None:
+        return {"id_field": None, "rows": None, "distinct_ids": 0, "bloom": None}
+
+    field, rows, ids = found[:3]
+    bloom = BloomFilter(len(ids))
+    for value in ids:
+        bloom.add(value)
+    entry = {
+        "id_field": field,
+        "rows": rows,
+        "distinct_ids": len(ids),
+        "bloom": bloom.to_dict(),
+    }
+    if len(found) > 3:
+        row_groups, id_type = found[3:]
+        entry["id_type"] = _type_to_json(id_type)
+        if row_groups is not None:
+            entry["row_groups"] = row_groups
+    return entry
+
+
+# --- Reading objects ------------------------------------------------------------
+
+
+def read_object(s3, bucket: str, key: str, etag: str = None) -> dict:
+    """
+    Download and decode an object for indexing or erasure.
+
+    Args:
+        etag (str, optional): Expected ETag (If-Match), so a replaced object
+            is never indexed or rewritten under the old version's identity.
+
+    Returns:
+        dict: 'content' (bytes for columnar formats, else str), 'format',
+        'codec', 'encoding' (text formats), 'etag', 'metadata' and
+        'content_type'.
+
+    Raises:
+        ValueError: If the key is not in a supported format.
+    """
+    from s3_utils import detect_encoding
+
+    base, codec = split_compression_suffix(key)
+    file_format = format_for_uri(base)
+    if file_format is None:
+        raise ValueError(f"Unsupported file type: {key}")
+    extra = {"IfMatch": etag} if etag else {}
+    response = s3.get_object(Bucket=bucket, Key=key, **extra)
+    content = open_decompressed(response["Body"], codec).read()
+    encoding = None
+    if not file_format.binary:
+        encoding = detect_encoding(content)
+        content = content.decode(encoding)
+    return {
+        "content": content,
+        "format": file_format.name,
+        "codec": codec,
+        "encoding": encoding,
+        "etag": normalize_etag(response.get("ETag")),
+        "metadata": response.get("Metadata", {}),
+        "content_type": response.get("ContentType"),
+    }
+
+
+# --- Index storage ---------------------------------------------------------------
+
+
+def _prefix(prefix: str) -> str:
+    return prefix.rstrip("/") + "/" if prefix else ""
+
+
+def index_prefix(prefix: str, id_field: str) -> str:
+    """e.g. ('data/', 'student_id') → 'data/_subject_index/student_id/'"""
+    return f"{_prefix(prefix)}{INDEX_DIR}{quote(id_field.lower(), safe='')}/"
+
+
+def index_key(prefix: str, id_field: str, key: str, etag: str) -> str:
+    relative = key[len(_prefix(prefix)) :]
+    return f"{index_prefix(prefix, id_field)}{relative}@{etag}.json"
+
+
+def _list(s3, bucket: str, prefix: str):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        yield from page.get("Contents", [])
+
+
+def list_data_objects(s3, bucket: str, prefix: str) -> Dict[str, str]:
+    """Supported data objects under `prefix`: key → ETag (index excluded)."""
+    objects = {}
+    for obj in _list(s3, bucket, _prefix(prefix)):
+        key = obj["Key"]
+        if f"/{INDEX_DIR}" in f"/{key}" or key.endswith("/"):
+            continue
+        if format_for_uri(split_compression_suffix(key)[0]) is not None:
+            objects[key] = normalize_etag(obj["ETag"])
+    return objects
+
+
+def list_index_entries(
+    s3, bucket: str, prefix: str, id_field: str
+) -> Dict[Tuple[str, str], str]:
+    """Stored entries: (data key, data ETag) → index key."""
+    location = index_prefix(prefix, id_field)
+    entries = {}
+    for obj in _list(s3, bucket, location):
+        relative, _, etag = obj["Key"][len(location) : -len(".json")].rpartition("@")
+        entries[(_prefix(prefix) + relative, etag)] = obj["Key"]
+    return entries
+
+
+def index_object(s3, bucket: str, prefix: str, id_field: str, key: str, etag=None):
+    """Build and store the index entry of one object; returns the entry."""
+    obj = read_object(s3, bucket, key, etag)
+    entry = build_object_index(obj["content"], obj["format"], id_field)
+    entry.update(key=key, etag=obj["etag"], format=obj["format"])
+    s3.put_object(
+        Bucket=bucket,
+        Key=index_key(prefix, id_field, key, obj["etag"]),
+        Body=json.dumps(entry).encode("utf-8"),
+        ContentType="application/json",
+    )
+    return entry
+
+
+def update_index(s3, bucket: str, prefix: str, id_field: str) -> dict:
+    """
+    Bring the index of `prefix` up to date: index new and changed objects and
+    delete the entries of objects that were replaced or deleted.
+
+    Returns:
+        dict: 'indexed' (keys (re)indexed), 'unchanged' and 'removed' counts.
+    """
+    from botocore.exceptions import ClientError
+
+    objects = list_data_objects(s3, bucket, prefix)
+    entries = list_index_entries(s3, bucket, prefix, id_field)
+    stale = [ik for (key, etag), ik in entries.items() if objects.get(key) != etag]
+    todo = [key for key, etag in objects.items() if (key, etag) not in entries]
+
+    def build(key):
+        try:
+            index_object(s3, bucket, prefix, id_field, key, objects[key])
+            return key
+        except ClientError as e:
+            # Replaced since the listing: the next run indexes the new version
+            if e.response["Error"]["Code"] not in ("PreconditionFailed", "412"):
+                raise
+        except ValueError:
+            logger.warning(f"⚠️ Could not index s3://{bucket}/{key}.")
+        return None
+
+    with ThreadPoolExecutor(max_workers=tuning.upload_workers()) as pool:
+        indexed = [key for key in pool.map(build, todo) if key]
+    for stale_key in stale:
+        s3.delete_object(Bucket=bucket, Key=stale_key)
+
+    logger.info(
+        f"Subject index for s3://{bucket}/{_prefix(prefix)}: {len(indexed)} indexed, "
+        f"{len(objects) - len(todo)} unchanged, {len(stale)} removed."
+    )
+    return {
+        "indexed": indexed,
+        "unchanged": len(objects) - len(todo),
+        "removed": len(stale),
+    }
+
+
+# --- Lookups -----------------------------------------------------------------------
+
+
+def entry_may_contain(entry: dict, subjects: SubjectSet, pairs=None) -> bool:
+    """
+    Whether an object may hold any of `subjects` (False means it cannot).
+
+    Args:
+        pairs (dict, optional): Cache of BloomFilter.hash_pair() of every
+            subject ID per entry 'id_type', filled here and reused across
+            entries.
+    """
+    if entry.get("bloom") is None:
+        return False
+    id_type = entry.get("id_type")
+    candidates = subjects.ids
+    if entry.get("row_groups"):
+        candidates = set()
+        for group in entry["row_groups"]:
+            candidates.update(subjects.in_range(group["min"], group["max"]))
+        if not candidates:
+            return False
+    if id_type:
+        # Look the IDs up as the column's type renders them
+        forms = subjects.column_forms(_type_from_json(id_type))
+        candidates = {forms[value] for value in candidates}
+    bloom = BloomFilter.from_dict(entry["bloom"])
+    if entry.get("row_groups") or pairs is None:
+        group_pairs = [BloomFilter.hash_pair(value) for value in candidates]
+    else:
+        if id_type not in pairs:
+            pairs[id_type] = [BloomFilter.hash_pair(value) for value in candidates]
+        group_pairs = pairs[id_type]
+    return any(bloom.contains_pair(pair) for pair in group_pairs)
+
+
+def objects_for_subjects(
+    s3, bucket: str, prefix: str, id_field: str, subjects: SubjectSet
+) -> Dict[str, str]:
+    """
+    The objects under `prefix` that may contain any of `subjects`: those whose
+    index entry matches, plus every object without a current entry.
+
+    Returns:
+        dict: key → ETag of the objects to process.
+    """
+    objects = list_data_objects(s3, bucket, prefix)
+    entries = list_index_entries(s3, bucket, prefix, id_field)
+    pairs = {}
+
+    def check(item):
+        key, etag = item
+        index = entries.get((key, etag))
+        if index is None:
+            return True
+        body = s3.get_object(Bucket=bucket, Key=index)["Body"].read()
+        return entry_may_contain(json.loads(body), subjects, pairs)
+
+    with ThreadPoolExecutor(max_workers=tuning.upload_workers()) as pool:
+        keep = list(pool.map(check, objects.items()))
+    candidates = {key: etag for (key, etag), hit in zip(objects.items(), keep) if hit}
+    logger.info(
+        f"Subject index: {len(candidates)} of {len(objects)} objects under "
+        f"s3://{bucket}/{_prefix(prefix)} may contain the subjects."
+    )
+    return candidates
@@ -0,0 +1,283 @@
+# Client-side rate limiting and retries for S3.
+#
+# Many concurrent GETs and PUTs against one prefix make S3 answer 503 SlowDown.
+# Clients from get_s3_client() therefore use botocore's "adaptive" retry mode
+# (exponential backoff with full jitter, plus a client-wide send-rate limiter
+# that backs off when throttled), and on top of that a token bucket per
+# (bucket, prefix) shared by every client in the process:
+#
+# - every attempt, retries included, takes a token from its prefix's bucket
+#   first, sleeping (with a little jitter) when the bucket is empty;
+# - a throttling response halves that prefix's rate, at most once per
+#   THROTTLE_COOLDOWN seconds (a burst of concurrent SlowDowns is one signal,
+#   not many), and every successful call adds about one request per second
+#   back per second (AIMD), so a hot prefix slows down on its own while other
+#   prefixes keep their full rate.
+#
+# Buckets are kept for at most THROTTLE_MAX_BUCKETS prefixes. When a new
+# prefix would go over, buckets back at their full rate are dropped (a new
+# bucket behaves the same), then the least recently used ones.
+#
+# Requests, retries, throttles and time spent waiting for tokens are counted
+# per process; emit_s3_metrics() publishes and resets them.
+#
+# botocore is only imported by client_config, when a client is built.
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from metrics import emit
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/throttling.log")
+
+RETRY_MODE_ENV = "S3_RETRY_MODE"
+MAX_ATTEMPTS_ENV = "S3_MAX_ATTEMPTS"
+PREFIX_RATE_ENV = "S3_PREFIX_RATE"
+
+DEFAULT_RETRY_MODE = "adaptive"
+DEFAULT_MAX_ATTEMPTS = 10
+# S3 sustains at least 3,500 writes and 5,500 reads per second per prefix
+DEFAULT_PREFIX_RATE = 3500.0
+# A throttled prefix never drops below this many requests per second
+MIN_PREFIX_RATE = 1.0
+# Throttling responses within this many seconds of a decrease are ignored
+THROTTLE_COOLDOWN = 1.0
+# Prefixes whose token buckets are kept at once
+THROTTLE_MAX_BUCKETS = 1024
+
+THROTTLE_CODES = frozenset(
+    {"SlowDown", "Throttling", "ThrottlingException", "TooManyRequests", "503"}
+)
+
+
+class TokenBucket:
+    """
+    A token bucket whose rate adapts to throttling (AIMD).
+
+    Args:
+        rate (float): Tokens added per second, also the upper bound the rate
+            recovers to after throttling.
+        burst (float, optional): Bucket capacity (defaults to one second of
+            tokens).
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.max_rate = self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._decreased = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until it is available. Returns the wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Reserve the token now; waiters queue up behind each other
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            # Jitter keeps threads that queued together from waking together
+            wait *= 1 + random.random() * 0.1
+            time.sleep(wait)
+        return wait
+
+    def throttled(self) -> bool:
+        """
+        Halve the rate after a throttling response, unless it was already
+        halved in the last THROTTLE_COOLDOWN seconds.
+
+        Returns:
+            bool: Whether the rate was decreased.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self._decreased is not None
+                and now - self._decreased < THROTTLE_COOLDOWN
+            ):
+                return False
+            self._decreased = now
+            self.rate = max(MIN_PREFIX_RATE, self.rate / 2)
+            self._tokens = min(self._tokens, self.rate)
+            return True
+
+    def succeeded(self):
+        """Recover the rate by about one request per second, per second."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+
+class S3Throttle:
+    """Token buckets per (bucket, prefix) and the counters behind the metrics."""
+
+    def __init__(self, rate: float = None, max_buckets: int = THROTTLE_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self.reset(rate)
+
+    def reset(self, rate: float = None):
+        """Forget every bucket and counter, and re-read S3_PREFIX_RATE."""
+        if rate is None:
+            rate = float(os.getenv(PREFIX_RATE_ENV, DEFAULT_PREFIX_RATE))
+        with self._lock:
+            self.rate = rate
+            self._buckets = OrderedDict()
+            self._counts = dict.fromkeys(("requests", "retries", "throttles"), 0)
+            self._waited = 0.0
+
+    def bucket(self, prefix: tuple) -> Optional[TokenBucket]:
+        if self.rate <= 0:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(prefix)
+            if bucket is not None:
+                self._buckets.move_to_end(prefix)
+                return bucket
+            if len(self._buckets) >= self.max_buckets:
+                self._prune()
+            bucket = self._buckets[prefix] = TokenBucket(self.rate)
+            return bucket
+
+    def _prune(self):
+        """Drop recovered buckets, then the least recently used, to max / 2."""
+        for prefix, bucket in list(self._buckets.items()):
+            if bucket.rate >= bucket.max_rate:
+                del self._buckets[prefix]
+        # Halving leaves room, so pruning is not repeated for every new prefix
+        while len(self._buckets) > self.max_buckets // 2:
+            self._buckets.popitem(last=False)
+
+    def count(self, name: str, waited: float = 0.0):
+        with self._lock:
+            self._counts[name] += 1
+            self._waited += waited
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Counts since the last reset, and the rate of each throttled prefix."""
+        with self._lock:
+            counts = dict(self._counts, wait_seconds=round(self._waited, 3))
+            counts["throttled_prefixes"] = {
+                f"{bucket}/{prefix}": round(tokens.rate, 1)
+                for (bucket, prefix), tokens in self._buckets.items()
+                if tokens.rate < tokens.max_rate
+            }
+            if reset:
+                self._counts = dict.fromkeys(self._counts, 0)
+                self._waited = 0.0
+        return counts
+
+    # --- botocore event handlers ------------------------------------------------
+
+    def on_parameters(self, params, context, **kwargs):
+        """before-parameter-build: note which prefix the call is for."""
+        key = params.get("Key") or params.get("Prefix") or ""
+        context["s3_prefix"] = (params.get("Bucket"), key.rpartition("/")[0])
+
+    def on_send(self, request, **kwargs):
+        """before-send: take a token for every attempt, retries included."""
+        context = request.context
+        attempt = context["s3_attempt"] = context.get("s3_attempt", 0) + 1
+        bucket = self.bucket(context.get("s3_prefix", (None, "")))
+        waited = bucket.acquire() if bucket else 0.0
+        self.count("retries" if attempt > 1 else "requests", waited)
+
+    def on_needs_retry(self, response, request_dict, **kwargs):
+        """needs-retry: slow the prefix down when S3 answers SlowDown."""
+        if response is None:
+            return None
+        http_response, parsed = response
+        code = parsed.get("Error", {}).get("Code")
+        if code in THROTTLE_CODES or http_response.status_code == 503:
+            prefix = request_dict["context"].get("s3_prefix", (None, ""))
+            bucket = self.bucket(prefix)
+            if bucket:
+                bucket.throttled()
+            self.count("throttles")
+            logger.warning(f"S3 throttled s3://{prefix[0]}/{prefix[1]} ({code}).")
+        # Whether and when to retry is left to botocore's retry handler
+        return None
+
+    def on_success(self, context, http_response=None, **kwargs):
+        """after-call: let the prefix's rate recover after a successful call."""
+        # after-call is also emitted for error responses, before they raise
+        if http_response is None or http_response.status_code >= 300:
+            return
+        bucket = self.bucket(context.get("s3_prefix", (None, "")))
+        if bucket:
+            bucket.succeeded()
+
+
+# Shared by every client in the process
+throttle = S3Throttle()
+
+
+def client_config():
+    """
+    botocore Config with the retry policy (S3_RETRY_MODE, default 'adaptive';
+    S3_MAX_ATTEMPTS, default 10).
+    """
+    from botocore.config import Config
+
+    return Config(
+        retries={
+            "mode": os.getenv(RETRY_MODE_ENV, DEFAULT_RETRY_MODE),
+            "max_attempts": int(os.getenv(MAX_ATTEMPTS_ENV, DEFAULT_MAX_ATTEMPTS)),
+        }
+    )
+
+
+def install_throttling(client):
+    """
+    Route every S3 call made by `client` through the shared prefix buckets.
+
+    Returns:
+        The same client.
+    """
+    events = client.meta.events
+    events.register(
+        "before-parameter-build.s3",
+        throttle.on_parameters,
+        unique_id="s3-throttle-parameters",
+    )
+    # First, so the token is taken before anything else handles the send
+    events.register_first(
+        "before-send.s3", throttle.on_send, unique_id="s3-throttle-send"
+    )
+    events.register(
+        "needs-retry.s3", throttle.on_needs_retry, unique_id="s3-throttle-retry"
+    )
+    events.register("after-call.s3", throttle.on_success, unique_id="s3-throttle-ok")
+    return client
+
+
+def emit_s3_metrics(dimensions: Optional[Dict[str, str]] = None) -> dict:
+    """
+    Publish S3Requests, S3Retries, S3Throttles and S3ThrottleWait since the
+    last call, then reset the counters.
+
+    Returns:
+        dict: The counts that were published.
+    """
+    counts = throttle.snapshot(reset=True)
+    if counts["requests"]:
+        emit(
+            {
+                "S3Requests": counts["requests"],
+                "S3Retries": counts["retries"],
+                "S3Throttles": counts["throttles"],
+                "S3ThrottleWait": counts["wait_seconds"],
+            },
+            dimensions,
+            properties={"throttled_prefixes": counts["throttled_prefixes"]},
+            units={"S3ThrottleWait": "Seconds"},
+        )
+    return counts
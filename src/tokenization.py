@@ -0,0 +1,276 @@
+# Reversible tokenisation ("strategy": "tokenize").
+#
+# Every PII value is replaced by a random token, and the value ↔ token pair is
+# kept in a vault so that consumers with access to it can re-identify the data
+# (detokenize). A value always maps to the same token, so joins and group-bys
+# on tokenised fields keep working.
+#
+# Lookups are batched: engines hand over the values of a whole chunk (a block
+# of CSV rows or NDJSON lines, a JSON document, a record batch) and the vault
+# resolves them with one IN query per BATCH_SIZE values plus one executemany
+# for the new ones, behind an in-process LRU cache. New pairs are written with
+# INSERT OR IGNORE and read back, so concurrent writers (threads, worker
+# processes, containers sharing the file) always agree on one token per value.
+#
+# TOKEN_VAULT selects the vault: a SQLite file path (or sqlite:///path). Other
+# schemes are served by backends added with register_vault_backend.
+#
+# The vault holds the original values: keep it away from the tokenised
+# outputs and restrict who can read it.
+import abc
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from utils.logging_utils import setup_file_logger
+
+logger = setup_file_logger(__name__, "logs/tokenization.log")
+
+VAULT_ENV = "TOKEN_VAULT"
+CACHE_SIZE_ENV = "TOKEN_CACHE_SIZE"
+
+DEFAULT_CACHE_SIZE = 100_000
+TOKEN_PREFIX = "tok_"
+# Values bound per IN query (older SQLite builds allow 999 parameters)
+BATCH_SIZE = 500
+
+
+def _new_tokens(count: int) -> List[str]:
+    # One urandom call for the whole batch rather than one per token
+    random = secrets.token_hex(16 * count)
+    return [TOKEN_PREFIX + random[i : i + 32] for i in range(0, 32 * count, 32)]
+
+
+def _batches(items: Sequence, size: int = BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class TokenVault(abc.ABC):
+    """
+    A value ↔ token store with batched lookups and an in-process LRU cache.
+
+    Backends implement _find_tokens, _find_values and _insert; all three work
+    on whole batches.
+    """
+
+    def __init__(self, cache_size: int = None):
+        if cache_size is None:
+            cache_size = int(os.getenv(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE))
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def tokenize(self, values: Sequence[str]) -> List[str]:
+        """
+        The tokens of `values`, in order, creating tokens for unseen values.
+
+        Args:
+            values (Sequence[str]): Values to tokenise (duplicates allowed).
+
+        Returns:
+            List[str]: One token per value.
+        """
+        distinct = dict.fromkeys(values)
+        tokens = self._cached(distinct)
+        pending = [value for value in distinct if value not in tokens]
+        if pending:
+            found = self._find_tokens(pending)
+            pending = [value for value in pending if value not in found]
+            while pending:
+                self._insert(dict(zip(pending, _new_tokens(len(pending)))))
+                # Read back: a concurrent writer may have stored the value first
+                found.update(self._find_tokens(pending))
+                pending = [value for value in pending if value not in found]
+            self._remember(found)
+            tokens.update(found)
+        return [tokens[value] for value in values]
+
+    def detokenize(self, tokens: Sequence[str]) -> List[Optional[str]]:
+        """
+        The original values of `tokens`, in order.
+
+        Returns:
+            List[str | None]: One value per token, None for unknown tokens.
+        """
+        found = self._find_values(list(dict.fromkeys(tokens)))
+        return [found.get(token) for token in tokens]
+
+    def _cached(self, values: Iterable[str]) -> Dict[str, str]:
+        hits = {}
+        cache, touch = self._cache, self._cache.move_to_end
+        with self._cache_lock:
+            for value in values:
+                token = cache.get(value)
+                if token is not None:
+                    touch(value)
+                    hits[value] = token
+        return hits
+
+    def _remember(self, pairs: Dict[str, str]):
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._cache.update(pairs)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @abc.abstractmethod
+    def _find_tokens(self, values: List[str]) -> Dict[str, str]:
+        """The stored token of each of `values` that has one."""
+
+    @abc.abstractmethod
+    def _find_values(self, tokens: List[str]) -> Dict[str, str]:
+        """The stored value of each of `tokens` that is known."""
+
+    @abc.abstractmethod
+    def _insert(self, pairs: Dict[str, str]):
+        """Store value → token pairs, keeping existing pairs for a value."""
+
+
+class SQLiteVault(TokenVault):
+    """
+    Token vault in a SQLite file.
+
+    Each thread (and each forked worker process) gets its own connection.
+    The database runs in WAL mode so readers never block the writer, and
+    inserts take the write lock up front (BEGIN IMMEDIATE), waiting up to
+    `timeout` seconds for other writers.
+    """
+
+    def __init__(self, path: str, cache_size: int = None, timeout: float = 30.0):
+        super().__init__(cache_size)
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "value TEXT PRIMARY KEY, token TEXT NOT NULL UNIQUE) WITHOUT ROWID"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _select(self, query: str, keys: List[str]) -> Dict[str, str]:
+        connection = self._connection()
+        found = {}
+        for batch in _batches(keys):
+            placeholders = ",".join("?" * len(batch))
+            found.update(connection.execute(query.format(placeholders), batch))
+        return found
+
+    def _find_tokens(self, values: List[str]) -> Dict[str, str]:
+        return self._select(
+            "SELECT value, token FROM tokens WHERE value IN ({})", values
+        )
+
+    def _find_values(self, tokens: List[str]) -> Dict[str, str]:
+        return self._select(
+            "SELECT token, value FROM tokens WHERE token IN ({})", tokens
+        )
+
+    def _insert(self, pairs: Dict[str, str]):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO tokens (value, token) VALUES (?, ?)",
+                pairs.items(),
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+# Vault backends by TOKEN_VAULT scheme: factory(location) -> TokenVault
+VAULT_BACKENDS: Dict[str, Callable[[str], TokenVault]] = {"sqlite": SQLiteVault}
+
+_vaults = {}
+_vaults_lock = threading.Lock()
+
+
+def register_vault_backend(scheme: str, factory: Callable[[str], TokenVault]):
+    """
+    Serve TOKEN_VAULT locations of the form '<scheme>://...' with `factory`.
+
+    Args:
+        scheme (str): URI scheme, e.g. 'dynamodb'.
+        factory (Callable): factory(location) -> TokenVault, called with the
+            part after '://'.
+    """
+    VAULT_BACKENDS[scheme] = factory
+
+
+def get_token_vault() -> TokenVault:
+    """
+    The vault configured by TOKEN_VAULT, opened once per process.
+
+    Raises:
+        ValueError: If TOKEN_VAULT is unset or names an unknown backend.
+    """
+    location = os.getenv(VAULT_ENV)
+    if not location:
+        raise ValueError(f"The 'tokenize' strategy needs a vault: set {VAULT_ENV}.")
+    scheme, separator, target = location.partition("://")
+    if not separator:
+        scheme, target = "sqlite", location
+    if scheme not in VAULT_BACKENDS:
+        raise ValueError(
+            f"Unsupported token vault '{scheme}'. "
+            f"Supported: {', '.join(VAULT_BACKENDS)}."
+        )
+    with _vaults_lock:
+        vault = _vaults.get(location)
+        if vault is None:
+            vault = _vaults[location] = VAULT_BACKENDS[scheme](target)
+            logger.info(f"🔑 Token vault opened ({scheme}).")
+        return vault
+
+
+def tokenize_values(values: Sequence, vault: TokenVault = None) -> list:
+    """
+    Replace each value with its token; None and '' are kept as they are.
+
+    Non-string values (e.g. JSON numbers) are tokenised as their JSON text.
+    """
+    vault = vault or get_token_vault()
+    present = [value for value in values if value is not None and value != ""]
+    tokens = vault.tokenize(
+        [
+            value if type(value) is str else json.dumps(value, ensure_ascii=False)
+            for value in present
+        ]
+    )
+    if len(present) == len(values):
+        return tokens
+    tokens = iter(tokens)
+    return [value if value is None or value == "" else next(tokens) for value in values]
+
+
+def tokenize_fields(slots: List[Tuple[dict, str]], vault: TokenVault = None):
+    """
+    Tokenise record fields in place with one batched vault lookup.
+
+    Args:
+        slots (list): (record, key) pairs; record[key] is replaced by its token.
+    """
+    if not slots:
+        return
+    tokens = tokenize_values([record[key] for record, key in slots], vault)
+    for (record, key), token in zip(slots, tokens):
+        record[key] = token
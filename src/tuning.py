@@ -0,0 +1,239 @@
+# Adaptive sizing of chunks, segments, row groups and worker counts.
+#
+# The right sizes differ between a 128 MB Lambda and a 64-core batch host, so
+# they are derived from the resources actually available to this process:
+#
+# - memory: AWS_LAMBDA_FUNCTION_MEMORY_SIZE, else the cgroup limit (v2 or v1),
+#   else physical memory;
+# - CPUs: the cgroup CPU quota, else the CPUs this process may run on;
+# - throughput: bytes/second observed by earlier runs in this process, so a
+#   warm container or service sizes chunks to take about TARGET_CHUNK_SECONDS.
+#
+# Explicit settings always win (e.g. CSV_CHUNK_SIZE, CSV_PARALLEL_WORKERS,
+# CHECKPOINT_SEGMENT_SIZE, SHARD_UPLOAD_WORKERS), and AUTO_TUNE=false restores
+# the static defaults. Every decision, and what it was based on, is emitted
+# as a metric whenever it changes.
+import math
+import os
+import threading
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from metrics import emit
+
+AUTO_TUNE_ENV = "AUTO_TUNE"
+
+MB = 1024 * 1024
+# Aim for chunks that take this long to obfuscate: long enough to amortise
+# per-chunk overhead, short enough to balance work across workers
+TARGET_CHUNK_SECONDS = 2.0
+# Rough in-memory cost of one row, used to turn a memory budget into rows
+ESTIMATED_ROW_BYTES = 1024
+
+
+class Resources(NamedTuple):
+    memory_bytes: int
+    cpus: int
+    source: str
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_memory_limit() -> Optional[int]:
+    v2 = _read("/sys/fs/cgroup/memory.max")
+    if v2 and v2 != "max":
+        return int(v2)
+    v1 = _read("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    # cgroup v1 reports "no limit" as a huge page-aligned number
+    if v1 and int(v1) < 1 << 60:
+        return int(v1)
+    return None
+
+
+def _cgroup_cpu_limit() -> Optional[int]:
+    v2 = _read("/sys/fs/cgroup/cpu.max")
+    if v2:
+        quota, _, period = v2.partition(" ")
+        if quota != "max" and period:
+            return max(1, math.ceil(int(quota) / int(period)))
+    quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return max(1, math.ceil(int(quota) / int(period)))
+    return None
+
+
+@lru_cache(maxsize=1)
+def detect_resources() -> Resources:
+    """Memory and CPUs available to this process (cached)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    cpus = min(cpus, _cgroup_cpu_limit() or cpus)
+
+    lambda_memory = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if lambda_memory:
+        return Resources(int(lambda_memory) * MB, cpus, "lambda")
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    limit = _cgroup_memory_limit()
+    if limit and limit < physical:
+        return Resources(limit, cpus, "cgroup")
+    return Resources(physical, cpus, "host")
+
+
+class ThroughputTracker:
+    """Exponential moving average of bytes/second per processing stage."""
+
+    def __init__(self, smoothing: float = 0.3):
+        self.smoothing = smoothing
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, nbytes: int, seconds: float):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        with self._lock:
+            previous = self._rates.get(stage)
+            self._rates[stage] = (
+                rate
+                if previous is None
+                else previous + self.smoothing * (rate - previous)
+            )
+        emit(
+            {"Throughput": rate},
+            {"Stage": stage},
+            units={"Throughput": "Bytes/Second"},
+        )
+
+    def rate(self, stage: str) -> Optional[float]:
+        with self._lock:
+            return self._rates.get(stage)
+
+    def reset(self):
+        with self._lock:
+            self._rates.clear()
+
+
+throughput = ThroughputTracker()
+
+_decisions = {}
+_decisions_lock = threading.Lock()
+
+
+def _auto_tune() -> bool:
+    return os.getenv(AUTO_TUNE_ENV, "true").lower() != "false"
+
+
+def _clamp(value: float, low: int, high: int) -> int:
+    return int(max(low, min(high, value)))
+
+
+def _decide(name: str, override_env: str, auto, static: int, basis: dict) -> int:
+    """Apply override > auto-tuned > static default, and record the decision."""
+    override = os.getenv(override_env) if override_env else None
+    if override:
+        value, source = int(override), "override"
+    elif _auto_tune():
+        value, source = int(auto()), "auto"
+    else:
+        value, source = static, "static"
+
+    with _decisions_lock:
+        changed = _decisions.get(name) != (value, source)
+        _decisions[name] = (value, source)
+    if changed:
+        resources = detect_resources()
+        emit(
+            {name: value},
+            {"Decision": name},
+            properties={
+                "source": source,
+                "memory_bytes": resources.memory_bytes,
+                "cpus": resources.cpus,
+                "resources_from": resources.source,
+                **basis,
+            },
+        )
+    return value
+
+
+def csv_chunk_size() -> int:
+    """Bytes per parallel CSV chunk."""
+    resources = detect_resources()
+    rate = throughput.rate("csv")
+
+    def auto():
+        # At most 1/8 of memory per worker: input, text, output and parser
+        cap = max(4 * MB, resources.memory_bytes // (8 * resources.cpus))
+        if rate:
+            return _clamp(rate * TARGET_CHUNK_SECONDS, 4 * MB, min(cap, 256 * MB))
+        return _clamp(16 * MB, 4 * MB, cap)
+
+    return _decide(
+        "CsvChunkSize", "CSV_CHUNK_SIZE", auto, 16 * MB, {"observed_rate": rate}
+    )
+
+
+def csv_workers(chunk_size: int) -> int:
+    """Worker processes for parallel CSV obfuscation."""
+    resources = detect_resources()
+
+    def auto():
+        # Each worker holds roughly 6x its chunk at peak
+        return _clamp(resources.memory_bytes // (6 * chunk_size), 1, resources.cpus)
+
+    return _decide(
+        "CsvWorkers",
+        "CSV_PARALLEL_WORKERS",
+        auto,
+        os.cpu_count() or 1,
+        {"chunk_size": chunk_size},
+    )
+
+
+def checkpoint_segment_size() -> int:
+    """Bytes read per checkpointed segment."""
+    resources = detect_resources()
+
+    def auto():
+        return _clamp(resources.memory_bytes // 8, 8 * MB, 128 * MB)
+
+    return _decide(
+        "CheckpointSegmentSize", "CHECKPOINT_SEGMENT_SIZE", auto, 64 * MB, {}
+    )
+
+
+def upload_workers() -> int:
+    """Concurrent part uploads (I/O bound, so more than the CPU count)."""
+    resources = detect_resources()
+
+    def auto():
+        return _clamp(2 * resources.cpus, 4, 16)
+
+    return _decide("UploadWorkers", "SHARD_UPLOAD_WORKERS", auto, 4, {})
+
+
+def parquet_row_group_size() -> int:
+    """Default rows per Parquet row group when the payload does not set one."""
+    resources = detect_resources()
+
+    def auto():
+        budget = min(128 * MB, resources.memory_bytes // 8)
+        return _clamp(budget // ESTIMATED_ROW_BYTES, 8 * 1024, 1024 * 1024)
+
+    return _decide("ParquetRowGroupSize", None, auto, 128 * 1024, {})
+
+
+def reset():
+    """Forget observed throughput and recorded decisions (e.g. in tests)."""
+    throughput.reset()
+    detect_resources.cache_clear()
+    with _decisions_lock:
+        _decisions.clear()
@@ -1,34 +1,267 @@
+import atexit
+import json
 import logging
 import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Module loggers only enqueue records; one background listener thread formats
+# them and does the file and console I/O, so concurrent batch processing
+# never waits on handler locks or disk writes.
+#
+# LOG_FORMAT=json writes one JSON object per line instead of plain text.
+# LOG_RATE_LIMIT (default 10) identical warnings per LOG_RATE_WINDOW seconds
+# (default 60) are written per logger; the rest are counted and the count is
+# reported with the next one let through. 0 disables the limit. At most
+# RATE_LIMIT_MAX_KEYS distinct messages are tracked (expired windows are
+# dropped first), so messages embedding keys or URIs cannot grow it unbounded.
+#
+# In Lambda, console output is written synchronously: it is what reaches
+# CloudWatch, and the background thread may be frozen between invocations.
+#
+# No PII in logs: callers never log row data or field values, and the JSON
+# output only contains the fixed fields below, never `extra` attributes.
+
+LOG_FORMAT_ENV = "LOG_FORMAT"
+RATE_LIMIT_ENV = "LOG_RATE_LIMIT"
+RATE_WINDOW_ENV = "LOG_RATE_WINDOW"
+
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_RATE_WINDOW = 60.0
+RATE_LIMIT_MAX_KEYS = 1024
+
+_TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_queue = queue.SimpleQueue()
+_queue_handlers = []
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class _LazyFileHandler(logging.FileHandler):
+    """
+    FileHandler that defers the writable-directory check and file creation
+    until the first record is emitted, so importing a module does no disk I/O.
+    """
+
+    def __init__(self, log_file: str):
+        self._requested_file = log_file
+        super().__init__(log_file, delay=True)
+
+    def _open(self):
+        log_file = self._requested_file
+        # If logs/ is not writable (like in Lambda), redirect to /tmp/
+        if not os.access(os.path.dirname(log_file), os.W_OK):
+            log_file = f"/tmp/{os.path.basename(log_file)}"
+
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        self.baseFilename = os.path.abspath(log_file)
+        return super()._open()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger and message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(
+            {
+                "timestamp": self.formatTime(record, _DATE_FORMAT),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+            },
+            ensure_ascii=False,
+        )
+
+
+class _FileRouter(logging.Handler):
+    """Writes each record to the log file of the logger that produced it."""
+
+    def __init__(self, formatter: logging.Formatter):
+        super().__init__()
+        self.formatter = formatter
+        self._handlers = {}
+
+    def emit(self, record: logging.LogRecord):
+        log_file = getattr(record, "log_file", None)
+        if log_file is None:
+            return
+        handler = self._handlers.get(log_file)
+        if handler is None:
+            handler = self._handlers[log_file] = _LazyFileHandler(log_file)
+            handler.setFormatter(self.formatter)
+        handler.handle(record)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        super().close()
+
+
+class RateLimiter:
+    """
+    Lets through at most `limit` identical records at WARNING or above per
+    logger and `window` seconds.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        """Drop expired windows, then the oldest entries, down to max_keys / 2."""
+        for key, (started, _, _) in list(self._seen.items()):
+            if now - started >= self.window:
+                del self._seen[key]
+        # Halving leaves room, so pruning is not repeated on every new message
+        while len(self._seen) > self.max_keys // 2:
+            del self._seen[next(iter(self._seen))]
+
+    def check(self, record: logging.LogRecord):
+        """
+        Returns:
+            None if the record should be dropped, else the number of identical
+            records dropped since the last one let through.
+        """
+        if not self.limit or record.levelno < logging.WARNING:
+            return 0
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._seen and len(self._seen) >= self.max_keys:
+                self._prune(now)
+            started, count, dropped = self._seen.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.limit:
+                self._seen[key] = (started, count, dropped + 1)
+                return None
+            self._seen[key] = (started, count + 1, 0)
+            return dropped
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Usable as a logging filter on handlers outside the queue
+        return self.check(record) is not None
+
+
+class _LoggerQueueHandler(QueueHandler):
+    """Enqueues records tagged with their log file, starting the listener."""
+
+    def __init__(self, log_file: str, limiter: RateLimiter):
+        super().__init__(_queue)
+        self.log_file = log_file
+        self.limiter = limiter
+
+    def emit(self, record: logging.LogRecord):
+        dropped = self.limiter.check(record)
+        if dropped is None:
+            return
+        _ensure_listener()
+        try:
+            record = self.prepare(record)
+            record.log_file = self.log_file
+            if dropped:
+                record.msg += f" ({dropped} similar messages suppressed)"
+            self.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+
+def _formatter() -> logging.Formatter:
+    if os.getenv(LOG_FORMAT_ENV, "text").lower() == "json":
+        return JsonFormatter()
+    return logging.Formatter(_TEXT_FORMAT, datefmt=_DATE_FORMAT)
+
+
+def _rate_limiter() -> RateLimiter:
+    return RateLimiter(
+        int(os.getenv(RATE_LIMIT_ENV, DEFAULT_RATE_LIMIT)),
+        float(os.getenv(RATE_WINDOW_ENV, DEFAULT_RATE_WINDOW)),
+    )
+
+
+def _in_lambda() -> bool:
+    return bool(os.getenv("AWS_LAMBDA_FUNCTION_NAME"))
+
+
+def _console_handler(formatter: logging.Formatter) -> logging.Handler:
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    handler.setLevel(logging.WARNING)
+    return handler
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is not None:
+            return
+        formatter = _formatter()
+        handlers = [_FileRouter(formatter)]
+        if not _in_lambda():
+            handlers.append(_console_handler(formatter))
+        _listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def flush_logs():
+    """
+    Write out every queued record and stop the background writer; it starts
+    again with the next record.
+    """
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def _reset_after_fork():
+    # The listener thread does not survive fork(); the child starts its own
+    global _queue, _listener, _listener_lock
+    _queue = queue.SimpleQueue()
+    _listener = None
+    _listener_lock = threading.Lock()
+    for handler in _queue_handlers:
+        handler.queue = _queue
+
+
+atexit.register(flush_logs)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 def setup_file_logger(name: str, log_file: str, level=logging.INFO) -> logging.Logger:
     """
     Creates a logger that logs to a file. If the default path is not writable
     (like in Lambda), it falls back to /tmp/log_name.log
-    """
-    # If logs/ is not writable (like in Lambda), redirect to /tmp/
-    if not os.access(os.path.dirname(log_file), os.W_OK):
-        log_file = f"/tmp/{os.path.basename(log_file)}"
-
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
+    Records are handed to a queue and written by one shared background thread,
+    which only resolves and opens the log file when the first record arrives,
+    keeping module imports (and Lambda cold starts) free of filesystem checks.
+    Warnings and errors are also written to the console.
+    """
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
     if not logger.handlers:
-        file_handler = logging.FileHandler(log_file)
-        formatter = logging.Formatter(
-            "%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-
-        stream_handler = logging.StreamHandler()
-        stream_handler.setFormatter(formatter)
-        stream_handler.setLevel(logging.WARNING)  # 🔥 Change this from INFO to WARNING
-        logger.addHandler(stream_handler)
+        handler = _LoggerQueueHandler(log_file, _rate_limiter())
+        _queue_handlers.append(handler)
+        logger.addHandler(handler)
+        if _in_lambda():
+            console = _console_handler(_formatter())
+            console.addFilter(_rate_limiter())
+            logger.addHandler(console)
 
     logger.propagate = True
     return logger
@@ -41,6 +41,28 @@ def set_default_env(monkeypatch):
     monkeypatch.setenv("ENV", "dev")
 
 
+# moto 4.1 ignores If-None-Match on PutObject, so exercise the HEAD fallback
+# here; the conditional path itself is covered with a mocked client.
+
+
+@pytest.fixture(autouse=True)
+def disable_conditional_writes(monkeypatch):
+    monkeypatch.setenv("S3_CONDITIONAL_WRITES", "false")
+
+
+# Rules tables are cached per container; start every test from a clean slate.
+
+
+@pytest.fixture(autouse=True)
+def reset_rule_cache(monkeypatch):
+    from rules import clear_rule_cache
+
+    monkeypatch.delenv("OBFUSCATION_RULES", raising=False)
+    clear_rule_cache()
+    yield
+    clear_rule_cache()
+
+
 # Add src/ to sys.path at runtime
 sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,141 @@
+import csv
+import io
+from itertools import count
+
+import boto3
+import moto.s3.models
+import pytest
+
+import checkpoint
+from checkpoint import LocalCheckpointStore, S3CheckpointStore
+from main import _process_s3_object
+from obfuscator import obfuscate_csv
+from parallel_csv import last_record_boundary
+
+
+def _large_csv(rows=120):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["id", "name", "email", "notes"])
+    for i in range(rows):
+        writer.writerow([i, f"User {i}", f"u{i}@x.com", f"multi\nline, {i}"])
+    return buffer.getvalue().encode("utf-8")
+
+
+def _stray_quote_csv(rows=120):
+    # A stray quote in an unquoted value does not open a quoted field; the
+    # quoted notes span several lines
+    lines = ["id,height,name,notes,email"]
+    for i in range(rows):
+        lines.append(f'{i},5\'{i}",User {i},"multi\n""{i}""\nline",u{i}@x.com')
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+@pytest.fixture
+def checkpointing(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_LOCATION", str(tmp_path / "checkpoints"))
+    monkeypatch.setenv("CHECKPOINT_MIN_SIZE", "1")
+    monkeypatch.setenv("CHECKPOINT_SEGMENT_SIZE", "300")
+    # Tiny multipart parts so a small file spans several of them
+    monkeypatch.setattr(checkpoint, "MIN_PART_SIZE", 500)
+    monkeypatch.setattr(moto.s3.models, "S3_UPLOAD_PART_MIN_SIZE", 500)
+    return tmp_path / "checkpoints"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    # moto 4.1 cannot decode the aws-chunked bodies boto3 sends for upload_part
+    # when it adds checksums by default
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    return boto3.client("s3", region_name="eu-west-2")
+
+
+def _stop_after_first_part(monkeypatch):
+    # The deadline is checked before each segment once a part is committed
+    ticks = count()
+    monkeypatch.setattr(checkpoint.time, "monotonic", lambda: next(ticks))
+
+
+def test_last_record_boundary_skips_quoted_newlines():
+    assert last_record_boundary(b'a,b\n1,"x\ny"\n2,"open\n') == 12
+    assert last_record_boundary('a,"no end') == 0
+    # A quote inside an unquoted value is data, not the start of a field
+    assert last_record_boundary(b'a,b\n5\'11",x\n6,"y\n') == 12
+
+
+@pytest.mark.parametrize("store_kind", ["local", "s3"])
+def test_checkpoint_stores_round_trip(tmp_path, s3, s3_bucket, store_kind):
+    if store_kind == "local":
+        store = LocalCheckpointStore(str(tmp_path))
+    else:
+        store = S3CheckpointStore(s3, s3_bucket, "_checkpoints")
+    assert store.load("job") is None
+    store.save("job", {"offset": 10, "parts": [{"PartNumber": 1, "ETag": "e"}]})
+    assert store.load("job")["offset"] == 10
+    store.delete("job")
+    assert store.load("job") is None
+
+
+def test_interrupted_job_resumes_from_checkpoint(
+    s3, s3_bucket, checkpointing, monkeypatch
+):
+    data = _large_csv()
+    s3.put_object(Bucket=s3_bucket, Key="big.csv", Body=data)
+
+    with monkeypatch.context() as m:
+        _stop_after_first_part(m)
+        first = _process_s3_object(s3, s3_bucket, "big.csv", False, deadline=1)
+    assert first["statusCode"] == 202 and first["incomplete"]
+    assert 0 < int(first["body"].split("at byte ")[1].split()[0]) < len(data)
+    assert list(checkpointing.iterdir())
+
+    second = _process_s3_object(s3, s3_bucket, "big.csv", False, deadline=None)
+    assert second["statusCode"] == 200
+
+    output = s3.get_object(Bucket=s3_bucket, Key="obfuscated/big.csv")
+    assert output["Body"].read() == obfuscate_csv(data.decode(), ["name", "email"])
+    assert output["Metadata"]["source-etag"]
+    assert not list(checkpointing.iterdir())
+
+
+def test_resumed_job_with_stray_quotes_matches_serial(
+    s3, s3_bucket, checkpointing, monkeypatch
+):
+    data = _stray_quote_csv()
+    s3.put_object(Bucket=s3_bucket, Key="quotes.csv", Body=data)
+
+    with monkeypatch.context() as m:
+        _stop_after_first_part(m)
+        first = _process_s3_object(s3, s3_bucket, "quotes.csv", False, deadline=1)
+    assert first["incomplete"]
+    second = _process_s3_object(s3, s3_bucket, "quotes.csv", False)
+    assert second["statusCode"] == 200
+
+    output = s3.get_object(Bucket=s3_bucket, Key="obfuscated/quotes.csv")
+    body = output["Body"].read()
+    assert body == obfuscate_csv(data.decode(), ["name", "email"])
+    assert b"User" not in body and b"@x.com" not in body
+
+
+def test_changed_input_discards_checkpoint(s3, s3_bucket, checkpointing, monkeypatch):
+    s3.put_object(Bucket=s3_bucket, Key="big.csv", Body=_large_csv())
+    with monkeypatch.context() as m:
+        _stop_after_first_part(m)
+        assert _process_s3_object(s3, s3_bucket, "big.csv", False, deadline=1)[
+            "incomplete"
+        ]
+
+    replacement = _large_csv(80)
+    s3.put_object(Bucket=s3_bucket, Key="big.csv", Body=replacement)
+    assert _process_s3_object(s3, s3_bucket, "big.csv", False)["statusCode"] == 200
+    output = s3.get_object(Bucket=s3_bucket, Key="obfuscated/big.csv")["Body"].read()
+    assert output == obfuscate_csv(replacement.decode(), ["name", "email"])
+
+
+def test_small_or_converted_inputs_are_not_checkpointed(
+    s3, s3_bucket, checkpointing, monkeypatch
+):
+    monkeypatch.setenv("CHECKPOINT_MIN_SIZE", str(10**9))
+    s3.put_object(Bucket=s3_bucket, Key="small.csv", Body=b"name,email\nA,a@x\n")
+    assert _process_s3_object(s3, s3_bucket, "small.csv", False)["statusCode"] == 200
+    assert not checkpointing.exists()
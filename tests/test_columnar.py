@@ -0,0 +1,135 @@
+import io
+
+import pyarrow as pa
+import pyarrow.orc as orc
+import pyarrow.parquet as pq
+import pytest
+
+from columnar import mask_columns, obfuscate_columnar, resolve_pii_columns
+from converters import convert_output
+from formats import format_for_uri, sniff_format
+from obfuscator import obfuscate_arrow_ipc, obfuscate_orc, obfuscate_parquet
+
+
+def _table():
+    return pa.table(
+        {
+            "Name": ["Alice", "Bob", "Cara"],
+            "email": ["a@x.com", "b@x.com", "c@x.com"],
+            "age": [30, 40, 50],
+        }
+    )
+
+
+def _ipc_bytes(table, stream=False):
+    sink = pa.BufferOutputStream()
+    opener = pa.ipc.new_stream if stream else pa.ipc.new_file
+    with opener(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=2):
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def test_resolve_pii_columns_is_case_insensitive():
+    assert resolve_pii_columns(["Name", "email"], ["name", "phone"]) == ["Name"]
+    with pytest.raises(ValueError, match="No matching PII fields"):
+        resolve_pii_columns(["age"], ["name"])
+
+
+def test_mask_columns_reuses_untouched_columns():
+    table = _table()
+    masked = mask_columns(table, ["Name"])
+    assert masked.column("Name").to_pylist() == ["***"] * 3
+    # Untouched columns are the very same buffers, not copies
+    assert masked.column("age").chunk(0).buffers()[1].address == (
+        table.column("age").chunk(0).buffers()[1].address
+    )
+
+
+def test_parquet_row_groups_are_preserved():
+    buffer = io.BytesIO()
+    pq.write_table(_table(), buffer, row_group_size=2)
+    result = obfuscate_parquet(buffer.getvalue(), ["email"])
+    parquet_file = pq.ParquetFile(io.BytesIO(result))
+    assert parquet_file.metadata.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.column("email").to_pylist() == ["***"] * 3
+    assert table.column("age").to_pylist() == [30, 40, 50]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_obfuscate_arrow_ipc(stream):
+    result = obfuscate_arrow_ipc(_ipc_bytes(_table(), stream), ["name", "email"])
+    table = pa.ipc.open_file(pa.BufferReader(result)).read_all()
+    assert table.column("Name").to_pylist() == ["***"] * 3
+    assert table.column("email").to_pylist() == ["***"] * 3
+    assert table.column("age").to_pylist() == [30, 40, 50]
+
+
+def test_obfuscate_orc():
+    buffer = io.BytesIO()
+    orc.write_table(_table(), buffer)
+    result = obfuscate_orc(buffer.getvalue(), ["email"])
+    table = orc.ORCFile(pa.BufferReader(result)).read()
+    assert table.column("email").to_pylist() == ["***"] * 3
+    assert table.column("Name").to_pylist() == ["Alice", "Bob", "Cara"]
+
+
+@pytest.mark.parametrize("file_format", ["arrow", "orc"])
+def test_invalid_columnar_content(file_format):
+    with pytest.raises(ValueError, match="Invalid"):
+        obfuscate_columnar(b"definitely not columnar", ["name"], file_format)
+
+
+def test_registry_and_sniffing():
+    assert format_for_uri("s3://b/data.feather").name == "arrow"
+    assert format_for_uri("s3://b/data.orc").name == "orc"
+    assert sniff_format(_ipc_bytes(_table())[:64]).name == "arrow"
+    assert sniff_format(_ipc_bytes(_table(), stream=True)[:64]).name == "arrow"
+    buffer = io.BytesIO()
+    orc.write_table(_table(), buffer)
+    assert sniff_format(buffer.getvalue()[:64]).name == "orc"
+
+
+def test_convert_between_columnar_formats():
+    arrow_bytes = convert_output(b"name,age\n***,30\n", "csv", "arrow")
+    orc_bytes = convert_output(arrow_bytes, "arrow", "orc")
+    table = orc.ORCFile(pa.BufferReader(orc_bytes)).read()
+    assert table.to_pylist() == [{"name": "***", "age": "30"}]
+    assert convert_output(orc_bytes, "orc", "csv") == b"name,age\r\n***,30\r\n"
+
+
+def test_drop_reads_only_retained_parquet_columns(monkeypatch):
+    buffer = io.BytesIO()
+    pq.write_table(_table(), buffer, compression="zstd", row_group_size=2)
+    reads = []
+    read_row_group = pq.ParquetFile.read_row_group
+
+    def spy(self, i, columns=None, **kwargs):
+        reads.append(columns)
+        return read_row_group(self, i, columns=columns, **kwargs)
+
+    monkeypatch.setattr(pq.ParquetFile, "read_row_group", spy)
+
+    result = obfuscate_parquet(buffer.getvalue(), ["EMAIL", "name"], "drop")
+
+    assert reads == [["age"], ["age"]]
+    metadata = pq.ParquetFile(pa.BufferReader(result)).metadata
+    assert metadata.schema.names == ["age"] and metadata.num_row_groups == 2
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+
+@pytest.mark.parametrize("file_format", ["arrow", "orc"])
+def test_drop_removes_columns(file_format):
+    content = _ipc_bytes(_table())
+    if file_format == "orc":
+        buffer = io.BytesIO()
+        orc.write_table(_table(), buffer)
+        content = buffer.getvalue()
+
+    result = obfuscate_columnar(content, ["email"], file_format, "drop")
+
+    table = convert_output(result, file_format, "json")
+    assert b"@x.com" not in table and b"Alice" in table
+    with pytest.raises(ValueError, match="no columns"):
+        obfuscate_columnar(content, ["email", "name", "age"], file_format, "drop")
@@ -0,0 +1,143 @@
+import gzip
+import io
+import json
+import pytest
+import pandas as pd
+
+from compression import (
+    compress_bytes,
+    open_decompressed,
+    sniff_compression,
+    split_compression_suffix,
+)
+from main import obfuscate_handler, lambda_handler
+from s3_utils import get_s3_client
+
+CSV_CONTENT = "id,name,email\n1,John,john@example.com\n2,Jane,jane@example.com\n"
+
+
+@pytest.mark.parametrize(
+    "uri,expected",
+    [
+        ("s3://b/sample.csv.gz", ("s3://b/sample.csv", "gzip")),
+        ("s3://b/data.json.ZST", ("s3://b/data.json", "zstd")),
+        ("s3://b/data.parquet.snappy", ("s3://b/data.parquet", "snappy")),
+        ("s3://b/plain.csv", ("s3://b/plain.csv", None)),
+    ],
+)
+def test_split_compression_suffix(uri, expected):
+    assert split_compression_suffix(uri) == expected
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd", "snappy"])
+def test_round_trip_streaming(codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    if codec == "snappy":
+        pytest.importorskip("snappy")
+    data = CSV_CONTENT.encode("utf-8") * 5000  # several decompressor chunks
+
+    compressed = compress_bytes(data, codec)
+
+    assert sniff_compression(compressed) == codec
+    stream = open_decompressed(io.BytesIO(compressed), codec)
+    assert stream.read(10) == data[:10]
+    assert stream.read() == data[10:]
+
+
+@pytest.mark.parametrize("suffix,codec", [(".gz", "gzip"), (".zst", "zstd")])
+def test_handler_reads_compressed_csv(s3_bucket, suffix, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    s3 = get_s3_client()
+    key = f"landing/sample.csv{suffix}"
+    s3.put_object(
+        Bucket=s3_bucket, Key=key, Body=compress_bytes(CSV_CONTENT.encode(), codec)
+    )
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/{key}",
+        "pii_fields": ["name", "email"],
+    }
+
+    result = obfuscate_handler(json.dumps(payload)).decode("utf-8")
+
+    assert result.count("***") == 4
+    assert "John" not in result
+
+
+def test_handler_reads_gzipped_json_and_parquet(s3_bucket):
+    s3 = get_s3_client()
+    data = [{"id": 1, "name": "Eve", "email": "eve@example.com"}]
+    s3.put_object(
+        Bucket=s3_bucket, Key="d.json.gz", Body=gzip.compress(json.dumps(data).encode())
+    )
+    buffer = io.BytesIO()
+    pd.DataFrame(data).to_parquet(buffer, index=False)
+    s3.put_object(
+        Bucket=s3_bucket, Key="d.parquet.gz", Body=gzip.compress(buffer.getvalue())
+    )
+
+    for key in ("d.json.gz", "d.parquet.gz"):
+        payload = {
+            "file_to_obfuscate": f"s3://{s3_bucket}/{key}",
+            "pii_fields": ["name"],
+        }
+        result = obfuscate_handler(json.dumps(payload))
+        assert b"Eve" not in result
+
+
+def test_handler_detects_utf16_in_compressed_stream(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(
+        Bucket=s3_bucket,
+        Key="utf16.csv.gz",
+        Body=gzip.compress("id,name\n1,Bob".encode("utf-16")),
+    )
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/utf16.csv.gz",
+        "pii_fields": ["name"],
+    }
+
+    assert b"Bob" not in obfuscate_handler(json.dumps(payload))
+
+
+def test_handler_compresses_output(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="plain.csv", Body=CSV_CONTENT)
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/plain.csv",
+        "pii_fields": ["name"],
+        "output_compression": "gzip",
+    }
+
+    result = obfuscate_handler(json.dumps(payload))
+
+    assert gzip.decompress(result).decode("utf-8").count("***") == 2
+
+
+def test_handler_rejects_unknown_output_compression():
+    payload = {
+        "file_to_obfuscate": "s3://bucket/file.csv",
+        "pii_fields": ["name"],
+        "output_compression": "rar",
+    }
+    with pytest.raises(ValueError, match="Unsupported output compression"):
+        obfuscate_handler(json.dumps(payload))
+
+
+def test_lambda_output_key_drops_input_codec(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(
+        Bucket=s3_bucket, Key="in/data.csv.gz", Body=gzip.compress(CSV_CONTENT.encode())
+    )
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "in/data.csv.gz"}}}
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 200
+    result = s3.get_object(Bucket=s3_bucket, Key="obfuscated/data.csv")["Body"].read()
+    assert result.count(b"***") == 4
@@ -0,0 +1,132 @@
+import io
+import json
+import pytest
+import pyarrow.parquet as pq
+import pandas as pd
+
+from converters import convert_output, validate_parquet_options
+from main import obfuscate_handler
+from s3_utils import get_s3_client
+
+CSV_OUTPUT = b"id,name,email\n1,***,***\n2,***,***\n"
+
+
+def test_csv_to_parquet_with_codec_and_row_groups():
+    result = convert_output(
+        CSV_OUTPUT,
+        "csv",
+        "parquet",
+        {"compression": "zstd", "row_group_size": 1},
+    )
+
+    parquet_file = pq.ParquetFile(io.BytesIO(result))
+    assert parquet_file.metadata.num_row_groups == 2
+    assert parquet_file.metadata.row_group(0).column(0).compression == "ZSTD"
+    table = parquet_file.read()
+    assert table.column("name").to_pylist() == ["***", "***"]
+    assert table.column("id").to_pylist() == ["1", "2"]
+
+
+def test_csv_values_are_kept_as_strings():
+    data = b'id,zip,note\n007,01234,NA\n8,,"two\nlines"\n'
+
+    table = pq.read_table(io.BytesIO(convert_output(data, "csv", "parquet")))
+
+    assert table.to_pylist() == [
+        {"id": "007", "zip": "01234", "note": "NA"},
+        {"id": "8", "zip": "", "note": "two\nlines"},
+    ]
+
+
+def test_csv_row_groups_span_read_blocks():
+    data = b"id,name\n" + b"".join(b"%d,***\n" % i for i in range(100_000))
+
+    result = convert_output(data, "csv", "parquet", {"row_group_size": 60_000})
+
+    metadata = pq.ParquetFile(io.BytesIO(result)).metadata
+    assert [metadata.row_group(i).num_rows for i in range(2)] == [60_000, 40_000]
+
+
+def test_mixed_json_records_to_parquet():
+    records = [{"id": 1, "tag": "a"}, {"id": "x7", "extra": [1, 2]}, {"id": 2.5}]
+    contents = {
+        "ndjson": "\n".join(json.dumps(record) for record in records).encode(),
+        "json": json.dumps(records).encode(),
+    }
+
+    for input_format, content in contents.items():
+        result = convert_output(content, input_format, "parquet")
+        table = pq.read_table(io.BytesIO(result))
+        assert table.column_names == ["id", "tag", "extra"]
+        assert table.column("id").to_pylist() == ["1", "x7", "2.5"]
+        assert table.column("tag").to_pylist() == ["a", None, None]
+        assert table.column("extra").to_pylist() == [None, [1, 2], None]
+
+
+def test_csv_to_ndjson():
+    result = convert_output(CSV_OUTPUT, "csv", "ndjson").decode("utf-8")
+    lines = result.strip().split("\n")
+
+    assert len(lines) == 2
+    assert json.loads(lines[0]) == {"id": "1", "name": "***", "email": "***"}
+
+
+def test_json_to_parquet_and_csv():
+    data = json.dumps([{"id": 1, "name": "***"}, {"id": 2, "name": "***", "x": 3}])
+
+    table = pq.read_table(io.BytesIO(convert_output(data.encode(), "json", "parquet")))
+    assert table.num_rows == 2
+
+    csv_result = convert_output(data.encode(), "json", "csv").decode("utf-8")
+    assert csv_result.splitlines()[0] == "id,name,x"
+
+
+def test_parquet_to_ndjson():
+    buffer = io.BytesIO()
+    pd.DataFrame({"id": [1, 2], "name": ["***", "***"]}).to_parquet(buffer)
+
+    result = convert_output(buffer.getvalue(), "parquet", "ndjson").decode("utf-8")
+
+    assert [json.loads(line)["id"] for line in result.splitlines()] == [1, 2]
+
+
+def test_same_format_is_passthrough():
+    assert convert_output(CSV_OUTPUT, "csv", "csv") is CSV_OUTPUT
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"compression": "lzma"}, {"row_group_size": 0}, {"page_size": 10}, "snappy"],
+)
+def test_invalid_parquet_options(options):
+    with pytest.raises((ValueError, TypeError)):
+        validate_parquet_options(options)
+
+
+def test_handler_converts_csv_to_parquet(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(
+        Bucket=s3_bucket, Key="big.csv", Body="id,name,email\n1,Ann,a@x.com\n"
+    )
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/big.csv",
+        "pii_fields": ["name", "email"],
+        "output_format": "parquet",
+        "parquet_options": {"compression": "gzip"},
+    }
+
+    result = obfuscate_handler(json.dumps(payload))
+
+    df = pd.read_parquet(io.BytesIO(result))
+    assert df["name"].tolist() == ["***"]
+    assert df["id"].tolist() == ["1"]
+
+
+def test_handler_rejects_unknown_output_format():
+    payload = {
+        "file_to_obfuscate": "s3://bucket/file.csv",
+        "pii_fields": ["name"],
+        "output_format": "xml",
+    }
+    with pytest.raises(ValueError, match="Unsupported output format"):
+        obfuscate_handler(json.dumps(payload))
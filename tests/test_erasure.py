@@ -0,0 +1,149 @@
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from columnar import read_table, write_table
+from erasure import (
+    SubjectSet,
+    erase_csv,
+    erase_json,
+    erase_ndjson,
+    erase_rows,
+    load_subject_ids,
+)
+from main import obfuscate_handler
+from s3_utils import get_s3_client
+
+SUBJECTS = SubjectSet(["1002", "1004"])
+
+
+def test_csv_rows_of_subjects_are_removed():
+    content = (
+        "student_id,name,email\n"
+        "1001,Ann,a@x.com\n"
+        "1002,Bob,b@x.com\n"
+        '1003,"Cy, Jr",c@x.com\n'
+        "1004,Di,d@x.com\n"
+    )
+    output, removed = erase_csv(io.StringIO(content), "Student_ID", SUBJECTS)
+    assert removed == 2
+    assert output == (
+        b"student_id,name,email\r\n1001,Ann,a@x.com\r\n" b'1003,"Cy, Jr",c@x.com\r\n'
+    )
+
+
+def test_missing_id_field_is_rejected():
+    with pytest.raises(ValueError, match="'student_id' not found"):
+        erase_csv("id,name\n1,Ann\n", "student_id", SUBJECTS)
+
+
+def test_json_ids_match_whatever_their_type():
+    records = [{"Student_ID": 1002}, {"student_id": "1003"}, {"name": "no id"}]
+    output, removed = erase_json(json.dumps(records), "student_id", SUBJECTS)
+    assert removed == 1
+    assert json.loads(output) == records[1:]
+
+    output, removed = erase_json('{"student_id": " 1004 "}', "student_id", SUBJECTS)
+    assert (json.loads(output), removed) == ([], 1)
+
+
+def test_ndjson_kept_lines_are_copied_verbatim():
+    content = '{"student_id": 1001, "n": "Ann"}\n\n{"student_id": 1002}\n{"a":1}'
+    output, removed = erase_ndjson(content, "student_id", SUBJECTS)
+    assert removed == 1
+    assert output == b'{"student_id": 1001, "n": "Ann"}\n{"a":1}\n'
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow", "orc"])
+@pytest.mark.parametrize("id_type", [pa.int64(), pa.string()])
+def test_columnar_rows_are_filtered_per_batch(file_format, id_type):
+    table = pa.table(
+        {
+            "student_id": pa.array(["1001", "1002", "1003", "1004", None]).cast(
+                id_type
+            ),
+            "name": ["Ann", "Bob", "Cy", "Di", "Ed"],
+        }
+    )
+    content = write_table(table, file_format, {"row_group_size": 2})
+
+    output, removed = erase_rows(content, file_format, "student_id", SUBJECTS)
+
+    result = read_table(output, file_format)
+    assert removed == 2
+    assert result.schema == table.schema
+    assert result.column("name").to_pylist() == ["Ann", "Cy", "Ed"]
+
+
+def test_ids_that_do_not_fit_the_column_type_compare_as_strings():
+    table = pa.table({"id": pa.array([7, 8], pa.int32()), "v": ["a", "b"]})
+    output, removed = erase_rows(
+        write_table(table, "parquet"), "parquet", "id", SubjectSet(["8", "x-9"])
+    )
+    assert removed == 1
+    assert pq.read_table(pa.BufferReader(output)).column("v").to_pylist() == ["a"]
+
+
+def test_parquet_row_groups_are_pruned_by_statistics(monkeypatch):
+    table = pa.table({"student_id": list(range(1000, 1040)), "v": ["x"] * 40})
+    content = write_table(
+        table, "parquet", {"row_group_size": 10, "compression": "zstd"}
+    )
+    reads = []
+    read_row_group = pq.ParquetFile.read_row_group
+
+    def spy(self, i, columns=None, **kwargs):
+        reads.append((i, columns))
+        return read_row_group(self, i, columns=columns, **kwargs)
+
+    monkeypatch.setattr(pq.ParquetFile, "read_row_group", spy)
+
+    # In range of no row group: nothing decoded, original bytes returned
+    assert erase_rows(content, "parquet", "student_id", SubjectSet(["5"])) == (
+        content,
+        0,
+    )
+    assert reads == []
+
+    output, removed = erase_rows(
+        content, "parquet", "student_id", SubjectSet(["1015", "1016"])
+    )
+
+    assert removed == 2
+    # Only row group 1 had its ID column scanned
+    assert reads[0] == (1, ["student_id"])
+    assert all(columns is None for _, columns in reads[1:])
+    metadata = pq.ParquetFile(pa.BufferReader(output)).metadata
+    assert [metadata.row_group(i).num_rows for i in range(4)] == [10, 8, 10, 10]
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+
+def test_subject_ids_loaded_from_s3(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="ids.txt", Body=b"1002\r\n\n1004\n")
+    subjects = load_subject_ids(f"s3://{s3_bucket}/ids.txt", s3=s3)
+    assert subjects.ids == {"1002", "1004"}
+    with pytest.raises(ValueError, match="No subject IDs"):
+        load_subject_ids([" "])
+
+
+def test_handler_erases_then_masks(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(
+        Bucket=s3_bucket,
+        Key="students.csv",
+        Body=b"student_id,email\n1001,a@x.com\n1002,b@x.com\n",
+    )
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/students.csv",
+        "erase_subjects": {"id_field": "student_id", "subject_ids": ["1002"]},
+    }
+
+    erased_only = obfuscate_handler(json.dumps(payload), s3=s3)
+    masked = obfuscate_handler(json.dumps(dict(payload, pii_fields=["email"])), s3=s3)
+
+    assert erased_only == b"student_id,email\r\n1001,a@x.com\r\n"
+    assert masked == b"student_id,email\r\n1001,***\r\n"
@@ -0,0 +1,138 @@
+import gzip
+import io
+import json
+import pytest
+import pandas as pd
+
+from formats import (
+    SNIFF_SIZE,
+    format_for_uri,
+    get_format,
+    register_format,
+    sniff_format,
+    _registry,
+)
+from main import obfuscate_handler
+from s3_utils import get_s3_client
+from exceptions import UnsupportedFormatError
+
+
+def _parquet_bytes():
+    buffer = io.BytesIO()
+    pd.DataFrame({"id": [1], "name": ["Ann"]}).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "uri,expected",
+    [
+        ("s3://b/a.csv", "csv"),
+        ("s3://b/a.JSON", "json"),
+        ("s3://b/a.jsonl", "ndjson"),
+        ("s3://b/a.ndjson", "ndjson"),
+        ("s3://b/a.parquet", "parquet"),
+        ("s3://b/a.exe", None),
+        ("s3://b/noext", None),
+    ],
+)
+def test_format_for_uri(uri, expected):
+    file_format = format_for_uri(uri)
+    assert (file_format.name if file_format else None) == expected
+
+
+@pytest.mark.parametrize(
+    "prefix,expected",
+    [
+        (b"id,name\n1,Ann\n", "csv"),
+        (b'[{"id": 1}]', "json"),
+        (b'  {"id": 1,\n "name": "x"}', "json"),
+        (b'{"id": 1}\n{"id": 2}\n', "ndjson"),
+        (b"PAR1\x15\x04", "parquet"),
+        (b"\x00\x01\x02binary", None),
+    ],
+)
+def test_sniff_format(prefix, expected):
+    file_format = sniff_format(prefix)
+    assert (file_format.name if file_format else None) == expected
+
+
+def test_sniffers_only_see_the_prefix():
+    seen = []
+    register_format("probe", (".probe",), lambda c, f: b"", sniffer=seen.append)
+    try:
+        sniff_format(b"x" * (SNIFF_SIZE * 10))
+        assert len(seen[0]) == SNIFF_SIZE
+    finally:
+        _registry.pop("probe")
+
+
+# New formats plug in through the registry without touching the handler
+def test_registered_format_is_used_by_handler(s3_bucket):
+    def obfuscate_pipe(content, pii_fields):
+        header, *rows = content.splitlines()
+        return "\n".join([header] + ["1|***" for _ in rows]).encode()
+
+    register_format("pipe", (".psv",), obfuscate_pipe)
+    try:
+        s3 = get_s3_client()
+        s3.put_object(Bucket=s3_bucket, Key="data.psv", Body="id|name\n1|Ann")
+        payload = {
+            "file_to_obfuscate": f"s3://{s3_bucket}/data.psv",
+            "pii_fields": ["name"],
+        }
+        assert obfuscate_handler(json.dumps(payload)) == b"id|name\n1|***"
+    finally:
+        _registry.pop("pipe")
+
+
+@pytest.mark.parametrize(
+    "body,check",
+    [
+        (b"id,name\n1,Ann\n", lambda r: r.count(b"***") == 1),
+        (json.dumps([{"id": 1, "name": "Ann"}]).encode(), lambda r: b"Ann" not in r),
+        (
+            b'{"id": 1, "name": "Ann"}\n{"id": 2, "name": "Bo"}\n',
+            lambda r: r.count(b"***") == 2,
+        ),
+        (_parquet_bytes(), lambda r: r[:4] == b"PAR1"),
+        (gzip.compress(b"id,name\n1,Ann\n"), lambda r: r == b"id,name\r\n1,***\r\n"),
+    ],
+)
+def test_handler_sniffs_extensionless_files(s3_bucket, body, check):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="exports/latest", Body=body)
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/exports/latest",
+        "pii_fields": ["name"],
+    }
+
+    assert check(obfuscate_handler(json.dumps(payload)))
+
+
+def test_handler_explicit_input_format(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="data.log", Body='{"id": 1, "name": "Ann"}\n')
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/data.log",
+        "pii_fields": ["name"],
+        "input_format": "ndjson",
+    }
+
+    assert b"Ann" not in obfuscate_handler(json.dumps(payload))
+
+
+def test_handler_unsniffable_content_is_unsupported(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="blob.dat", Body=b"\x00\x01\x02\x03")
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/blob.dat",
+        "pii_fields": ["name"],
+    }
+
+    with pytest.raises(UnsupportedFormatError):
+        obfuscate_handler(json.dumps(payload))
+
+
+def test_get_format_returns_engine():
+    assert get_format("csv").binary is False
+    assert get_format("parquet").binary is True
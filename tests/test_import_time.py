@@ -0,0 +1,59 @@
+# Cold-start regression tests.
+# Runs `python -X importtime -c "import main"` in a fresh interpreter and checks:
+# ✅ Heavy dependencies (pandas, pyarrow, boto3, chardet) are not imported up front
+# ✅ The cumulative import time of main stays under a budget
+# ✅ Importing main does not create any log files
+
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Cumulative import time budget for `import main`, in microseconds.
+# Generous enough for slow CI machines; the heavy imports alone exceed it.
+IMPORT_TIME_BUDGET_US = int(os.getenv("IMPORT_TIME_BUDGET_US", "250000"))
+
+HEAVY_MODULES = ("pandas", "pyarrow", "boto3", "botocore", "chardet", "numpy")
+
+
+def _import_main_with_importtime(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": SRC_DIR},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+    # Each line: "import time: <self us> | <cumulative us> | <indent><module>"
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative_us, module = line.split("|")
+        timings[module.strip()] = int(cumulative_us.strip())
+    return timings
+
+
+def test_heavy_modules_not_imported_at_startup(tmp_path):
+    timings = _import_main_with_importtime(tmp_path)
+    top_level = {name.split(".")[0] for name in timings}
+
+    for module in HEAVY_MODULES:
+        assert module not in top_level, f"{module} is imported when loading main"
+
+
+def test_main_import_time_within_budget(tmp_path):
+    timings = _import_main_with_importtime(tmp_path)
+
+    assert "main" in timings
+    assert timings["main"] < IMPORT_TIME_BUDGET_US, (
+        f"import main took {timings['main']}us " f"(budget {IMPORT_TIME_BUDGET_US}us)"
+    )
+
+
+def test_import_does_not_touch_log_files(tmp_path):
+    _import_main_with_importtime(tmp_path)
+    assert not (tmp_path / "logs").exists()
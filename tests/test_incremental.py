@@ -0,0 +1,189 @@
+import json
+import time
+
+import pytest
+
+import main
+from incremental import get_manifest_store, manifest_name, run_incremental
+from main import lambda_handler, run_incremental_batch
+from s3_utils import get_s3_client
+from subject_index import update_index
+
+
+@pytest.fixture
+def processed_keys(monkeypatch):
+    keys = []
+    process = main._process_s3_object
+
+    def spy(s3, bucket, key, force, **kwargs):
+        keys.append(key)
+        return process(s3, bucket, key, force, **kwargs)
+
+    monkeypatch.setattr(main, "_process_s3_object", spy)
+    return keys
+
+
+def test_nightly_runs_process_only_new_and_changed_objects(
+    s3_bucket, monkeypatch, processed_keys
+):
+    s3 = get_s3_client()
+    # The manifest may live under the prefix it tracks
+    monkeypatch.setenv("PROCESSED_MANIFEST_LOCATION", f"s3://{s3_bucket}/landing/_m")
+    event = {"incremental": f"s3://{s3_bucket}/landing/"}
+    for name in ("a", "b"):
+        s3.put_object(
+            Bucket=s3_bucket, Key=f"landing/{name}.csv", Body=b"name,id\nAnn,1\n"
+        )
+
+    first = lambda_handler(event, None)
+
+    assert first["statusCode"] == 200
+    assert (first["listed"], first["pending"], first["processed"]) == (2, 2, 2)
+    assert sorted(processed_keys) == ["landing/a.csv", "landing/b.csv"]
+    output = s3.get_object(Bucket=s3_bucket, Key="obfuscated/a.csv")["Body"].read()
+    assert output == b"name,id\r\n***,1\r\n"
+
+    processed_keys.clear()
+    assert lambda_handler(event, None)["pending"] == 0
+    assert processed_keys == []
+
+    s3.put_object(Bucket=s3_bucket, Key="landing/c.csv", Body=b"name,id\nCy,3\n")
+    s3.put_object(Bucket=s3_bucket, Key="landing/a.csv", Body=b"name,id\nAl,9\n")
+    s3.delete_object(Bucket=s3_bucket, Key="landing/b.csv")
+    third = lambda_handler(event, None)
+
+    assert sorted(processed_keys) == ["landing/a.csv", "landing/c.csv"]
+    assert third["listed"] == 2 and third["processed"] == 2
+    store = get_manifest_store(s3)
+    manifest = store.load(manifest_name(s3_bucket, "landing/"))
+    assert sorted(manifest["objects"]) == ["landing/a.csv", "landing/c.csv"]
+    assert manifest["objects"]["landing/c.csv"]["processed_at"]
+    assert manifest["objects"]["landing/c.csv"]["etag"]
+
+
+def test_changed_objects_replace_their_output(s3_bucket, tmp_path):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/a.csv", Body=b"name,id\nAnn,1\n")
+    uri = f"s3://{s3_bucket}/in/"
+    run_incremental_batch(s3, uri, False, manifest_location=str(tmp_path))
+
+    s3.put_object(Bucket=s3_bucket, Key="in/a.csv", Body=b"name,id\nAl,9\n")
+    second = run_incremental_batch(s3, uri, False, manifest_location=str(tmp_path))
+
+    assert second["statusCode"] == 200 and second["processed"] == 1
+    output = s3.get_object(Bucket=s3_bucket, Key="obfuscated/a.csv")["Body"].read()
+    assert output == b"name,id\r\n***,9\r\n"
+
+
+def test_conflicts_on_changed_objects_are_retried(s3_bucket, tmp_path):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/a.csv", Body=b"x")
+    store = get_manifest_store(s3, str(tmp_path))
+    calls = []
+
+    def process(key, etag, changed):
+        calls.append(changed)
+        return {"statusCode": 409}
+
+    assert run_incremental(s3, s3_bucket, "in/", process, store)["processed"] == 1
+    s3.put_object(Bucket=s3_bucket, Key="in/a.csv", Body=b"y")
+    second = run_incremental(s3, s3_bucket, "in/", process, store)
+
+    assert calls == [False, True]
+    assert second["processed"] == 0 and second["failed"] == 1
+
+
+def test_permanent_failures_wait_for_the_object_to_change(
+    s3_bucket, tmp_path, processed_keys
+):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/good.csv", Body=b"name,id\nAnn,1\n")
+    s3.put_object(Bucket=s3_bucket, Key="in/bad.csv", Body=b"just one column\n")
+    uri = f"s3://{s3_bucket}/in/"
+
+    first = run_incremental_batch(s3, uri, True, manifest_location=str(tmp_path))
+
+    assert first["statusCode"] == 200
+    assert first["processed"] == 1 and first["rejected"] == 1
+    assert first["failed"] == 0 and first["failures"] == []
+
+    processed_keys.clear()
+    second = run_incremental_batch(s3, uri, True, manifest_location=str(tmp_path))
+    assert second["pending"] == 0 and processed_keys == []
+
+    s3.put_object(Bucket=s3_bucket, Key="in/bad.csv", Body=b"name,id\nBo,2\n")
+    third = run_incremental_batch(s3, uri, True, manifest_location=str(tmp_path))
+
+    assert third["statusCode"] == 200 and third["processed"] == 1
+    assert processed_keys == ["in/bad.csv"]
+
+
+def test_transient_failures_are_retried_by_the_next_run(s3_bucket, tmp_path):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/a.csv", Body=b"x")
+    store = get_manifest_store(s3, str(tmp_path))
+    outcomes = iter([{"statusCode": 500, "body": "throttled"}, {"statusCode": 200}])
+
+    def process(key, etag, changed):
+        return next(outcomes)
+
+    first = run_incremental(s3, s3_bucket, "in/", process, store)
+    assert first["failed"] == 1
+    assert first["failures"] == [
+        {"key": "in/a.csv", "statusCode": 500, "body": "throttled"}
+    ]
+    second = run_incremental(s3, s3_bucket, "in/", process, store)
+    assert second["pending"] == 1 and second["processed"] == 1
+
+
+def test_index_entries_and_outputs_under_the_prefix_are_not_input(
+    s3_bucket, tmp_path, monkeypatch, processed_keys
+):
+    rules = tmp_path / "rules.json"
+    rules.write_text(
+        json.dumps({"default": {"pii_fields": ["name"], "output_prefix": "in/out/"}})
+    )
+    monkeypatch.setenv("OBFUSCATION_RULES", str(rules))
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/a.csv", Body=b"id,name\n1,Ann\n")
+    update_index(s3, s3_bucket, "in/", "id")
+    uri = f"s3://{s3_bucket}/in/"
+    manifests = str(tmp_path / "manifests")
+
+    first = run_incremental_batch(s3, uri, True, manifest_location=manifests)
+
+    assert first["statusCode"] == 200
+    assert processed_keys == ["in/a.csv"]
+    assert s3.get_object(Bucket=s3_bucket, Key="in/out/a.csv")
+    processed_keys.clear()
+    second = run_incremental_batch(s3, uri, True, manifest_location=manifests)
+    assert second["statusCode"] == 200
+    assert second["listed"] == 1 and processed_keys == []
+
+
+def test_deadline_leaves_the_rest_for_the_next_run(s3_bucket, tmp_path):
+    s3 = get_s3_client()
+    for i in range(3):
+        s3.put_object(Bucket=s3_bucket, Key=f"in/{i}.csv", Body=b"x")
+    store = get_manifest_store(s3, str(tmp_path))
+
+    summary = run_incremental(
+        s3,
+        s3_bucket,
+        "in/",
+        lambda key, etag, changed: {"statusCode": 200},
+        store,
+        deadline=time.monotonic() - 1,
+    )
+
+    assert summary["remaining"] == 3 and summary["processed"] == 0
+    assert store.load(manifest_name(s3_bucket, "in/")) is None
+
+
+def test_incremental_event_needs_a_manifest_location(s3_bucket):
+    response = lambda_handler({"incremental": f"s3://{s3_bucket}/in/"}, None)
+    assert response["statusCode"] == 400
+    assert "PROCESSED_MANIFEST_LOCATION" in response["body"]
+    response = lambda_handler({"incremental": "landing/"}, None)
+    assert response["statusCode"] == 400
+    assert "s3://bucket/prefix/" in response["body"]
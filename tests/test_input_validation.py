@@ -58,3 +58,13 @@ def test_file_extension_unsupported_type():
     )
     with pytest.raises(UnsupportedFormatError):
         obfuscate_handler(input_json)
+
+
+# Unknown obfuscation strategy
+def test_unsupported_strategy():
+    input_json = (
+        '{"file_to_obfuscate": "s3://bucket/file.csv", "pii_fields": ["email"], '
+        '"strategy": "shuffle"}'
+    )
+    with pytest.raises(ValueError, match="Unsupported strategy"):
+        obfuscate_handler(input_json)
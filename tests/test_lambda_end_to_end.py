@@ -1,6 +1,7 @@
 import json
 from unittest.mock import patch
 import pytest
+import main
 from main import lambda_handler
 from s3_utils import get_s3_client
 
@@ -245,3 +246,201 @@ def test_lambda_env_dev_defaults_to_force(monkeypatch, s3_bucket):
     assert response["statusCode"] == 200
     assert "***" in result
     assert "Test" not in result
+
+
+# Batched events: every record in the notification is processed,
+# not just Records[0], and each one gets its own result entry.
+
+
+def test_lambda_processes_every_record_in_batch(s3_bucket):
+    s3 = get_s3_client()
+    input_keys = [f"batch/file_{i}.csv" for i in range(5)]
+    for i, key in enumerate(input_keys):
+        s3.put_object(
+            Bucket=s3_bucket, Key=key, Body=f"id,name,email\n{i},User{i},u{i}@x.com"
+        )
+
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": key}}}
+            for key in input_keys
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 200
+    assert len(response["results"]) == 5
+    assert all(r["statusCode"] == 200 for r in response["results"])
+    for i in range(5):
+        result = (
+            s3.get_object(Bucket=s3_bucket, Key=f"obfuscated/file_{i}.csv")["Body"]
+            .read()
+            .decode()
+        )
+        assert f"User{i}" not in result
+        assert result.count("***") == 2
+
+
+def test_lambda_batch_reports_mixed_results(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="ok.csv", Body="id,name\n1,Alice")
+
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "ok.csv"}}},
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "gone.csv"}}},
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 207
+    codes = {r["key"]: r["statusCode"] for r in response["results"]}
+    assert codes == {"ok.csv": 200, "gone.csv": 404}
+    assert "batchItemFailures" not in response
+
+
+# SQS-wrapped S3 notifications: only messages that failed with a retryable
+# error are reported in batchItemFailures.
+
+
+def _sqs_record(message_id, bucket, key):
+    s3_event = {
+        "Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key}}}]
+    }
+    return {
+        "messageId": message_id,
+        "eventSource": "aws:sqs",
+        "body": json.dumps(s3_event),
+    }
+
+
+def test_lambda_sqs_partial_batch_failures(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="good.csv", Body="id,name\n1,Alice")
+    s3.put_object(Bucket=s3_bucket, Key="bad.csv", Body="id,age\n1,30")
+
+    event = {
+        "Records": [
+            _sqs_record("msg-1", s3_bucket, "good.csv"),
+            _sqs_record("msg-2", s3_bucket, "bad.csv"),
+            _sqs_record("msg-3", s3_bucket, "missing.csv"),
+            {"messageId": "msg-4", "eventSource": "aws:sqs", "body": "not json"},
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    statuses = {r["message_id"]: r["statusCode"] for r in response["results"]}
+    assert statuses == {"msg-1": 200, "msg-2": 500, "msg-3": 404, "msg-4": 400}
+    assert response["batchItemFailures"] == [{"itemIdentifier": "msg-2"}]
+
+
+def test_lambda_sqs_test_event_is_ignored():
+    event = {
+        "Records": [
+            {
+                "messageId": "msg-1",
+                "eventSource": "aws:sqs",
+                "body": json.dumps({"Event": "s3:TestEvent"}),
+            }
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 400
+
+
+# ETag / content-hash short-circuit: unchanged inputs are not re-obfuscated
+# or re-uploaded when the Lambda runs again with refresh enabled.
+
+
+def test_lambda_skips_unchanged_input(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="same.csv", Body="id,name\n1,Alice")
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "same.csv"}}}
+        ],
+        "refresh": True,
+        "force": False,
+    }
+
+    first = lambda_handler(event, context=None)
+    assert first["statusCode"] == 200
+    assert "unchanged" not in first["results"][0]
+
+    with patch("main.obfuscate_handler") as mock_handler:
+        second = lambda_handler(event, context=None)
+
+    assert second["statusCode"] == 200
+    assert second["results"][0]["unchanged"] is True
+    mock_handler.assert_not_called()
+
+
+def test_lambda_skips_upload_when_output_identical(s3_bucket):
+    s3 = get_s3_client()
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "pii.csv"}}}
+        ],
+        "refresh": True,
+        "force": False,
+    }
+    s3.put_object(Bucket=s3_bucket, Key="pii.csv", Body="id,name\n1,Alice")
+    lambda_handler(event, context=None)
+
+    # Only the PII value changes, so the obfuscated output is byte-identical
+    etag = s3.put_object(Bucket=s3_bucket, Key="pii.csv", Body="id,name\n1,Bob")["ETag"]
+    response = lambda_handler(event, context=None)
+
+    assert response["results"][0]["unchanged"] is True
+    # The output now records the new input, so a later run (in another
+    # process) stops at the HEAD instead of obfuscating again
+    output = s3.head_object(Bucket=s3_bucket, Key="obfuscated/pii.csv")
+    assert output["Metadata"]["source-etag"] == etag.strip('"')
+    main._recent_outputs.clear()
+    with patch("main.obfuscate_handler") as mock_handler:
+        third = lambda_handler(event, context=None)
+    assert third["results"][0]["unchanged"] is True
+    mock_handler.assert_not_called()
+
+
+def test_lambda_force_always_rewrites(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="again.csv", Body="id,name\n1,Alice")
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "again.csv"}}}
+        ],
+        "force": True,
+    }
+    lambda_handler(event, context=None)
+
+    with patch("main.obfuscate_handler", return_value=b"id,name\n1,***\n") as mock:
+        response = lambda_handler(event, context=None)
+
+    assert "unchanged" not in response["results"][0]
+    mock.assert_called_once()
+
+
+def test_lambda_reprocesses_changed_input(s3_bucket):
+    s3 = get_s3_client()
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "chg.csv"}}}
+        ],
+        "force": True,
+    }
+    s3.put_object(Bucket=s3_bucket, Key="chg.csv", Body="id,name\n1,Alice")
+    lambda_handler(event, context=None)
+
+    s3.put_object(Bucket=s3_bucket, Key="chg.csv", Body="id,name\n2,Alice")
+    response = lambda_handler(event, context=None)
+
+    assert "unchanged" not in response["results"][0]
+    output = s3.get_object(Bucket=s3_bucket, Key="obfuscated/chg.csv")
+    assert b"2,***" in output["Body"].read()
+    assert output["Metadata"]["plan-hash"]
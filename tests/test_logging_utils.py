@@ -0,0 +1,99 @@
+import json
+import logging
+import threading
+import uuid
+
+import pytest
+
+from utils import logging_utils
+from utils.logging_utils import RateLimiter, flush_logs, setup_file_logger
+
+
+@pytest.fixture
+def new_logger(tmp_path):
+    """A uniquely named queue-backed logger writing to a temp file."""
+
+    def create():
+        log_file = tmp_path / "test.log"
+        return setup_file_logger(f"test-{uuid.uuid4()}", str(log_file)), log_file
+
+    yield create
+    flush_logs()
+
+
+def test_records_are_written_by_the_background_thread(new_logger, monkeypatch):
+    logger, log_file = new_logger()
+    assert not log_file.exists()
+
+    written_by = []
+    original_emit = logging_utils._FileRouter.emit
+
+    def spy(self, record):
+        written_by.append(threading.current_thread())
+        original_emit(self, record)
+
+    monkeypatch.setattr(logging_utils._FileRouter, "emit", spy)
+    logger.info("Starting obfuscation")
+    flush_logs()
+
+    assert "INFO - " in log_file.read_text()
+    assert "Starting obfuscation" in log_file.read_text()
+    assert written_by and threading.main_thread() not in written_by
+
+
+def test_json_output(new_logger, monkeypatch):
+    flush_logs()
+    monkeypatch.setenv("LOG_FORMAT", "json")
+    logger, log_file = new_logger()
+
+    logger.warning("Missing fields: %s", "phone", extra={"row": "jo@x.com"})
+    flush_logs()
+
+    record = json.loads(log_file.read_text())
+    assert record["level"] == "WARNING"
+    assert record["message"] == "Missing fields: phone"
+    # Only the fixed fields: `extra` attributes never reach the log
+    assert set(record) == {"timestamp", "level", "logger", "message"}
+
+
+def test_repeated_warnings_are_rate_limited(new_logger, monkeypatch):
+    monkeypatch.setenv("LOG_RATE_LIMIT", "3")
+    logger, log_file = new_logger()
+
+    for _ in range(10):
+        logger.warning("Process pool unavailable")
+    logger.info("Done")
+    flush_logs()
+
+    lines = log_file.read_text().splitlines()
+    assert sum("Process pool unavailable" in line for line in lines) == 3
+    assert "Done" in lines[-1]
+
+
+def test_rate_limiter_reports_suppressed_count():
+    limiter = RateLimiter(limit=1, window=0)
+    record = logging.LogRecord("x", logging.WARNING, "", 0, "again", None, None)
+
+    limiter.window = 60
+    assert limiter.check(record) == 0
+    assert limiter.check(record) is None
+    assert limiter.check(record) is None
+    limiter.window = 0
+    assert limiter.check(record) == 2
+    # Below WARNING nothing is limited
+    info = logging.LogRecord("x", logging.INFO, "", 0, "again", None, None)
+    assert all(limiter.check(info) == 0 for _ in range(5))
+
+
+def test_rate_limiter_tracks_a_bounded_number_of_messages():
+    limiter = RateLimiter(limit=1, window=60, max_keys=8)
+
+    for i in range(100):
+        record = logging.LogRecord(
+            "x", logging.WARNING, "", 0, f"s3://b/{i}", None, None
+        )
+        assert limiter.check(record) == 0
+        assert len(limiter._seen) <= 8
+
+    # Recent messages are still limited
+    assert limiter.check(record) is None
@@ -5,6 +5,7 @@ import logging
 import pandas as pd
 import io
 from obfuscator import obfuscate_csv, obfuscate_json, obfuscate_parquet
+from obfuscator import obfuscate_ndjson
 
 
 def test_obfuscate_csv():
@@ -245,6 +246,46 @@ def test_json_field_case_insensitivity():
     assert "alice@example.com" not in result
 
 
+# NDJSON: one object per line, streamed line by line
+def test_obfuscate_ndjson_lines():
+    input_data = (
+        '{"id": 1, "Name": "Alice", "email": "alice@example.com"}\n'
+        "\n"
+        '{"id": 2, "name": "Bob"}\n'
+    )
+    result = obfuscate_ndjson(input_data, ["name", "email"]).decode("utf-8")
+    lines = [json.loads(line) for line in result.splitlines()]
+
+    assert lines[0] == {"id": 1, "Name": "***", "email": "***"}
+    assert lines[1] == {"id": 2, "name": "***"}
+
+
+def test_drop_strategy_removes_fields():
+    csv_output = obfuscate_csv(
+        'id,Name,email\n1,Alice,a@x.com\n2,"Bob, Jr",\n', ["name", "EMAIL"], "drop"
+    )
+    assert csv_output == b"id\r\n1\r\n2\r\n"
+
+    json_output = obfuscate_json('[{"id": 1, "Email": "a@x.com"}]', ["email"], "drop")
+    assert json.loads(json_output) == [{"id": 1}]
+
+    ndjson_output = obfuscate_ndjson('{"id": 1, "name": "A"}\n', ["name"], "drop")
+    assert ndjson_output == b'{"id": 1}\n'
+
+    with pytest.raises(ValueError, match="no columns"):
+        obfuscate_csv("name,email\nA,a@x.com\n", ["name", "email"], "drop")
+
+
+def test_obfuscate_ndjson_invalid_line():
+    with pytest.raises(ValueError, match="line 2"):
+        obfuscate_ndjson('{"name": "a"}\nnot json\n', ["name"])
+
+
+def test_obfuscate_ndjson_missing_fields():
+    with pytest.raises(ValueError, match="No matching PII fields"):
+        obfuscate_ndjson('{"id": 1}\n', ["name"])
+
+
 def test_obfuscate_parquet_valid():
     df = pd.DataFrame(
         {
@@ -0,0 +1,172 @@
+import csv
+import io
+
+import pytest
+
+from obfuscator import obfuscate_csv
+from parallel_csv import (
+    _record_ends,
+    find_record_boundaries,
+    first_record_end,
+    last_record_boundary,
+    obfuscate_csv_parallel,
+)
+
+
+def _sample_csv(rows=200):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["name", "email", "notes"])
+    for i in range(rows):
+        # Quoted fields with embedded newlines, commas and escaped quotes
+        writer.writerow([f"User {i}", f"u{i}@x.com", f'line one\nsaid "hi", {i}'])
+    return buffer.getvalue()
+
+
+def _stray_quote_csv(rows=60):
+    # Unquoted values with stray quotes, which do not open a quoted field,
+    # next to quoted values spanning several lines
+    lines = ["height,secret,notes,email"]
+    for i in range(rows):
+        lines.append(f'5\'{i}",SECRET{i},"line\n""{i}"" more\nline""",u{i}@x.com')
+        lines.append(f'6ft,SECRET{i}b,x"y"z,"a\nb"')
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture(autouse=True)
+def small_parallel_threshold(monkeypatch):
+    monkeypatch.setenv("CSV_PARALLEL_MIN_SIZE", "1")
+
+
+@pytest.mark.parametrize("content", [_sample_csv(), _sample_csv().encode("utf-8")])
+def test_boundaries_never_split_quoted_records(content):
+    boundaries = find_record_boundaries(content, 97)
+    assert boundaries[0] == 0 and boundaries[-1] == len(content)
+    assert len(boundaries) > 10
+    for a, b in zip(boundaries, boundaries[1:]):
+        chunk = content[a:b]
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        # Every chunk parses into whole 3-field records
+        assert all(len(row) == 3 for row in csv.reader(io.StringIO(text)))
+
+
+@pytest.mark.parametrize("as_bytes", [False, True])
+def test_stray_quotes_do_not_move_boundaries(as_bytes):
+    content = _stray_quote_csv()
+    data = content.encode("utf-8") if as_bytes else content
+    # Where the csv module ends each record
+    reader = csv.reader(io.StringIO(content, newline=""))
+    record_ends = {_offset(content, reader.line_num) for _ in reader}
+
+    boundaries = find_record_boundaries(data, 37)
+
+    assert len(boundaries) > 10
+    assert set(boundaries[1:-1]) <= record_ends
+    assert last_record_boundary(data[: boundaries[5] + 20]) == boundaries[5]
+
+
+def _offset(content, line_num):
+    """Offset just after the first `line_num` physical lines."""
+    position = 0
+    for _ in range(line_num):
+        position = content.index("\n", position) + 1
+    return position
+
+
+def test_boundaries_with_unterminated_quote_cover_the_rest():
+    content = 'a,b\n1,"open\n2,3\n4,5\n'
+    assert find_record_boundaries(content, 5) == [0, len(content)]
+
+
+def test_counted_quotes_find_the_same_boundaries_as_the_csv_walk(monkeypatch):
+    import parallel_csv
+
+    monkeypatch.setattr(parallel_csv, "SCAN_BLOCK_SIZE", 64)
+    content = _sample_csv()
+    data = content.encode("utf-8")
+    start = first_record_end(data)
+
+    assert _record_ends(data) is not None
+    assert find_record_boundaries(data, 97, start) == find_record_boundaries(
+        content, 97, start
+    )
+    assert last_record_boundary(data[:-3]) == last_record_boundary(content[:-3])
+    # A stray quote cannot be told apart by counting, so the walk is used
+    assert _record_ends(_stray_quote_csv().encode("utf-8")) is None
+
+
+def test_first_record_end_skips_quoted_newlines():
+    assert first_record_end(b'"a\nb",c\n1,2\n') == 8
+    assert first_record_end("a,b") == 3
+
+
+@pytest.mark.parametrize("transport", ["shm", "pickle"])
+@pytest.mark.parametrize("as_bytes", [False, True])
+def test_parallel_output_matches_serial(as_bytes, transport):
+    content = _sample_csv()
+    expected = obfuscate_csv(content, ["email", "Notes"])
+    data = content.encode("utf-8") if as_bytes else content
+    result = obfuscate_csv_parallel(
+        data, ["email", "Notes"], workers=2, chunk_size=500, transport=transport
+    )
+    assert result == expected
+    assert result.count(b"name,email,notes") == 1
+
+
+@pytest.mark.parametrize("transport", ["shm", "pickle"])
+def test_parallel_output_with_stray_quotes_matches_serial(transport):
+    content = _stray_quote_csv()
+    expected = obfuscate_csv(content, ["secret", "email"])
+
+    result = obfuscate_csv_parallel(
+        content, ["secret", "email"], workers=2, chunk_size=300, transport=transport
+    )
+
+    assert result == expected
+    assert b"SECRET" not in result and b"@x.com" not in result
+
+
+def test_parallel_drop_matches_serial():
+    content = _sample_csv()
+    expected = obfuscate_csv(content, ["email", "Notes"], "drop")
+    result = obfuscate_csv_parallel(
+        content, ["email", "Notes"], workers=2, chunk_size=500, strategy="drop"
+    )
+    assert result == expected
+    assert result.startswith(b"name\r\n") and b"@x.com" not in result
+
+
+def test_parallel_propagates_no_match_error():
+    with pytest.raises(ValueError, match="No matching PII fields"):
+        obfuscate_csv_parallel(_sample_csv(), ["phone"], workers=2, chunk_size=500)
+
+
+def test_invalid_header_rejected_before_forking():
+    with pytest.raises(ValueError, match="JSON detected"):
+        obfuscate_csv_parallel('{"a": 1}\n' * 100, ["a"], workers=2, chunk_size=50)
+
+
+def test_streams_and_single_worker_use_serial_path():
+    content = _sample_csv(5)
+    expected = obfuscate_csv(content, ["email"])
+    assert (
+        obfuscate_csv_parallel(io.StringIO(content), ["email"], workers=4) == expected
+    )
+    assert obfuscate_csv_parallel(content, ["email"], workers=1) == expected
+
+
+def test_outputs_larger_than_their_region_are_returned_by_value(monkeypatch):
+    import parallel_csv
+
+    monkeypatch.setattr(parallel_csv, "OUTPUT_HEADROOM", 0)
+    content = "name,email\n" + "".join(f",e{i}\n" for i in range(300))
+    expected = obfuscate_csv(content, ["name", "email"])
+    result = obfuscate_csv_parallel(
+        content, ["name", "email"], workers=2, chunk_size=64
+    )
+    assert result == expected
+
+
+def test_unknown_transport_is_rejected():
+    with pytest.raises(ValueError, match="Unsupported CSV transport"):
+        obfuscate_csv_parallel(_sample_csv(), ["email"], transport="carrier-pigeon")
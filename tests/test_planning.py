@@ -0,0 +1,110 @@
+import gzip
+import json
+
+import boto3
+import pyarrow as pa
+import pytest
+
+from columnar import write_table
+from main import obfuscate_handler
+from planning import RangedObject, plan, throughput_rates
+from s3_utils import get_s3_client
+
+
+@pytest.fixture
+def planned_bucket(s3_bucket, monkeypatch):
+    # moto 4.1 garbles the aws-chunked bodies boto3 sends for large puts
+    # when it adds checksums by default
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    s3 = boto3.client("s3", region_name="eu-west-2")
+    big = pa.table({"ID": list(range(200_000)), "Email": ["a@x.com"] * 200_000})
+    objects = {
+        "in/people.csv": b"id,Name,email\n1,Ann,a@x.com\n",
+        "in/events.ndjson.gz": gzip.compress(b'{"id": 1, "ip": "1.2.3.4"}\n' * 50),
+        "in/doc.json": json.dumps([{"id": 1, "name": "Ann"}] * 10).encode(),
+        "in/big.parquet": write_table(big, "parquet", {"compression": "none"}),
+        "in/stream.arrow": write_table(big.slice(0, 10), "arrow"),
+        "in/notes.pdf": b"%PDF-1.4",
+    }
+    for key, body in objects.items():
+        s3.put_object(Bucket=s3_bucket, Key=key, Body=body)
+    return s3_bucket, objects
+
+
+def test_prefix_plan_reads_only_headers_and_footers(planned_bucket):
+    bucket, objects = planned_bucket
+    s3 = get_s3_client()
+
+    report = plan(s3, f"s3://{bucket}/in/", ["name", "email"])
+
+    files = {f["key"].split("/")[-1]: f for f in report["files"]}
+    assert report["objects"] == 6
+    assert report["bytes"] == sum(len(body) for body in objects.values())
+    assert files["people.csv"]["matched"] == ["Name", "email"]
+    assert files["people.csv"]["missing"] == []
+    assert files["events.ndjson.gz"]["compression"] == "gzip"
+    assert files["events.ndjson.gz"]["columns"] == ["id", "ip"]
+    assert files["events.ndjson.gz"]["missing"] == ["name", "email"]
+    assert files["doc.json"]["missing"] == ["email"]
+    assert files["big.parquet"]["matched"] == ["Email"]
+    assert files["stream.arrow"]["columns"] == ["ID", "Email"]
+    assert files["notes.pdf"]["skipped"] == "Unsupported format"
+    assert report["files_with_missing_fields"] == 4
+    assert report["files_without_matches"] == 1
+    # The Parquet body is MBs; only its footer block was fetched
+    assert files["big.parquet"]["size"] > 1_000_000
+    assert files["big.parquet"]["bytes_read"] <= 64 * 1024
+    assert report["estimated_seconds"] > 0
+
+
+def test_single_object_plan_through_the_handler(s3_bucket, monkeypatch):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="people.csv", Body=b"id,email\n" * 1000)
+    monkeypatch.setenv("PLAN_THROUGHPUT", '{"csv": 9000}')
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/people.csv",
+        "pii_fields": ["Email", "phone"],
+        "plan": True,
+    }
+
+    report = json.loads(obfuscate_handler(json.dumps(payload), s3=s3))
+
+    (entry,) = report["files"]
+    assert entry["matched"] == ["email"] and entry["missing"] == ["phone"]
+    assert entry["estimated_seconds"] == pytest.approx(1.0, abs=0.01)
+    with pytest.raises(TypeError, match="'plan'"):
+        obfuscate_handler(json.dumps(dict(payload, plan="yes")), s3=s3)
+
+
+def test_long_first_json_record_is_read_further(s3_bucket, monkeypatch):
+    s3 = get_s3_client()
+    record = {"notes": "x" * 5000, "email": "a@x.com"}
+    body = json.dumps([record] * 5).encode()
+    s3.put_object(Bucket=s3_bucket, Key="doc.json", Body=body)
+    monkeypatch.setenv("PLAN_PREFIX_SIZE", "1024")
+
+    report = plan(s3, f"s3://{s3_bucket}/doc.json", ["email"])
+
+    assert report["files"][0]["matched"] == ["email"]
+    assert report["files"][0]["bytes_read"] < len(body)
+
+
+def test_ranged_object_caches_its_last_block(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="blob", Body=bytes(range(256)) * 100)
+    source = RangedObject(s3, s3_bucket, "blob", 25600, block_size=1000)
+
+    source.seek(-8, 2)
+    assert source.read(8) == bytes(range(248, 256))
+    assert source.read_range(24700, 10) == bytes(range(124, 134))
+    assert source.requests == 1 and source.bytes_read == 1000
+    # Reading on from the start fetches only the bytes not seen yet
+    assert source.read_range(0, 10) == bytes(range(10))
+    assert source.read_range(5, 1500)[-1] == 1504 % 256
+    assert source.requests == 3 and source.bytes_read == 3000
+
+
+def test_throughput_override_must_be_an_object(monkeypatch):
+    monkeypatch.setenv("PLAN_THROUGHPUT", "[1, 2]")
+    with pytest.raises(ValueError, match="PLAN_THROUGHPUT"):
+        throughput_rates()
@@ -0,0 +1,75 @@
+import json
+import pstats
+import tracemalloc
+
+import pytest
+
+from main import lambda_handler, obfuscate_handler
+from profiling import profiled
+from s3_utils import get_s3_client
+
+CSV = b"id,name,email\n1,Alice,alice@example.com\n2,Bob,bob@example.com\n"
+
+
+def _payload(bucket, **extra):
+    return json.dumps(
+        {
+            "file_to_obfuscate": f"s3://{bucket}/data.csv",
+            "pii_fields": ["email"],
+            **extra,
+        }
+    )
+
+
+def test_profiled_run_returns_the_same_output(s3_bucket, tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_OUTPUT", str(tmp_path))
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="data.csv", Body=CSV)
+
+    plain = obfuscate_handler(_payload(s3_bucket), s3=s3)
+    profiled_output = obfuscate_handler(_payload(s3_bucket, profile=True), s3=s3)
+
+    assert profiled_output == plain
+    (stats_file,) = tmp_path.glob("*-data.csv.pstats")
+    assert pstats.Stats(str(stats_file)).total_calls > 0
+    summary = stats_file.with_suffix(".txt").read_text()
+    assert "Wall time" in summary and "Peak traced memory" in summary
+    assert "obfuscate_handler" in summary
+    # Function names and locations only, never data
+    assert "alice@example.com" not in summary
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_must_be_a_boolean(s3_bucket):
+    with pytest.raises(TypeError, match="'profile'"):
+        obfuscate_handler(_payload(s3_bucket, profile="yes"))
+
+
+def test_profile_written_to_s3(s3_bucket):
+    s3 = get_s3_client()
+    with profiled("run", destination=f"s3://{s3_bucket}/profiles", s3=s3) as written:
+        sum(range(1000))
+
+    keys = [o["Key"] for o in s3.list_objects_v2(Bucket=s3_bucket)["Contents"]]
+    assert sorted(keys) == sorted(
+        location.replace(f"s3://{s3_bucket}/", "") for location in written.values()
+    )
+    assert all(key.startswith("profiles/") for key in keys)
+
+
+def test_lambda_reports_profile_locations(s3_bucket, tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_OUTPUT", str(tmp_path))
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="data.csv", Body=CSV)
+    event = {
+        "profile": True,
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "data.csv"}}}
+        ],
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 200
+    assert response["profile"]["pstats"].startswith(str(tmp_path))
+    assert "_process_s3_object" in open(response["profile"]["summary"]).read()
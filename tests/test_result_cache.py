@@ -0,0 +1,131 @@
+import json
+import os
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+
+from main import obfuscate_handler, lambda_handler
+from result_cache import LocalResultCache, S3ManifestCache, result_cache_key
+from s3_utils import get_s3_client
+
+
+def test_cache_key_changes_with_version_and_plan():
+    base = result_cache_key("b", "k.csv", "etag1", ["name", "email"])
+
+    assert base == result_cache_key("b", "k.csv", "etag1", ["Email", "name"])
+    assert base != result_cache_key("b", "k.csv", "etag2", ["name", "email"])
+    assert base != result_cache_key("b", "k.csv", "etag1", ["name"])
+    assert base != result_cache_key("b", "k.csv", "etag1", ["name", "email"], "drop")
+    as_ndjson = result_cache_key("b", "k.csv", "etag1", ["name"], input_format="ndjson")
+    assert as_ndjson != result_cache_key("b", "k.csv", "etag1", ["name"])
+
+
+def test_local_cache_round_trip(tmp_path):
+    cache = LocalResultCache(str(tmp_path))
+
+    assert cache.get("abc123") is None
+    cache.put("abc123", b"obfuscated")
+    assert cache.get("abc123") == b"obfuscated"
+
+
+def test_local_cache_evicts_least_recently_used(tmp_path):
+    cache = LocalResultCache(str(tmp_path), max_bytes=25)
+    for i, name in enumerate(("aa1", "bb2", "cc3")):
+        cache.put(name, b"x" * 10)
+        # mtime resolution can be coarse: space the writes out explicitly
+        os.utime(tmp_path / name[:2] / name, (i, i))
+    assert cache.get("aa1") is None
+    assert cache.get("bb2") == b"x" * 10
+
+    # The hit made bb2 recently used, so cc3 goes next
+    os.utime(tmp_path / "cc3"[:2] / "cc3", (5, 5))
+    cache.put("dd4", b"y" * 10)
+
+    assert cache.get("cc3") is None
+    assert cache.get("bb2") is not None and cache.get("dd4") is not None
+    cache.put("ee5", b"z" * 30)
+    assert cache.get("ee5") is None
+
+
+# Local disk cache in front of obfuscate_handler: a repeat request is answered
+# after a HEAD, without downloading the body again.
+def test_handler_served_from_local_cache(s3_bucket, tmp_path, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE_DIR", str(tmp_path))
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="data.csv", Body="id,name\n1,Alice")
+    payload = json.dumps(
+        {"file_to_obfuscate": f"s3://{s3_bucket}/data.csv", "pii_fields": ["name"]}
+    )
+
+    first = obfuscate_handler(payload)
+
+    with patch("main.fetch_file_from_s3") as mock_fetch:
+        second = obfuscate_handler(payload)
+
+    mock_fetch.assert_not_called()
+    assert second == first
+
+    # A new version of the input is a cache miss
+    s3.put_object(Bucket=s3_bucket, Key="data.csv", Body="id,name\n2,Bob")
+    assert b"2,***" in obfuscate_handler(payload)
+
+
+# S3 manifest cache in the Lambda: a hit becomes a server-side copy_object
+def test_lambda_copies_cached_output(s3_bucket, tmp_path, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE_MANIFEST", f"s3://{s3_bucket}/_cache")
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="a/data.csv", Body="id,name\n1,Alice")
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "a/data.csv"}}}
+        ]
+    }
+    lambda_handler(event, context=None)
+
+    # Route the same input to a new output prefix
+    rules = tmp_path / "rules.json"
+    rules.write_text(
+        json.dumps(
+            {"default": {"pii_fields": ["name", "email"], "output_prefix": "v2/"}}
+        )
+    )
+    monkeypatch.setenv("OBFUSCATION_RULES", str(rules))
+
+    with patch("main.obfuscate_handler") as mock_handler:
+        response = lambda_handler(event, context=None)
+
+    mock_handler.assert_not_called()
+    assert response["statusCode"] == 200
+    assert response["results"][0]["cached"] is True
+    copied = s3.get_object(Bucket=s3_bucket, Key="v2/data.csv")["Body"].read()
+    original = s3.get_object(Bucket=s3_bucket, Key="obfuscated/data.csv")["Body"].read()
+    assert copied == original
+
+
+def test_manifest_stale_entry_is_a_miss(s3_bucket):
+    s3 = get_s3_client()
+    cache = S3ManifestCache(s3, s3_bucket, "_cache")
+    cache.record("key1", s3_bucket, "deleted/output.csv", "abc")
+
+    entry = cache.lookup("key1")
+    assert entry == {"bucket": s3_bucket, "key": "deleted/output.csv", "etag": "abc"}
+    assert cache.copy_to(entry, s3_bucket, "new/output.csv") is False
+    assert cache.lookup("missing") is None
+
+
+def test_manifest_entry_of_overwritten_output_is_a_miss(s3_bucket):
+    s3 = get_s3_client()
+    cache = S3ManifestCache(s3, s3_bucket, "_cache")
+    entry = {"bucket": s3_bucket, "key": "out.csv", "etag": "abc"}
+    # moto ignores copy preconditions, so answer as S3 does for a changed ETag
+    precondition_failed = ClientError(
+        {"Error": {"Code": "PreconditionFailed"}}, "CopyObject"
+    )
+
+    with patch.object(s3, "copy_object", side_effect=precondition_failed) as copy:
+        assert cache.copy_to(entry, s3_bucket, "new.csv") is False
+
+    assert copy.call_args.kwargs["CopySourceIfMatch"] == "abc"
+    # Entries recorded without an ETag are never trusted
+    del entry["etag"]
+    assert cache.copy_to(entry, s3_bucket, "new.csv") is False
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+import pytest
+import boto3
+from unittest.mock import patch
+
+import rules
+from rules import RuleTable, get_rule_table
+from main import lambda_handler
+from s3_utils import get_s3_client
+
+RULES_CONFIG = {
+    "rules": [
+        {"prefix": "hr/", "pii_fields": ["salary"], "output_prefix": "safe/hr/"},
+        {"match": "students/*.csv", "pii_fields": ["name", "email"]},
+    ],
+    "default": {"pii_fields": ["email"], "output_prefix": "obfuscated/"},
+}
+
+
+# Prefix and glob rules, first match wins, default as fallback
+def test_rule_table_resolves_prefix_glob_and_default():
+    table = RuleTable(RULES_CONFIG)
+
+    assert table.resolve("hr/pay.csv")["pii_fields"] == ["salary"]
+    assert table.resolve("hr/pay.csv")["output_prefix"] == "safe/hr/"
+    assert table.resolve("students/a.csv")["pii_fields"] == ["name", "email"]
+    assert table.resolve("students/a.csv")["output_prefix"] == "obfuscated/"
+    assert table.resolve("other/x.json")["pii_fields"] == ["email"]
+
+
+def test_rule_table_without_default_returns_none():
+    table = RuleTable({"rules": [{"prefix": "hr/", "pii_fields": ["name"]}]})
+    assert table.resolve("finance/x.csv") is None
+
+
+def test_builtin_defaults_when_unconfigured():
+    rule = get_rule_table().resolve("anything.csv")
+    assert rule["pii_fields"] == ["name", "email"]
+    assert rule["output_prefix"] == "obfuscated/"
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"rules": [{"pii_fields": ["name"]}]},  # no prefix or match
+        {"rules": [{"prefix": "a/", "pii_fields": []}]},
+        {"rules": [{"prefix": "a/", "pii_fields": ["name"], "strategy": "nope"}]},
+        {"rules": [{"prefix": "a/", "pii_fields": ["name"], "typo": 1}]},
+        {"rules": "not a list"},
+    ],
+)
+def test_invalid_rules_are_rejected(config):
+    with pytest.raises(ValueError):
+        RuleTable(config)
+
+
+# Local file: cached within the TTL, reloaded only when the file changes
+def test_local_rules_cached_and_revalidated(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(RULES_CONFIG))
+
+    first = get_rule_table(str(path), ttl=3600)
+    assert get_rule_table(str(path), ttl=3600) is first
+
+    # TTL expired but file unchanged → same table
+    assert get_rule_table(str(path), ttl=0) is first
+
+    updated = {"default": {"pii_fields": ["phone"]}}
+    path.write_text(json.dumps(updated))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    assert get_rule_table(str(path), ttl=0).resolve("x.csv")["pii_fields"] == ["phone"]
+
+
+# S3 object: revalidated with If-None-Match instead of a full download
+def test_s3_rules_revalidated_with_etag(s3_bucket):
+    s3 = boto3.client("s3", region_name="eu-west-2")
+    s3.put_object(
+        Bucket=s3_bucket, Key="config/rules.json", Body=json.dumps(RULES_CONFIG)
+    )
+    source = f"s3://{s3_bucket}/config/rules.json"
+
+    first = get_rule_table(source, s3=s3, ttl=0)
+
+    with patch.object(s3, "get_object", wraps=s3.get_object) as spy:
+        assert get_rule_table(source, s3=s3, ttl=0) is first
+        assert "IfNoneMatch" in spy.call_args.kwargs
+
+    s3.put_object(
+        Bucket=s3_bucket,
+        Key="config/rules.json",
+        Body=json.dumps({"default": {"pii_fields": ["phone"]}}),
+    )
+    assert get_rule_table(source, s3=s3, ttl=0).resolve("x")["pii_fields"] == ["phone"]
+
+
+# A failed reload keeps serving the last good table
+def test_failed_reload_serves_last_good_table(s3_bucket):
+    s3 = boto3.client("s3", region_name="eu-west-2")
+    s3.put_object(
+        Bucket=s3_bucket, Key="config/rules.json", Body=json.dumps(RULES_CONFIG)
+    )
+    source = f"s3://{s3_bucket}/config/rules.json"
+    first = get_rule_table(source, s3=s3, ttl=0)
+
+    s3.put_object(Bucket=s3_bucket, Key="config/rules.json", Body=b"{not json")
+    assert get_rule_table(source, s3=s3, ttl=0) is first
+    s3.delete_object(Bucket=s3_bucket, Key="config/rules.json")
+    assert get_rule_table(source, s3=s3, ttl=0) is first
+
+
+# Other threads are served the cached table while one thread reloads it
+def test_slow_reload_does_not_block_other_threads(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(RULES_CONFIG))
+    first = get_rule_table(str(path), ttl=0)
+    fetching, release = threading.Event(), threading.Event()
+    load = rules._load_from_file
+
+    def slow_load(source, version=None):
+        fetching.set()
+        release.wait(5)
+        return load(source, version)
+
+    with patch.object(rules, "_load_from_file", slow_load):
+        reloader = threading.Thread(target=get_rule_table, args=(str(path), None, 0))
+        reloader.start()
+        assert fetching.wait(5)
+        started = time.monotonic()
+        assert get_rule_table(str(path), ttl=0) is first
+        assert time.monotonic() - started < 1  # did not wait for the reload
+        release.set()
+        reloader.join()
+
+
+def test_lambda_uses_rules_for_fields_and_output(s3_bucket, tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(RULES_CONFIG))
+    monkeypatch.setenv("OBFUSCATION_RULES", str(path))
+
+    s3 = get_s3_client()
+    s3.put_object(
+        Bucket=s3_bucket, Key="hr/pay.csv", Body="id,name,salary\n1,Ann,50000"
+    )
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "hr/pay.csv"}}}
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 200
+    result = s3.get_object(Bucket=s3_bucket, Key="safe/hr/pay.csv")["Body"].read()
+    assert b"50000" not in result
+    assert b"Ann" in result  # only the rule's fields are obfuscated
+
+
+def test_lambda_skips_keys_without_matching_rule(s3_bucket, tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [{"prefix": "hr/", "pii_fields": ["x"]}]}))
+    monkeypatch.setenv("OBFUSCATION_RULES", str(path))
+
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "misc/a.csv"}}}
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 204
+
+
+def test_lambda_rule_output_format_changes_extension(s3_bucket, tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    path.write_text(
+        json.dumps({"default": {"pii_fields": ["name"], "output_format": "parquet"}})
+    )
+    monkeypatch.setenv("OBFUSCATION_RULES", str(path))
+
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/data.csv", Body="id,name\n1,Ann")
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": s3_bucket}, "object": {"key": "in/data.csv"}}}
+        ]
+    }
+
+    response = lambda_handler(event, context=None)
+
+    assert response["statusCode"] == 200
+    body = s3.get_object(Bucket=s3_bucket, Key="obfuscated/data.parquet")["Body"]
+    assert body.read()[:4] == b"PAR1"
@@ -1,7 +1,7 @@
 import boto3
 import pytest
 
-from s3_utils import fetch_file_from_s3
+from s3_utils import fetch_file_from_s3, put_object_if_absent
 from unittest.mock import patch, MagicMock
 from exceptions import S3ObjectNotFoundError
 
@@ -95,3 +95,52 @@ def test_logs_encoding_detected(caplog):
             fetch_file_from_s3(fake_s3_uri)
 
     assert any("Detected file encoding:" in message for message in caplog.messages)
+
+
+# Conditional writes: one PUT with If-None-Match instead of HEAD + PUT
+
+
+def _client_error(code):
+    from botocore.exceptions import ClientError
+
+    return ClientError({"Error": {"Code": code}}, "PutObject")
+
+
+def test_put_if_absent_uses_single_conditional_put(monkeypatch):
+    monkeypatch.setenv("S3_CONDITIONAL_WRITES", "true")
+    mock_s3 = MagicMock()
+
+    assert put_object_if_absent(mock_s3, "bucket", "out.csv", b"data") is True
+    mock_s3.put_object.assert_called_once_with(
+        Bucket="bucket", Key="out.csv", Body=b"data", IfNoneMatch="*"
+    )
+    mock_s3.head_object.assert_not_called()
+
+
+def test_put_if_absent_returns_false_when_key_exists(monkeypatch):
+    monkeypatch.setenv("S3_CONDITIONAL_WRITES", "true")
+    mock_s3 = MagicMock()
+    mock_s3.put_object.side_effect = _client_error("PreconditionFailed")
+
+    assert put_object_if_absent(mock_s3, "bucket", "out.csv", b"data") is False
+    mock_s3.head_object.assert_not_called()
+
+
+def test_put_if_absent_falls_back_when_unsupported(monkeypatch):
+    monkeypatch.setenv("S3_CONDITIONAL_WRITES", "true")
+    mock_s3 = MagicMock()
+    mock_s3.put_object.side_effect = [_client_error("NotImplemented"), None]
+    mock_s3.head_object.side_effect = _client_error("404")
+
+    assert put_object_if_absent(mock_s3, "bucket", "out.csv", b"data") is True
+    assert mock_s3.put_object.call_count == 2
+    assert "IfNoneMatch" not in mock_s3.put_object.call_args.kwargs
+
+
+def test_put_if_absent_head_fallback_detects_existing(s3_bucket):
+    s3 = boto3.client("s3", region_name="eu-west-2")
+    s3.put_object(Bucket=s3_bucket, Key="out.csv", Body=b"old")
+
+    assert put_object_if_absent(s3, s3_bucket, "out.csv", b"new") is False
+    assert put_object_if_absent(s3, s3_bucket, "new.csv", b"new") is True
+    assert s3.get_object(Bucket=s3_bucket, Key="out.csv")["Body"].read() == b"old"
@@ -0,0 +1,133 @@
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from main import obfuscate_handler
+from s3_utils import get_s3_client
+from service import ObfuscationService, QueueFullError, create_server
+
+
+@pytest.fixture
+def running_service():
+    """Start a service on a free local port; yields a request function."""
+    servers = []
+
+    def start(handler, workers=2, queue_size=4):
+        service = ObfuscationService(handler, workers, queue_size)
+        server = create_server(service, "127.0.0.1:0")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append((server, service))
+
+        def request(method, path, body=None):
+            conn = http.client.HTTPConnection(*server.server_address, timeout=10)
+            conn.request(method, path, body=body)
+            response = conn.getresponse()
+            return response.status, response.getheaders(), response.read()
+
+        return service, request
+
+    yield start
+    for server, service in servers:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()
+
+
+def test_obfuscates_the_same_payload_as_the_handler(s3_bucket, running_service):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="data.csv", Body=b"name,email\nJo,jo@x.com\n")
+    service, request = running_service(obfuscate_handler)
+    service.s3 = s3
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/data.csv",
+        "pii_fields": ["email"],
+    }
+
+    status, _, body = request("POST", "/obfuscate", json.dumps(payload))
+
+    assert status == 200
+    assert body == b"name,email\r\nJo,***\r\n"
+    assert service.stats()["completed"] == 1
+
+
+@pytest.mark.parametrize(
+    "payload, expected_status",
+    [
+        ("not json", 400),
+        (json.dumps({"pii_fields": ["name"]}), 400),
+        ({"file_to_obfuscate": "missing.csv", "pii_fields": ["a"]}, 404),
+    ],
+)
+def test_errors_map_to_http_statuses(
+    s3_bucket, running_service, payload, expected_status
+):
+    _, request = running_service(obfuscate_handler)
+    if isinstance(payload, dict):
+        uri = f"s3://{s3_bucket}/{payload['file_to_obfuscate']}"
+        payload = json.dumps(dict(payload, file_to_obfuscate=uri))
+    status, _, body = request("POST", "/obfuscate", payload)
+    assert status == expected_status
+    assert json.loads(body)["error"]
+
+
+def test_backpressure_rejects_when_queue_is_full(running_service):
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def slow_handler(json_input, encoding_override, s3):
+        started.release()
+        release.wait(10)
+        return b"done"
+
+    service, request = running_service(slow_handler, workers=1, queue_size=1)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(request("POST", "/obfuscate", "{}"))
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    started.acquire(timeout=5)
+    deadline = time.monotonic() + 5
+    while service.stats()["queued"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # One request running and one queued: the next one is turned away
+    with pytest.raises(QueueFullError):
+        service.submit("{}")
+    status, headers, _ = request("POST", "/obfuscate", "{}")
+    assert status == 503
+    assert dict(headers)["Retry-After"] == "1"
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert [r[0] for r in results] == [200, 200]
+    assert service.stats()["rejected"] == 2
+
+
+def test_health_and_unix_socket(tmp_path):
+    service = ObfuscationService(lambda *args: b"ok", workers=1, queue_size=0)
+    path = str(tmp_path / "obfuscator.sock")
+    server = create_server(service, f"unix:{path}")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(path)
+            sock.sendall(
+                b"GET /health HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+            )
+            response = b""
+            while chunk := sock.recv(4096):
+                response += chunk
+        assert response.startswith(b"HTTP/1.1 200")
+        assert json.loads(response.split(b"\r\n\r\n", 1)[1])["workers"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()
@@ -0,0 +1,243 @@
+import gzip
+import hashlib
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from main import lambda_handler
+from obfuscator import obfuscate_csv, obfuscate_ndjson
+from s3_utils import get_s3_client
+from sharding import (
+    iter_parts,
+    shard_prefix,
+    stream_sharded_output,
+    validate_shard_options,
+    write_sharded_output,
+)
+
+CSV = "id,name,notes\n" + "".join(f'{i},***,"a\nb, {i}"\n' for i in range(10))
+
+
+def _event(bucket, key):
+    return {"Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key}}}]}
+
+
+def test_csv_parts_repeat_the_header_and_keep_every_row():
+    original = obfuscate_csv(CSV, ["name"])
+    parts = list(iter_parts(original, "csv", rows_per_part=4))
+
+    assert [rows for _, rows in parts] == [4, 4, 2]
+    header = b"id,name,notes\r\n"
+    assert all(body.startswith(header) for body, _ in parts)
+    assert header + b"".join(body[len(header) :] for body, _ in parts) == original
+
+
+def test_csv_parts_bounded_by_bytes():
+    parts = list(iter_parts(obfuscate_csv(CSV, ["name"]), "csv", target_bytes=60))
+    assert len(parts) > 2
+    assert sum(rows for _, rows in parts) == 10
+
+
+@pytest.mark.parametrize("file_format", ["ndjson", "json"])
+def test_json_parts(file_format):
+    records = [{"id": i, "name": "***"} for i in range(5)]
+    if file_format == "json":
+        data = json.dumps(records).encode()
+    else:
+        data = b"".join(json.dumps(r).encode() + b"\n" for r in records)
+
+    parts = list(iter_parts(data, file_format, rows_per_part=2))
+
+    assert [rows for _, rows in parts] == [2, 2, 1]
+    if file_format == "json":
+        decoded = [r for body, _ in parts for r in json.loads(body)]
+    else:
+        decoded = [json.loads(line) for body, _ in parts for line in body.splitlines()]
+    assert decoded == records
+
+
+def test_parquet_parts_are_complete_files():
+    buffer = io.BytesIO()
+    pq.write_table(pa.table({"id": list(range(10)), "name": ["***"] * 10}), buffer)
+
+    parts = list(iter_parts(buffer.getvalue(), "parquet", rows_per_part=3))
+
+    assert [rows for _, rows in parts] == [3, 3, 3, 1]
+    ids = [
+        i
+        for body, _ in parts
+        for i in pq.read_table(io.BytesIO(body))["id"].to_pylist()
+    ]
+    assert ids == list(range(10))
+
+
+@pytest.mark.parametrize("file_format", ["csv", "ndjson"])
+def test_streamed_parts_match_the_parts_of_the_whole_output(s3_bucket, file_format):
+    s3 = get_s3_client()
+    if file_format == "csv":
+        data = CSV.replace("***", "Ann")
+        whole = obfuscate_csv(data, ["name"])
+    else:
+        data = "".join(json.dumps({"id": i, "name": "Ann"}) + "\n" for i in range(9))
+        whole = obfuscate_ndjson(data, ["name"])
+    shard = {"rows_per_part": 4}
+
+    streamed = stream_sharded_output(
+        s3,
+        s3_bucket,
+        "a/out.x",
+        io.StringIO(data),
+        file_format,
+        ["name"],
+        "mask",
+        shard,
+    )
+    buffered = write_sharded_output(s3, s3_bucket, "b/out.x", whole, file_format, shard)
+
+    assert [(p["rows"], p["sha256"]) for p in streamed["parts"]] == [
+        (p["rows"], p["sha256"]) for p in buffered["parts"]
+    ]
+    assert streamed["content_sha256"] == buffered["content_sha256"]
+
+
+def test_parts_are_uploaded_while_the_input_is_read(s3_bucket):
+    s3 = get_s3_client()
+    lines_read = []
+    uploads = []
+
+    def lines():
+        yield "id,name\n"
+        for i in range(100):
+            lines_read.append(i)
+            yield f"{i},Ann\n"
+
+    put_object = s3.put_object
+
+    def record_upload(**kwargs):
+        uploads.append(len(lines_read))
+        return put_object(**kwargs)
+
+    s3.put_object = record_upload
+    manifest = stream_sharded_output(
+        s3,
+        s3_bucket,
+        "out.csv",
+        lines(),
+        "csv",
+        ["name"],
+        "mask",
+        {"rows_per_part": 10},
+    )
+
+    assert len(manifest["parts"]) == 10 and manifest["total_rows"] == 100
+    # The first part was cut long before the last line was read
+    assert min(uploads) < 50
+
+
+def test_streamed_parquet_parts(s3_bucket):
+    buffer = io.BytesIO()
+    pq.write_table(pa.table({"id": list(range(10)), "name": ["Ann"] * 10}), buffer)
+    s3 = get_s3_client()
+
+    manifest = stream_sharded_output(
+        s3,
+        s3_bucket,
+        "out.parquet",
+        buffer.getvalue(),
+        "parquet",
+        ["name"],
+        "mask",
+        {"rows_per_part": 3},
+    )
+
+    assert [part["rows"] for part in manifest["parts"]] == [3, 3, 3, 1]
+    tables = [
+        pq.read_table(
+            io.BytesIO(s3.get_object(Bucket=s3_bucket, Key=p["key"])["Body"].read())
+        )
+        for p in manifest["parts"]
+    ]
+    assert [i for t in tables for i in t["id"].to_pylist()] == list(range(10))
+    assert {v for t in tables for v in t["name"].to_pylist()} == {"***"}
+
+
+@pytest.mark.parametrize(
+    "options", [{}, {"rows": 5}, {"rows_per_part": 0}, {"target_bytes": "1MB"}, []]
+)
+def test_invalid_shard_options(options):
+    with pytest.raises(ValueError):
+        validate_shard_options(options)
+
+
+def test_shard_prefix():
+    assert shard_prefix("obfuscated/data.csv.gz") == "obfuscated/data/"
+    assert shard_prefix("data.parquet") == "data/"
+
+
+def test_lambda_writes_parts_and_manifest(s3_bucket, tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    rule = {
+        "pii_fields": ["name"],
+        "output_compression": "gzip",
+        "shard": {"rows_per_part": 4},
+    }
+    path.write_text(json.dumps({"default": rule}))
+    monkeypatch.setenv("OBFUSCATION_RULES", str(path))
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/big.csv", Body=CSV.replace("***", "Ann"))
+
+    response = lambda_handler(_event(s3_bucket, "in/big.csv"), context=None)
+
+    assert response["statusCode"] == 200
+    manifest = json.loads(
+        s3.get_object(Bucket=s3_bucket, Key="obfuscated/big/manifest.json")[
+            "Body"
+        ].read()
+    )
+    assert manifest["total_rows"] == 10
+    assert manifest["compression"] == "gzip"
+    assert [p["key"] for p in manifest["parts"]] == [
+        f"obfuscated/big/part-0000{i}.csv.gz" for i in range(3)
+    ]
+    for part in manifest["parts"]:
+        body = s3.get_object(Bucket=s3_bucket, Key=part["key"])["Body"].read()
+        assert hashlib.sha256(body).hexdigest() == part["sha256"]
+        assert b"Ann" not in gzip.decompress(body)
+
+    # The manifest is the output: a second run does not rewrite the parts
+    event = dict(_event(s3_bucket, "in/big.csv"), force=False)
+    again = lambda_handler(event, context=None)
+    assert again["statusCode"] in (200, 409)
+    assert "up to date" in again["body"] or "already exists" in again["body"]
+
+
+def test_rerun_with_fewer_parts_deletes_stale_parts(s3_bucket, tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    monkeypatch.setenv("OBFUSCATION_RULES", str(path))
+    # Pick up the rule change on the second run
+    monkeypatch.setenv("OBFUSCATION_RULES_TTL", "0")
+    s3 = get_s3_client()
+    s3.put_object(Bucket=s3_bucket, Key="in/big.csv", Body=CSV.replace("***", "Ann"))
+    # Not a part of this output: left alone
+    s3.put_object(Bucket=s3_bucket, Key="obfuscated/big/part-notes/x", Body=b"x")
+
+    for rows_per_part in (2, 4):
+        rule = {"pii_fields": ["name"], "shard": {"rows_per_part": rows_per_part}}
+        path.write_text(json.dumps({"default": rule}))
+        response = lambda_handler(_event(s3_bucket, "in/big.csv"), context=None)
+        assert response["statusCode"] == 200
+
+    listed = s3.list_objects_v2(Bucket=s3_bucket, Prefix="obfuscated/big/")
+    manifest = json.loads(
+        s3.get_object(Bucket=s3_bucket, Key="obfuscated/big/manifest.json")[
+            "Body"
+        ].read()
+    )
+    assert sorted(obj["Key"] for obj in listed["Contents"]) == sorted(
+        [part["key"] for part in manifest["parts"]]
+        + ["obfuscated/big/manifest.json", "obfuscated/big/part-notes/x"]
+    )
+    assert len(manifest["parts"]) == 3
@@ -0,0 +1,16 @@
+from shm_transport import SharedBuffer, read_ref, shared_memory_available, write_ref
+
+
+def test_refs_read_and_write_ranges():
+    with SharedBuffer.from_bytes(b"header\nrow one\nrow two\n") as shared:
+        assert read_ref(shared.ref(0, 7), shared.ref(15, 23)) == b"header\nrow two\n"
+
+    with SharedBuffer(16) as target:
+        assert write_ref(target.ref(4, 10), b"abc") == 3
+        assert target.read(4, 7) == b"abc"
+        # Too large for the 6-byte region: the caller keeps the data
+        assert write_ref(target.ref(4, 10), b"too long") is None
+
+
+def test_shared_memory_available():
+    assert shared_memory_available() is True
@@ -0,0 +1,151 @@
+import gzip
+import json
+from datetime import date
+from decimal import Decimal
+
+import pyarrow as pa
+import pytest
+
+from columnar import read_table, write_table
+from erasure import SubjectSet, erase_from_prefix, erase_rows
+from s3_utils import get_s3_client
+from subject_index import (
+    BloomFilter,
+    build_object_index,
+    entry_may_contain,
+    list_index_entries,
+    objects_for_subjects,
+    update_index,
+)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    for i in range(1000):
+        bloom.add(str(i))
+    restored = BloomFilter.from_dict(json.loads(json.dumps(bloom.to_dict())))
+    assert all(str(i) in restored for i in range(1000))
+    false_positives = sum(f"x{i}" in restored for i in range(10000))
+    assert false_positives < 300
+
+
+def test_parquet_entry_uses_row_group_statistics():
+    table = pa.table({"student_id": list(range(100, 200)), "name": ["n"] * 100})
+    entry = build_object_index(
+        write_table(table, "parquet", {"row_group_size": 50}), "parquet", "STUDENT_ID"
+    )
+    assert entry["id_field"] == "student_id"
+    assert entry["rows"] == 100 and entry["distinct_ids"] == 100
+    assert [(g["min"], g["max"]) for g in entry["row_groups"]] == [
+        (100, 149),
+        (150, 199),
+    ]
+    assert entry_may_contain(entry, SubjectSet(["120"]))
+    # Out of every row group's range: ruled out without the Bloom filter
+    assert not entry_may_contain(entry, SubjectSet(["99", "200", "abc"]))
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_index_and_erasure_agree_on_typed_ids(file_format):
+    content = write_table(pa.table({"id": [5, 7, 12], "name": ["n"] * 3}), file_format)
+    entry = build_object_index(content, file_format, "id")
+    subjects = SubjectSet(["007"])
+
+    # Erasure casts '007' to the column type and matches 7
+    assert erase_rows(content, file_format, "id", subjects)[1] == 1
+    assert entry_may_contain(entry, subjects)
+    assert not entry_may_contain(entry, SubjectSet(["008"]))
+
+
+def test_stats_that_do_not_sort_as_strings_are_not_used_for_pruning():
+    prices = pa.array([Decimal("9.50"), Decimal("9.75"), Decimal("10.25")])
+    days = pa.array([date(2024, 1, 9), date(2024, 1, 10), date(2024, 2, 1)])
+    for column in (prices, days):
+        content = write_table(pa.table({"id": column}), "parquet")
+        entry = build_object_index(content, "parquet", "id")
+        subject = SubjectSet([str(column[1].as_py())])
+
+        assert entry["row_groups"][0]["min"] is None
+        assert erase_rows(content, "parquet", "id", subject)[1] == 1
+        assert entry_may_contain(entry, subject)
+
+
+def test_object_without_id_field_holds_no_subjects():
+    entry = build_object_index("name,email\nAnn,a@x.com\n", "csv", "student_id")
+    assert entry["bloom"] is None
+    assert not entry_may_contain(entry, SubjectSet(["1"]))
+
+
+@pytest.fixture
+def indexed_bucket(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(
+        Bucket=s3_bucket, Key="data/a.csv", Body=b"student_id,name\n1,Ann\n2,Bob\n"
+    )
+    s3.put_object(
+        Bucket=s3_bucket,
+        Key="data/b.ndjson.gz",
+        Body=gzip.compress(b'{"student_id": 3}\n{"student_id": 4}\n'),
+    )
+    s3.put_object(
+        Bucket=s3_bucket,
+        Key="data/c.parquet",
+        Body=write_table(pa.table({"student_id": [5, 6]}), "parquet"),
+    )
+    s3.put_object(Bucket=s3_bucket, Key="data/readme.md", Body=b"not data")
+    return s3, s3_bucket
+
+
+def test_index_is_updated_incrementally(indexed_bucket):
+    s3, bucket = indexed_bucket
+
+    first = update_index(s3, bucket, "data", "student_id")
+    assert sorted(first["indexed"]) == [
+        "data/a.csv",
+        "data/b.ndjson.gz",
+        "data/c.parquet",
+    ]
+
+    s3.put_object(Bucket=bucket, Key="data/a.csv", Body=b"student_id\n7\n")
+    s3.delete_object(Bucket=bucket, Key="data/c.parquet")
+    second = update_index(s3, bucket, "data/", "student_id")
+
+    assert second == {"indexed": ["data/a.csv"], "unchanged": 1, "removed": 2}
+    assert sorted(
+        key for key, _ in list_index_entries(s3, bucket, "data", "student_id")
+    ) == [
+        "data/a.csv",
+        "data/b.ndjson.gz",
+    ]
+
+
+def test_lookup_touches_only_matching_and_unindexed_objects(indexed_bucket):
+    s3, bucket = indexed_bucket
+    update_index(s3, bucket, "data", "student_id")
+    s3.put_object(Bucket=bucket, Key="data/new.csv", Body=b"student_id\n9\n")
+
+    candidates = objects_for_subjects(
+        s3, bucket, "data", "student_id", SubjectSet(["4"])
+    )
+
+    assert sorted(candidates) == ["data/b.ndjson.gz", "data/new.csv"]
+
+
+def test_erase_from_prefix_rewrites_in_place_and_reindexes(indexed_bucket):
+    s3, bucket = indexed_bucket
+    update_index(s3, bucket, "data", "student_id")
+
+    results = erase_from_prefix(
+        s3, bucket, "data", "student_id", SubjectSet(["2", "6"])
+    )
+
+    assert results == {"data/a.csv": 1, "data/c.parquet": 1}
+    body = s3.get_object(Bucket=bucket, Key="data/a.csv")["Body"].read()
+    assert body == b"student_id,name\r\n1,Ann\r\n"
+    parquet = s3.get_object(Bucket=bucket, Key="data/c.parquet")["Body"].read()
+    assert read_table(parquet, "parquet").column("student_id").to_pylist() == [5]
+    # The index follows the rewritten objects: nothing left to find
+    assert (
+        objects_for_subjects(s3, bucket, "data", "student_id", SubjectSet(["2", "6"]))
+        == {}
+    )
@@ -0,0 +1,108 @@
+import pytest
+from botocore.awsrequest import AWSResponse
+
+import throttling
+from s3_utils import _new_client, safe_get_s3_object
+from throttling import TokenBucket, emit_s3_metrics, throttle
+
+SLOW_DOWN = (
+    b"<?xml version='1.0' encoding='UTF-8'?><Error><Code>SlowDown</Code>"
+    b"<Message>Please reduce your request rate.</Message></Error>"
+)
+
+
+class _Raw:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+@pytest.fixture(autouse=True)
+def fresh_throttle(monkeypatch):
+    emitted = []
+    monkeypatch.setattr(throttling, "emit", lambda *a, **k: emitted.append((a, k)))
+    throttle.reset()
+    yield emitted
+    throttle.reset()
+
+
+def test_token_bucket_waits_and_adapts(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(throttling.time, "sleep", sleeps.append)
+    bucket = TokenBucket(rate=10, burst=1)
+
+    assert bucket.acquire() == 0
+    assert 0.09 < bucket.acquire() < 0.12
+    assert len(sleeps) == 1
+
+    assert bucket.throttled()
+    assert bucket.rate == 5
+    bucket.succeeded()
+    assert bucket.rate == pytest.approx(5.2)
+    for _ in range(1000):
+        bucket.succeeded()
+    assert bucket.rate == 10  # never above the configured rate
+
+
+def test_slow_down_is_retried_and_counted(s3_bucket, fresh_throttle):
+    s3 = _new_client()
+    s3.put_object(Bucket=s3_bucket, Key="hot/data.csv", Body=b"id\n1\n")
+    responses = [AWSResponse("https://s3", 503, {}, _Raw(SLOW_DOWN))]
+
+    def slow_down_once(request, **kwargs):
+        return responses.pop() if responses else None
+
+    s3.meta.events.register_first("before-send.s3.GetObject", slow_down_once)
+
+    assert safe_get_s3_object(s3, s3_bucket, "hot/data.csv") == b"id\n1\n"
+
+    counts = emit_s3_metrics()
+    assert (counts["requests"], counts["retries"], counts["throttles"]) == (2, 1, 1)
+    # Only the throttled prefix was slowed down
+    assert list(counts["throttled_prefixes"]) == [f"{s3_bucket}/hot"]
+    ((args, kwargs),) = fresh_throttle
+    assert args[0]["S3Throttles"] == 1 and args[0]["S3Retries"] == 1
+    assert emit_s3_metrics()["requests"] == 0  # counters were reset
+
+
+def test_throttles_within_the_cooldown_decrease_once(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(throttling.time, "monotonic", lambda: clock[0])
+    bucket = TokenBucket(rate=3500)
+
+    # e.g. ten concurrent requests answered with SlowDown together
+    assert [bucket.throttled() for _ in range(10)].count(True) == 1
+    assert bucket.rate == 1750
+
+    clock[0] += throttling.THROTTLE_COOLDOWN
+    assert bucket.throttled()
+    assert bucket.rate == 875
+
+
+def test_only_successful_calls_recover_the_rate():
+    prefix = ("bucket", "hot")
+    bucket = throttle.bucket(prefix)
+    bucket.throttled()
+    context = {"s3_prefix": prefix}
+
+    # after-call is emitted for the final SlowDown too, before it is raised
+    throttle.on_success(context, http_response=AWSResponse("https://s3", 503, {}, None))
+    assert bucket.rate == throttle.rate / 2
+
+    throttle.on_success(context, http_response=AWSResponse("https://s3", 200, {}, None))
+    assert bucket.rate > throttle.rate / 2
+
+
+def test_buckets_are_bounded_and_throttled_prefixes_kept_longest():
+    limited = throttling.S3Throttle(rate=100, max_buckets=8)
+    hot = limited.bucket(("bucket", "hot"))
+    hot.throttled()
+    for i in range(50):
+        limited.bucket(("bucket", f"p{i}"))
+
+    assert len(limited._buckets) <= 8
+    # A recovered prefix starts again from a new, full bucket
+    assert ("bucket", "p0") not in limited._buckets
+    assert limited.snapshot()["throttled_prefixes"] == {"bucket/hot": 50.0}
@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+import threading
+
+import pyarrow as pa
+import pytest
+
+import tokenization
+from columnar import obfuscate_columnar, read_table, write_table
+from main import obfuscate_handler
+from obfuscator import obfuscate_json, obfuscate_ndjson
+from s3_utils import get_s3_client
+from tokenization import TOKEN_PREFIX, SQLiteVault, TokenVault, get_token_vault
+
+
+@pytest.fixture(autouse=True)
+def vault_location(tmp_path, monkeypatch):
+    monkeypatch.setattr(tokenization, "_vaults", {})
+    location = str(tmp_path / "vault" / "tokens.sqlite3")
+    monkeypatch.setenv("TOKEN_VAULT", location)
+    return location
+
+
+def test_tokens_are_stable_reversible_and_batched(vault_location, monkeypatch):
+    vault = SQLiteVault(vault_location)
+    calls = []
+    find_tokens = vault._find_tokens
+    monkeypatch.setattr(
+        vault,
+        "_find_tokens",
+        lambda values: calls.append(len(values)) or find_tokens(values),
+    )
+    values = [f"user{i}@example.com" for i in range(1200)] * 2
+
+    tokens = vault.tokenize(values)
+
+    # One lookup for the distinct values, one read-back after the insert
+    assert calls == [1200, 1200]
+    assert tokens[:1200] == tokens[1200:]
+    assert len(set(tokens)) == 1200 and tokens[0].startswith(TOKEN_PREFIX)
+    assert vault.tokenize(values[:10]) == tokens[:10]
+    assert len(calls) == 2  # served by the LRU cache
+    # A new process (no cache) sees the same tokens and can reverse them
+    fresh = SQLiteVault(vault_location, cache_size=0)
+    assert fresh.tokenize(values[:3]) == tokens[:3]
+    assert fresh.detokenize(tokens[:3] + ["tok_unknown"]) == values[:3] + [None]
+
+
+def test_concurrent_writers_agree_on_one_token(vault_location):
+    values = [str(i) for i in range(300)]
+    results = []
+
+    def worker():
+        # Separate vaults behave like separate processes sharing the file
+        results.append(SQLiteVault(vault_location, cache_size=0).tokenize(values))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4
+    assert all(result == results[0] for result in results)
+
+
+def test_vault_must_be_configured(monkeypatch):
+    monkeypatch.delenv("TOKEN_VAULT")
+    with pytest.raises(ValueError, match="TOKEN_VAULT"):
+        get_token_vault()
+    monkeypatch.setenv("TOKEN_VAULT", "redis://localhost")
+    with pytest.raises(ValueError, match="Unsupported token vault 'redis'"):
+        get_token_vault()
+
+
+def test_handler_tokenizes_csv(s3_bucket):
+    s3 = get_s3_client()
+    s3.put_object(
+        Bucket=s3_bucket,
+        Key="people.csv",
+        Body=b"id,email\n1,a@x.com\n2,\n3,a@x.com\n",
+    )
+    payload = {
+        "file_to_obfuscate": f"s3://{s3_bucket}/people.csv",
+        "pii_fields": ["email"],
+        "strategy": "tokenize",
+    }
+
+    output = obfuscate_handler(json.dumps(payload), s3=s3)
+
+    rows = list(csv.DictReader(io.StringIO(output.decode("utf-8"))))
+    emails = [row["email"] for row in rows]
+    assert emails[0] == emails[2] and emails[0].startswith(TOKEN_PREFIX)
+    assert emails[1] == ""
+    assert get_token_vault().detokenize([emails[0]]) == ["a@x.com"]
+
+
+def test_json_and_ndjson_tokens_match():
+    ndjson = obfuscate_ndjson(
+        '{"Email": "a@x.com", "n": 1}\n{"email": 42}\n', ["email"], "tokenize"
+    )
+    records = [json.loads(line) for line in ndjson.decode().splitlines()]
+    document = json.loads(
+        obfuscate_json('[{"email": "a@x.com"}]', ["EMAIL", "email"], "tokenize")
+    )
+
+    assert records[0]["Email"] == document[0]["email"]
+    assert records[0]["n"] == 1
+    assert get_token_vault().detokenize([records[1]["email"]]) == ["42"]
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow", "orc"])
+def test_columnar_tokens_keep_nulls(file_format):
+    table = pa.table({"id": [1, 2, 3, 4], "email": ["a@x", None, "a@x", "b@x"]})
+    content = write_table(table, file_format, {"row_group_size": 2})
+    result = read_table(
+        obfuscate_columnar(content, ["email"], file_format, "tokenize"), file_format
+    )
+
+    emails = result.column("email").to_pylist()
+    assert emails[1] is None and emails[0] == emails[2] != emails[3]
+    assert get_token_vault().detokenize([emails[0], emails[3]]) == ["a@x", "b@x"]
+    assert result.column("id").to_pylist() == [1, 2, 3, 4]
+
+
+def test_vault_backends_must_implement_the_batch_operations():
+    class Incomplete(TokenVault):
+        def _find_tokens(self, values):
+            return {}
+
+    with pytest.raises(TypeError, match="_find_values"):
+        Incomplete()
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+import tuning
+from tuning import MB
+
+
+@pytest.fixture(autouse=True)
+def fresh_tuning(monkeypatch):
+    for name in (
+        "AWS_LAMBDA_FUNCTION_MEMORY_SIZE",
+        "AUTO_TUNE",
+        "CSV_CHUNK_SIZE",
+        "CSV_PARALLEL_WORKERS",
+        "CHECKPOINT_SEGMENT_SIZE",
+        "SHARD_UPLOAD_WORKERS",
+    ):
+        monkeypatch.delenv(name, raising=False)
+    emitted = []
+    monkeypatch.setattr(
+        tuning, "emit", lambda metrics, *args, **kwargs: emitted.append(metrics)
+    )
+    tuning.reset()
+    yield emitted
+    tuning.reset()
+
+
+def test_lambda_memory_setting_takes_precedence(monkeypatch):
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "512")
+    resources = tuning.detect_resources()
+    assert resources.memory_bytes == 512 * MB
+    assert resources.source == "lambda"
+    # 512 MB / 8 = 64 MB segments
+    assert tuning.checkpoint_segment_size() == 64 * MB
+
+
+@pytest.mark.parametrize(
+    "files, expected",
+    [
+        ({"/sys/fs/cgroup/memory.max": "268435456"}, 256 * MB),
+        ({"/sys/fs/cgroup/memory.max": "max"}, None),
+        ({"/sys/fs/cgroup/memory/memory.limit_in_bytes": "134217728"}, 128 * MB),
+        ({"/sys/fs/cgroup/memory/memory.limit_in_bytes": str(1 << 62)}, None),
+    ],
+)
+def test_cgroup_memory_limit(monkeypatch, files, expected):
+    monkeypatch.setattr(tuning, "_read", files.get)
+    assert tuning._cgroup_memory_limit() == expected
+
+
+@pytest.mark.parametrize(
+    "files, expected",
+    [
+        ({"/sys/fs/cgroup/cpu.max": "150000 100000"}, 2),
+        ({"/sys/fs/cgroup/cpu.max": "max 100000"}, None),
+        (
+            {
+                "/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "50000",
+                "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000",
+            },
+            1,
+        ),
+    ],
+)
+def test_cgroup_cpu_limit(monkeypatch, files, expected):
+    monkeypatch.setattr(tuning, "_read", files.get)
+    assert tuning._cgroup_cpu_limit() == expected
+
+
+def test_overrides_and_static_defaults(monkeypatch):
+    monkeypatch.setenv("CSV_CHUNK_SIZE", "1000")
+    monkeypatch.setenv("SHARD_UPLOAD_WORKERS", "3")
+    assert tuning.csv_chunk_size() == 1000
+    assert tuning.upload_workers() == 3
+
+    monkeypatch.setenv("AUTO_TUNE", "false")
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "128")
+    assert tuning.checkpoint_segment_size() == 64 * MB
+    assert tuning.parquet_row_group_size() == 128 * 1024
+
+
+def test_chunk_size_follows_observed_throughput(monkeypatch):
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "10240")
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 1})
+    monkeypatch.setattr(tuning, "_cgroup_cpu_limit", lambda: None)
+    assert tuning.csv_chunk_size() == 16 * MB
+    # 20 MB/s for 2 seconds per chunk
+    tuning.throughput.observe("csv", 20 * MB, 1.0)
+    assert tuning.csv_chunk_size() == 40 * MB
+    # Never below the floor however slow the last run was
+    tuning.throughput.reset()
+    tuning.throughput.observe("csv", 1, 1.0)
+    assert tuning.csv_chunk_size() == 4 * MB
+
+
+def test_workers_limited_by_memory(monkeypatch):
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "256")
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)))
+    monkeypatch.setattr(tuning, "_cgroup_cpu_limit", lambda: None)
+    # 256 MB / (6 * 16 MB) → 2 workers even with 8 CPUs
+    assert tuning.csv_workers(16 * MB) == 2
+
+
+def test_decisions_are_emitted_when_they_change(monkeypatch, fresh_tuning):
+    tuning.upload_workers()
+    tuning.upload_workers()
+    assert fresh_tuning == [{"UploadWorkers": tuning.upload_workers()}]
+
+    monkeypatch.setenv("SHARD_UPLOAD_WORKERS", "9")
+    tuning.upload_workers()
+    assert fresh_tuning[-1] == {"UploadWorkers": 9}
+    assert len(fresh_tuning) == 2